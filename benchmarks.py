@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Performance benchmarks for the shared scanning/storage modules
+Usage: python benchmarks.py [parse] [load] [search] [store] [journal] [formats]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from records import MODE_ENTREE, MODE_SORTIE, MODE_RETOUR, SortieData, RecordIndex, row_id, search_blob
+from columnar import ColumnStore, records_memory
+from excel_io import write_records_workbook, read_movement_file
+from search_index import TrigramIndex
+from journal import ScanJournal
+from storage_formats import FORMATS, StorageFormatError
+from qr_parsing import parse_payload, parse_order_payload
+
+def sample_payloads(count):
+    """Build a mixed day of scans covering every payload format"""
+    payloads = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            payloads.append(f"*VMSDZ06CUKI{i:06d}*\nMOTOCYCLE CUKI -I-\nCUKI\nbleu nuit/ blanc\n\nCUKI I 06/2025")
+        elif kind == 1:
+            payloads.append(f"REF{i:06d}\nVMS\nMOTOCYCLE\nCH{i:08d}\nrouge\nLOT1\n\nREL")
+        elif kind == 2:
+            payloads.append(f"*VMSDZ06CUKI{i:06d}*MOTOCYCLE CUKI -II-CUKI")
+        else:
+            payloads.append(f"CH{i:08d}")
+    return payloads
+
+def bench_parse(count=20000, repeat=5):
+    """Parses per second for each data type over a mixed day of scans"""
+    payloads = sample_payloads(count)
+    print(f"Parsing {count} payloads (best of {repeat})")
+    for mode in (MODE_ENTREE, MODE_SORTIE, MODE_RETOUR):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for payload in payloads:
+                parse_payload(payload, mode)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"  {mode:<8} {count / best:>12,.0f} parses/s  ({best * 1000:.1f} ms)")
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for payload in payloads:
+            parse_order_payload(payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {'Commande':<8} {count / best:>12,.0f} parses/s  ({best * 1000:.1f} ms)")
+
+def sample_sortie_records(count):
+    """A Sortie file of count movements over a month"""
+    return [SortieData(Date=f"{i % 28 + 1:02d}/10/2025", Heure=f"{i % 24:02d}:{i % 60:02d}",
+                       DESIGNATION=f"MOTOCYCLE {i % 40}", N_CHASSIS=f"VMSDZ{i:08d}",
+                       ID_CLIENT=str(i % 9999), NOM_PRENOM=f"CLIENT {i % 999}", WILAYA=str(i % 58 + 1))
+            for i in range(count)]
+
+def bench_load(count=100000):
+    """Time to load a Sortie reference workbook (read, filter, parse Date/Heure)"""
+    handle, filename = tempfile.mkstemp(suffix=".xlsx")
+    os.close(handle)
+    try:
+        write_records_workbook(filename, sample_sortie_records(count), MODE_SORTIE)
+        print(f"Loading a {count}-row Sortie workbook")
+        start = time.perf_counter()
+        records, timestamps = read_movement_file(filename, MODE_SORTIE)
+        elapsed = time.perf_counter() - start
+        print(f"  {len(records)} records in {elapsed:.2f} s  ({count / elapsed:,.0f} rows/s)")
+    finally:
+        os.remove(filename)
+
+def bench_search(count=500000, queries=("vmsdz0012", "client 77", "10:3", "zzz")):
+    """Trigram index: build time and query time over a large session"""
+    records = sample_sortie_records(count)
+    index = TrigramIndex()
+    start = time.perf_counter()
+    index.ensure(records)
+    print(f"Indexing {count} Sortie records: {time.perf_counter() - start:.1f} s")
+    for query in queries:
+        start = time.perf_counter()
+        found = index.search(query)
+        elapsed = time.perf_counter() - start
+        print(f"  {query!r:<12} {len(found):>8} rows  {elapsed * 1000:.2f} ms")
+
+def bench_store(count=100000, query="client 77"):
+    """Column store against a list of dataclasses: memory per row, scan search, filter"""
+    records = sample_sortie_records(count)
+    print(f"{count} Sortie records")
+    print(f"  dataclass list      {records_memory(records) / count:>8.0f} bytes/row")
+    start = time.perf_counter()
+    found = [i for i, record in enumerate(records) if query in search_blob(record)]
+    print(f"  list search         {(time.perf_counter() - start) * 1000:>8.1f} ms  ({len(found)} rows)")
+
+    store = ColumnStore(SortieData, records)
+    del records
+    store.block.views.clear()  # Rows loaded but never shown
+    print(f"  column store        {store.memory_usage() / count:>8.0f} bytes/row (columns only)")
+    for record in store:
+        row_id(record)
+    print(f"  column store        {store.memory_usage() / count:>8.0f} bytes/row (with a view per row)")
+    start = time.perf_counter()
+    found = store.search(query)
+    print(f"  column search       {(time.perf_counter() - start) * 1000:>8.1f} ms  ({len(found)} rows)")
+    start = time.perf_counter()
+    found = store.equal('WILAYA', "16")
+    print(f"  WILAYA == '16'      {(time.perf_counter() - start) * 1000:>8.1f} ms  ({len(found)} rows)")
+
+def bench_journal(count=100000):
+    """Cost of the write-ahead journal on the scan path, and of a compaction"""
+    records = sample_sortie_records(count)
+    with tempfile.TemporaryDirectory() as folder:
+        journal = ScanJournal(os.path.join(folder, "bench.journal"), write_records_workbook)
+        journal.start()
+        store = ColumnStore(SortieData)
+        index = RecordIndex()
+        times = []
+        for record in records:
+            store.append(record)
+            index.add(record)
+            start = time.perf_counter()
+            journal.add(record)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        print(f"{count} scans journaled: median {times[count // 2] * 1e6:.1f} us, "
+              f"99th percentile {times[count * 99 // 100] * 1e6:.1f} us, "
+              f"{sum(1 for elapsed in times if elapsed > 0.001)} over 1 ms")
+        index.followers.append(journal)
+        journal.mark_saved(os.path.join(folder, "bench.xlsx"))
+        index.add(store[0])  # One unsaved change
+        start = time.perf_counter()
+        journal.compact()
+        print(f"  compaction (xlsx + journal) {time.perf_counter() - start:.2f} s")
+        journal.close()
+
+def bench_formats(counts=(10000, 100000, 1000000)):
+    """Save and load times of a Sortie session in each storage format"""
+    for count in counts:
+        store = ColumnStore(SortieData, sample_sortie_records(count))
+        print(f"{count} Sortie rows")
+        with tempfile.TemporaryDirectory() as folder:
+            for storage_format in FORMATS:
+                filename = os.path.join(folder, "bench" + storage_format.extensions[0])
+                try:
+                    start = time.perf_counter()
+                    storage_format.write(filename, store, MODE_SORTIE)
+                    saved = time.perf_counter() - start
+                    start = time.perf_counter()
+                    loaded = ColumnStore(SortieData, storage_format.read(filename, MODE_SORTIE))
+                    load = time.perf_counter() - start
+                except StorageFormatError as e:
+                    print(f"  {storage_format.name:<8} {e}")
+                    continue
+                assert len(loaded) == count
+                size = os.path.getsize(filename) / 1e6
+                print(f"  {storage_format.name:<8} save {saved:>7.2f} s  load {load:>7.2f} s  {size:>7.1f} MB")
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "load": bench_load,
+    "search": bench_search,
+    "store": bench_store,
+    "journal": bench_journal,
+    "formats": bench_formats,
+}
+
+def main():
+    """Run the benchmarks named on the command line (all by default)"""
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name} (available: {', '.join(BENCHMARKS)})")
+            sys.exit(1)
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Dictionary encoding of repetitive field values
+WILAYA, DESIGNATION/Designation, Fournisseur and Date/DATE take few distinct
+values in a day. Each has one dictionary shared by the session store
+(columnar.py), the Sortie/Retour file loader and the Excel writer: every
+distinct value is held once and rows keep an integer code
+"""
+
+class Dictionary:
+    """Distinct values of a categorical column, each with an integer code"""
+
+    def __init__(self, values=()):
+        self.values = []  # code -> value
+        self.codes = {}  # (type, value) -> code; the type keeps 1, 1.0 and True apart
+        self.lower = []  # code -> lowercase text, as searched
+        for value in values:
+            self.encode(value)
+
+    def encode(self, value):
+        key = (value.__class__, value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.values)
+            self.values.append(value)
+            self.lower.append(str(value or "").lower())
+        return code
+
+    def find(self, value):
+        """Code of a value (None if it was never encoded)"""
+        return self.codes.get((value.__class__, value))
+
+    def intern(self, value):
+        """The shared copy of an equal value"""
+        return self.values[self.encode(value)]
+
+    def __len__(self):
+        return len(self.values)
+
+# Field name -> shared dictionary name (same values across data types)
+SHARED_FIELDS = {
+    'WILAYA': 'wilaya',
+    'DESIGNATION': 'designation',
+    'Designation': 'designation',
+    'Fournisseur': 'fournisseur',
+    'Date': 'date',
+    'DATE': 'date',
+}
+
+_shared = {}  # Dictionary name -> Dictionary
+
+def shared_dictionary(field):
+    """Dictionary shared by every column of this field (None if the field is not shared)"""
+    name = SHARED_FIELDS.get(field)
+    if name is None:
+        return None
+    dictionary = _shared.get(name)
+    if dictionary is None:
+        dictionary = _shared[name] = Dictionary()
+    return dictionary
+
+def register_values(field, values):
+    """Known values of a field (the 58 wilayas, ...), encoded up front"""
+    dictionary = shared_dictionary(field)
+    for value in values:
+        dictionary.encode(value)
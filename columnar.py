@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar session store
+Backs products_data (Mouvement Stock) and orders_data (Préparation
+Commandes): field values live in typed columns, repetitive fields are
+dictionary-encoded, and the records handed out are views on a row of the
+columns. Searches, equality filters, counts and exports run on the columns
+"""
+
+import sys
+from array import array
+from collections import namedtuple
+from dataclasses import fields
+from operator import attrgetter, itemgetter
+
+import numpy as np
+
+from categories import Dictionary, shared_dictionary
+from records import new_row_id
+
+# Rows a save is writing (ColumnStore.save_point)
+SavePoint = namedtuple('SavePoint', 'block length rewrite moves')
+
+def _slot_view(values, dtype):
+    """numpy view on an array('q'/'b'); must not outlive the call using it"""
+    return np.frombuffer(values, dtype=dtype) if len(values) else np.zeros(0, dtype=dtype)
+
+class CategoryColumn:
+    """Dictionary-encoded column: one int64 code per slot"""
+
+    def __init__(self, dictionary=None):
+        self.dictionary = dictionary or Dictionary()  # Shared with other columns of the field (categories.py)
+        self.codes = array('q')
+
+    def get(self, slot):
+        return self.dictionary.values[self.codes[slot]]
+
+    def set(self, slot, value):
+        self.codes[slot] = self.dictionary.encode(value)
+
+    def append(self, value):
+        self.codes.append(self.dictionary.encode(value))
+
+    def extend(self, values):
+        encode = self.dictionary.encode
+        self.codes.extend([encode(value) for value in values])
+
+    def take(self, slots):
+        """Values of the slots, decoded in one numpy take"""
+        values = np.empty(len(self.dictionary), dtype=object)
+        values[:] = self.dictionary.values
+        return values[_slot_view(self.codes, np.int64)[slots]].tolist()
+
+    def matches(self, text, slots):
+        """Mask over slots: lowercase text of the value contains text"""
+        hits = np.fromiter((text in lower for lower in self.dictionary.lower), dtype=bool,
+                           count=len(self.dictionary))
+        return hits[_slot_view(self.codes, np.int64)[slots]]
+
+    def equal(self, value, slots):
+        code = self.dictionary.find(value)
+        if code is None:
+            return np.zeros(len(slots), dtype=bool)
+        return _slot_view(self.codes, np.int64)[slots] == code
+
+    def nbytes(self, seen):
+        size = sys.getsizeof(self.codes) + sys.getsizeof(self.dictionary.values)
+        size += sys.getsizeof(self.dictionary.codes) + sys.getsizeof(self.dictionary.lower)
+        for value in self.dictionary.values:
+            size += _object_size(value, seen) + sys.getsizeof((None, None))
+        return size + sum(_object_size(lower, seen) for lower in self.dictionary.lower)
+
+class TextColumn:
+    """Mostly distinct values (references, chassis numbers) kept as a list"""
+
+    def __init__(self):
+        self.values = []
+        self.lower = None  # Lowercase texts, built on the first search
+
+    def get(self, slot):
+        return self.values[slot]
+
+    def set(self, slot, value):
+        self.values[slot] = value
+        if self.lower is not None:
+            self.lower[slot] = str(value or "").lower()
+
+    def append(self, value):
+        self.values.append(value)
+        if self.lower is not None:
+            self.lower.append(str(value or "").lower())
+
+    def extend(self, values):
+        self.values.extend(values)
+        if self.lower is not None:
+            self.lower.extend(str(value or "").lower() for value in values)
+
+    def take(self, slots):
+        values = self.values
+        return [values[slot] for slot in slots.tolist()]
+
+    def matches(self, text, slots):
+        if self.lower is None:
+            self.lower = [str(value or "").lower() for value in self.values]
+        hits = np.fromiter((text in lower for lower in self.lower), dtype=bool, count=len(self.lower))
+        return hits[slots]
+
+    def equal(self, value, slots):
+        values = self.values
+        return np.fromiter((values[slot] == value for slot in slots.tolist()), dtype=bool, count=len(slots))
+
+    def nbytes(self, seen):
+        size = sys.getsizeof(self.values) + sum(_object_size(value, seen) for value in self.values)
+        if self.lower is not None:
+            size += sys.getsizeof(self.lower) + sum(_object_size(lower, seen) for lower in self.lower)
+        return size
+
+class NumberColumn:
+    """int (QTE) or bool (PREPARED) column in a typed array
+
+    A value of another type turns the column into a plain list, so any
+    value can still be stored.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind  # int or bool
+        self.values = array('q' if kind is int else 'b')
+        self.typed = True
+
+    def get(self, slot):
+        value = self.values[slot]
+        return self.kind(value) if self.typed else value
+
+    def _check(self, value):
+        if self.typed and type(value) is not self.kind:
+            self.values = [self.kind(value) for value in self.values]
+            self.typed = False
+
+    def set(self, slot, value):
+        self._check(value)
+        self.values[slot] = value
+
+    def append(self, value):
+        self._check(value)
+        self.values.append(value)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def take(self, slots):
+        values = self.values
+        if self.typed:
+            kind = self.kind
+            return [kind(values[slot]) for slot in slots.tolist()]
+        return [values[slot] for slot in slots.tolist()]
+
+    def _distinct(self):
+        if self.typed:
+            numbers = _slot_view(self.values, np.int64 if self.kind is int else np.int8)
+            return numbers, [self.kind(value) for value in np.unique(numbers).tolist()]
+        return np.array(self.values, dtype=object), None
+
+    def matches(self, text, slots):
+        numbers, distinct = self._distinct()
+        if distinct is None:
+            return np.fromiter((text in str(numbers[slot] or "").lower() for slot in slots.tolist()),
+                               dtype=bool, count=len(slots))
+        hits = [value for value in distinct if text in str(value or "").lower()]
+        return np.isin(numbers[slots], hits)
+
+    def equal(self, value, slots):
+        numbers, _ = self._distinct()
+        return numbers[slots] == value
+
+    def nbytes(self, seen):
+        if self.typed:
+            return sys.getsizeof(self.values)
+        return sys.getsizeof(self.values) + sum(_object_size(value, seen) for value in self.values)
+
+def _object_size(value, seen):
+    """Size of an object counted once (strings shared between rows are not counted twice)"""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    return sys.getsizeof(value)
+
+def _make_column(record_class, field):
+    if field.type in (int, bool):
+        return NumberColumn(field.type)
+    if field.name in record_class.categorical_columns:
+        return CategoryColumn(shared_dictionary(field.name))
+    return TextColumn()
+
+class ColumnBlock:
+    """The columns of a store; rows are addressed by slot"""
+
+    def __init__(self, record_class):
+        self.columns = [_make_column(record_class, field) for field in fields(record_class)]
+        self.size = 0  # Slots in use or free
+        self.views = {}  # slot -> record view handed out
+        self.edited = set()  # Slots whose fields were assigned since the last save
+        self.ids = []  # Row id (records.row_id) of each slot
+
+    def row(self, slot):
+        return [column.get(slot) for column in self.columns]
+
+    def set_row(self, slot, values):
+        for column, value in zip(self.columns, values):
+            column.set(slot, value)
+
+    def append_row(self, values):
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self.ids.append(None)
+        self.size += 1
+        return self.size - 1
+
+    def extend_columns(self, columns, count):
+        """Append count rows given column by column; returns the first new slot"""
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+        self.ids.extend([new_row_id() for _ in range(count)])
+        self.size += count
+        return self.size - count
+
+_view_classes = {}  # Record class -> its view class
+
+def _field_property(position, name):
+    def get(view):
+        return view._block.columns[position].get(view._slot)
+
+    def set(view, value):
+        block = view._block
+        block.columns[position].set(view._slot, value)
+        block.edited.add(view._slot)
+    return property(get, set, doc=f"{name} column of the row")
+
+def view_class(record_class):
+    """Subclass of a record dataclass whose fields read and write a store row
+
+    Views are still instances of the record class (isinstance, fields(),
+    equality, repr and asdict work as before).
+    """
+    view = _view_classes.get(record_class)
+    if view is None:
+        namespace = {field.name: _field_property(position, field.name)
+                     for position, field in enumerate(fields(record_class))}
+        namespace['_row_id'] = property(lambda view: view._block.ids[view._slot], doc="Row id of the row")
+        namespace['__doc__'] = f"{record_class.__name__} stored in a ColumnStore"
+        view = _view_classes[record_class] = type(f"{record_class.__name__}View", (record_class,), namespace)
+    return view
+
+class ColumnStore:
+    """List of records of one class, stored column by column
+
+    Supports the list operations the apps use (len, iteration, indexing,
+    append/extend, item assignment and deletion, clear). A record appended
+    to the store becomes a view of its row: the same object stays valid and
+    its field assignments go to the columns. Records removed from the store
+    get their field values back and are plain dataclass instances again.
+
+    Changes since the last save are tracked (pending_changes, save_point/
+    mark_saved): appended rows and edited rows can be written alone,
+    anything else (deletions, clear) needs the whole file rewritten.
+    """
+
+    def __init__(self, record_class, records=()):
+        self.record_class = record_class
+        self.view_class = view_class(record_class)
+        self.names = [field.name for field in fields(record_class)]
+        self.values_of = attrgetter(*self.names)
+        self.clear()
+        self.extend(records)
+
+    def clear(self):
+        # Records handed out before keep reading the old block
+        self.block = ColumnBlock(self.record_class)
+        self.order = array('q')  # Slot of each row, in list order
+        self.free = []  # Slots of removed rows, reused by the next appends
+        self.reshaped = True  # Rows removed since the last save (or never saved)
+        self.saved_slots = {}  # Slot -> position in the saved file, for the saved rows
+        self.moves = 0  # Rows replaced or removed, to tell whether a save point still matches
+
+    def save_point(self, rewrite):
+        """The current rows are about to be written (the whole file if rewrite)
+
+        Edits made from now on are tracked apart, so they are still pending
+        once mark_saved(point) confirms the write.
+        """
+        point = SavePoint(self.block, len(self.order), rewrite or self.reshaped, self.moves)
+        self.block.edited = set()
+        return point
+
+    def mark_saved(self, point):
+        """The rows of a save point are in the file"""
+        if point.block is not self.block:
+            return  # Cleared since
+        if point.moves != self.moves:
+            self.reshaped = True  # Rows replaced or removed during the write: the next save rewrites
+            return
+        if point.rewrite:
+            self.saved_slots = {slot: position for position, slot in enumerate(self.order[:point.length])}
+        else:
+            for position in range(len(self.saved_slots), point.length):
+                self.saved_slots[self.order[position]] = position
+        self.reshaped = False
+
+    def pending_changes(self):
+        """(appended positions, edited positions) since the last save; None if the file must be rewritten"""
+        if self.reshaped:
+            return None
+        saved = self.saved_slots
+        edited = sorted(saved[slot] for slot in self.block.edited if slot in saved)
+        return range(len(saved), len(self.order)), edited
+
+    # --- List operations ---
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._view(slot) for slot in self.order[index]]
+        return self._view(self.order[index])
+
+    def __iter__(self):
+        view = self._view
+        for slot in self.order:
+            yield view(slot)
+
+    def append(self, record):
+        self.order.append(self._store(record))
+
+    def extend(self, records):
+        if isinstance(records, ColumnTable) and records.record_class is self.record_class:
+            # Straight into the columns, without a record per row
+            first = self.block.extend_columns(records.columns, len(records))
+            self.order.extend(range(first, first + len(records)))
+            return
+        for record in records:
+            self.append(record)
+
+    def __setitem__(self, index, record):
+        self.moves += 1
+        old_slot = self.order[index]
+        slot = self.order[index] = self._store(record)
+        self._release(old_slot)
+        if old_slot in self.saved_slots:
+            # Same row of the file, new values
+            self.saved_slots[slot] = self.saved_slots.pop(old_slot)
+            self.block.edited.add(slot)
+
+    def __delitem__(self, index):
+        self.moves += 1
+        slot = self.order[index]
+        del self.order[index]
+        self._release(slot)
+        if slot in self.saved_slots:
+            self.reshaped = True
+
+    def remove_records(self, records):
+        """Remove several records at once (one pass over the list)"""
+        slots = {record._slot for record in records if self.holds(record)}
+        if slots:
+            self.moves += 1
+            self.order = array('q', [slot for slot in self.order if slot not in slots])
+            for slot in slots:
+                self._release(slot)
+            if not slots.isdisjoint(self.saved_slots):
+                self.reshaped = True
+
+    def row_ids(self, positions=None):
+        """Row ids (records.row_id) in list order, or of the rows at positions, without making record views"""
+        ids, order = self.block.ids, self.order
+        if positions is None:
+            return [ids[slot] for slot in order]
+        return [ids[order[position]] for position in positions]
+
+    def row_values(self, position):
+        """Field values of the row at position, in field order"""
+        return self.block.row(self.order[position])
+
+    def holds(self, record):
+        """Whether this very record is in the store"""
+        return record.__dict__.get('_block') is self.block
+
+    def _view(self, slot):
+        view = self.block.views.get(slot)
+        if view is None:
+            view = self.view_class.__new__(self.view_class)
+            view.__dict__.update(_block=self.block, _slot=slot)
+            self.block.views[slot] = view
+        return view
+
+    def _store(self, record):
+        """Write a record in a free slot and turn it into a view of that slot"""
+        if self.holds(record):
+            raise ValueError("Enregistrement déjà présent dans la liste")
+        values = self.values_of(record)
+        if self.free:
+            slot = self.free.pop()
+            self.block.set_row(slot, values)
+        else:
+            slot = self.block.append_row(values)
+        if type(record) is self.record_class:
+            state = record.__dict__
+            self.block.ids[slot] = state.pop('_row_id', None) or new_row_id()
+            for name in self.names:
+                state.pop(name, None)
+            record.__class__ = self.view_class
+            state.update(_block=self.block, _slot=slot)
+            self.block.views[slot] = record
+        else:
+            # Other objects (views of another store) are copied; a new view is made on access
+            self.block.ids[slot] = new_row_id()
+        return slot
+
+    def _release(self, slot):
+        """A row left the list: its view becomes a plain record again"""
+        view = self.block.views.pop(slot, None)
+        if view is not None:
+            values = self.block.row(slot)
+            state = view.__dict__
+            del state['_block'], state['_slot']
+            view.__class__ = self.record_class
+            state.update(zip(self.names, values))
+            state['_row_id'] = self.block.ids[slot]
+        self.free.append(slot)
+
+    # --- Column operations ---
+
+    def _slots(self):
+        """Slots in list order, as a numpy copy (the order array stays resizable)"""
+        return np.array(self.order, dtype=np.int64)
+
+    def search(self, text, field=None):
+        """Positions of the rows whose lowercase text contains text
+
+        In every field, or only in the field at position field (same
+        matching as records.search_fields).
+        """
+        slots = self._slots()
+        columns = self.block.columns if field is None else [self.block.columns[field]]
+        found = np.zeros(len(slots), dtype=bool)
+        for column in columns:
+            found |= column.matches(text, slots)
+        return np.flatnonzero(found).tolist()
+
+    def equal(self, name, value):
+        """Positions of the rows whose name column equals value
+
+        On a dictionary-encoded column, one integer comparison per row.
+        """
+        slots = self._slots()
+        mask = self.block.columns[self.names.index(name)].equal(value, slots)
+        return np.flatnonzero(mask).tolist()
+
+    def count(self, name, value):
+        return len(self.equal(name, value))
+
+    def column(self, name):
+        """Values of a column, in list order"""
+        return self.block.columns[self.names.index(name)].take(self._slots())
+
+    def value_counts(self, name):
+        """{value: number of rows} of a column"""
+        column = self.block.columns[self.names.index(name)]
+        if isinstance(column, CategoryColumn):
+            codes = _slot_view(column.codes, np.int64)[self._slots()]
+            counts = np.bincount(codes, minlength=len(column.dictionary))
+            return {column.dictionary.values[code]: int(total) for code, total in enumerate(counts) if total}
+        counts = {}
+        for value in self.column(name):
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def rows(self, names=None):
+        """Value tuples in list order (Excel export), without making record views"""
+        slots = self._slots()
+        columns = [self.block.columns[self.names.index(name)] for name in (names or self.names)]
+        return zip(*[column.take(slots) for column in columns])
+
+    def snapshot(self):
+        """Immutable copy of the rows, for a save running on another thread"""
+        return RowSnapshot(self.record_class, tuple(self.rows()))
+
+    def memory_usage(self):
+        """Bytes used by the rows: columns, dictionaries and the record views handed out"""
+        seen = set()
+        size = sys.getsizeof(self.order) + sum(column.nbytes(seen) for column in self.block.columns)
+        size += sys.getsizeof(self.block.ids) + sum(sys.getsizeof(iid) for iid in self.block.ids)
+        size += sys.getsizeof(self.block.views)
+        for view in self.block.views.values():
+            size += sys.getsizeof(view) + sys.getsizeof(view.__dict__)
+        return size
+
+class RowSnapshot:
+    """Rows of a ColumnStore at one point in time (value tuples in field order)
+
+    Exported like the store itself (rows/names/len); later changes of the
+    store do not show through.
+    """
+
+    def __init__(self, record_class, rows):
+        self.record_class = record_class
+        self.names = tuple(field.name for field in fields(record_class))
+        self.values = rows
+
+    def rows(self, names=None):
+        if names is None or tuple(names) == self.names:
+            return iter(self.values)
+        return map(itemgetter(*[self.names.index(name) for name in names]), self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+class ColumnTable:
+    """Rows read column by column (value lists in field order), as read_csv gives them
+
+    Iterates as records like the other readers; ColumnStore.extend takes
+    the columns as they are.
+    """
+
+    def __init__(self, record_class, columns):
+        self.record_class = record_class
+        self.columns = columns
+
+    def __iter__(self):
+        record_class = self.record_class
+        for values in zip(*self.columns):
+            yield record_class(*values)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+def records_memory(records):
+    """Bytes used by a list of dataclass records (shared strings counted once)"""
+    seen = set()
+    size = sys.getsizeof(records)
+    for record in records:
+        size += sys.getsizeof(record) + sys.getsizeof(record.__dict__)
+        size += sum(_object_size(value, seen) for value in record.__dict__.values())
+    return size
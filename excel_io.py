@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Excel workbook layout for Entrée/Sortie/Retour and order files
+Shared by the Mouvement Stock app, Préparation Commandes and the headless
+ingest (ingest_cli.py); the other file formats are in storage_formats.py
+"""
+
+import math
+import os
+import re
+import tempfile
+import zipfile
+from collections import namedtuple
+from dataclasses import fields
+from operator import attrgetter
+from xml.sax.saxutils import escape
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from records import MODE_SORTIE, MODE_RETOUR, MODE_COMMANDE, ProductData, OrderData, RECORD_CLASSES
+from columnar import ColumnStore, RowSnapshot
+from categories import shared_dictionary
+
+SHEET_NAME = 'Sheet1'
+
+# Sortie/Retour files: title on row 1, header on row 3
+MOVEMENT_HEADER_ROW = 3
+
+_THIN = Side(style='thin')
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+TITLE_FONT = Font(bold=True, size=14)
+TITLE_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+
+def record_columns(mode):
+    """Column names of a data type, in file order"""
+    return [field.name for field in fields(RECORD_CLASSES[mode])]
+
+def movement_title(mode):
+    """Title row of a Sortie/Retour file"""
+    return f"{mode.upper()} LIVRAISON JOURNALIERE"
+
+def _styled(worksheet, value, font, alignment, border=None):
+    cell = WriteOnlyCell(worksheet, value)
+    cell.font = font
+    cell.alignment = alignment
+    if border is not None:
+        cell.border = border
+    return cell
+
+# Rows written between two progress reports
+PROGRESS_ROWS = 5000
+
+def record_rows(records, columns):
+    """Value tuples of records in column order (a ColumnStore or RowSnapshot is read column by column)"""
+    if isinstance(records, (ColumnStore, RowSnapshot)):
+        return records.rows(columns)
+    return map(attrgetter(*columns), records)
+
+def write_records_workbook(filename, records, mode, progress=None):
+    """Write records in the layout of their data type; returns the number of rows
+
+    Rows are streamed (write-only workbook), so records may be any iterable;
+    a columnar.ColumnStore (or a RowSnapshot of one) is read column by
+    column. progress(rows written, total rows) is called along the way.
+    """
+    columns = record_columns(mode)
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(SHEET_NAME)
+    if mode in (MODE_SORTIE, MODE_RETOUR):
+        # Title merged over all columns, then an empty row
+        last_column = chr(ord('A') + len(columns) - 1)
+        worksheet.merged_cells.add(f'A1:{last_column}1')
+        worksheet.append([_styled(worksheet, movement_title(mode), TITLE_FONT, TITLE_ALIGNMENT)])
+        worksheet.append([])
+    worksheet.append([_styled(worksheet, column, HEADER_FONT, HEADER_ALIGNMENT, HEADER_BORDER)
+                      for column in columns])
+    total = len(records) if hasattr(records, '__len__') else None
+    count = 0
+    for row in record_rows(records, columns):
+        worksheet.append(row)
+        count += 1
+        if progress is not None and count % PROGRESS_ROWS == 0:
+            progress(count, total)
+    workbook.save(filename)
+    return count
+
+# --- Incremental saving ---
+
+# Sheet part of the first worksheet, as written by openpyxl and pandas
+SHEET_PART = 'xl/worksheets/sheet1.xml'
+
+SAVE_UNCHANGED = "unchanged"
+SAVE_PATCHED = "patched"
+SAVE_WRITTEN = "written"
+
+class WorkbookPatchError(Exception):
+    """The workbook cannot be patched in place (it is rewritten instead)"""
+
+def _cell_xml(reference, value):
+    if value is None or value == "":
+        return ""
+    if value.__class__ is bool:
+        return f'<c r="{reference}" t="b"><v>{int(value)}</v></c>'
+    if value.__class__ is int or (value.__class__ is float and math.isfinite(value)):
+        return f'<c r="{reference}" t="n"><v>{value!r}</v></c>'
+    text = str(value)
+    if ILLEGAL_CHARACTERS_RE.search(text):
+        raise WorkbookPatchError(f"Caractère interdit dans {reference}")
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f'<c r="{reference}" t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+def _row_xml(row_number, values):
+    cells = "".join(_cell_xml(f"{get_column_letter(column)}{row_number}", value)
+                    for column, value in enumerate(values, 1))
+    return f'<row r="{row_number}">{cells}</row>'.encode('utf-8')
+
+def _patch_sheet(sheet, edited, appended):
+    """Sheet XML with the edited rows replaced and the appended rows added at the end"""
+    parts = []
+    position = 0
+    for row_number, values in edited:
+        start = sheet.find(b'<row r="%d"' % row_number, position)
+        if start < 0:
+            raise WorkbookPatchError(f"Ligne {row_number} introuvable")
+        tag_end = sheet.index(b'>', start)
+        if sheet[tag_end - 1:tag_end] == b'/':
+            end = tag_end + 1
+        else:
+            end = sheet.find(b'</row>', tag_end)
+            if end < 0:
+                raise WorkbookPatchError(f"Ligne {row_number} incomplète")
+            end += len(b'</row>')
+        parts += [sheet[position:start], _row_xml(row_number, values)]
+        position = end
+    if appended:
+        new_rows = b"".join(_row_xml(row_number, values) for row_number, values in appended)
+        end = sheet.find(b'</sheetData>', position)
+        if end >= 0:
+            parts += [sheet[position:end], new_rows]
+            position = end
+        else:
+            end = sheet.find(b'<sheetData/>', position)
+            if end < 0:
+                end = sheet.find(b'<sheetData />', position)
+            if end < 0:
+                raise WorkbookPatchError("sheetData introuvable")
+            parts += [sheet[position:end], b'<sheetData>' + new_rows + b'</sheetData>']
+            position = sheet.index(b'>', end) + 1
+    parts.append(sheet[position:])
+    sheet = b"".join(parts)
+    if appended:
+        # Keep the used range in line with the new last row
+        last_row = appended[-1][0]
+        sheet = re.sub(rb'(<dimension ref="[A-Z]+\d+:[A-Z]+)(\d+)"',
+                       lambda match: match.group(1) + str(max(int(match.group(2)), last_row)).encode() + b'"',
+                       sheet, count=1)
+    return sheet
+
+def patch_workbook_rows(filename, edited, appended):
+    """Rewrite data rows of the first sheet in place
+
+    edited and appended are lists of (row number, values) in row order.
+    Only the sheet XML is rebuilt; the other parts are copied as they are.
+    The file is replaced atomically (temporary file, then rename).
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temporary = tempfile.mkstemp(suffix=".xlsx", dir=directory)
+    os.close(handle)
+    try:
+        with zipfile.ZipFile(filename) as source, \
+                zipfile.ZipFile(temporary, 'w', zipfile.ZIP_DEFLATED) as target:
+            names = source.namelist()
+            if SHEET_PART not in names:
+                raise WorkbookPatchError(f"{SHEET_PART} introuvable")
+            for info in source.infolist():
+                data = source.read(info.filename)
+                if info.filename == SHEET_PART:
+                    data = _patch_sheet(data, edited, appended)
+                target.writestr(info, data)
+        os.replace(temporary, filename)
+    except zipfile.BadZipFile as e:
+        raise WorkbookPatchError(str(e))
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+def _write_replacing(filename, write):
+    """write(temporary path), then replace filename with it (a crash never leaves half a file)"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temporary = tempfile.mkstemp(suffix=os.path.splitext(filename)[1] or ".xlsx", dir=directory)
+    os.close(handle)
+    try:
+        write(temporary)
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+def _file_signature(filename):
+    try:
+        status = os.stat(filename)
+    except OSError:
+        return None
+    return status.st_mtime_ns, status.st_size
+
+# What a save writes, copied from the store: the whole table (rows, a
+# columnar.RowSnapshot) or the (row number, values) of the edited and
+# appended rows
+SavePlan = namedtuple('SavePlan', 'filename rows edited appended point')
+
+class IncrementalSaver:
+    """Saves a ColumnStore to a workbook, rewriting the file only when needed
+
+    The first save of a store writes the whole workbook with
+    write_full(filename, rows, progress), as do saves to another file,
+    after rows were removed, or when the file changed on disk since.
+    Otherwise only the new rows are appended and the edited rows patched,
+    and a save without changes does not touch the file.
+
+    plan() copies what has to be written and runs on the UI thread; write()
+    only needs the plan, so it can run on a worker while the store keeps
+    changing. finished() or failed() then report the outcome.
+    patchable(filename) tells whether a file can be patched at all (other
+    formats than xlsx are always rewritten).
+    """
+
+    def __init__(self, write_full, patchable=None):
+        self.write_full = write_full
+        self.patchable = patchable or (lambda filename: True)
+        self.filename = None
+        self.store = None
+        self.signature = None  # (mtime, size) of the file after our last save
+
+    def plan(self, filename, store, first_row):
+        """SavePlan of the changes of store since its last save (finished() marks them saved)"""
+        changes = store.pending_changes()
+        if (changes is not None and store is self.store and filename == self.filename
+                and _file_signature(filename) == self.signature):
+            appended, edited = changes
+        else:
+            appended = edited = None
+        if appended is not None and (not (appended or edited) or self.patchable(filename)):
+            plan = SavePlan(filename, None,
+                            [(first_row + position, store.row_values(position)) for position in edited],
+                            [(first_row + position, store.row_values(position)) for position in appended],
+                            store.save_point(False))
+        else:
+            plan = SavePlan(filename, store.snapshot(), None, None, store.save_point(True))
+        self.filename = filename
+        self.store = store
+        return plan
+
+    def write(self, plan, progress=None):
+        """Write a plan to its file; returns (SAVE_*, rows written, file signature)
+
+        Only touches the file, so it may run on any thread. A plan that
+        cannot be patched in raises WorkbookPatchError (see failed()).
+        """
+        if plan.rows is not None:
+            _write_replacing(plan.filename, lambda temporary: self.write_full(temporary, plan.rows, progress))
+            status, count = SAVE_WRITTEN, len(plan.rows)
+        elif plan.edited or plan.appended:
+            patch_workbook_rows(plan.filename, plan.edited, plan.appended)
+            status, count = SAVE_PATCHED, len(plan.edited) + len(plan.appended)
+        else:
+            status, count = SAVE_UNCHANGED, 0
+        return status, count, _file_signature(plan.filename)
+
+    def finished(self, plan, signature):
+        """The plan was written: the next save of the store can be incremental"""
+        if plan.filename == self.filename:
+            self.signature = signature
+            self.store.mark_saved(plan.point)
+
+    def failed(self, plan):
+        """The plan was not written: the next save rewrites the whole file"""
+        if plan.filename == self.filename:
+            self.store = None
+
+    def save(self, filename, store, first_row):
+        """Save store to filename on this thread; returns (SAVE_*, rows written)"""
+        plan = self.plan(filename, store, first_row)
+        try:
+            status, count, signature = self.write(plan)
+        except WorkbookPatchError as e:
+            print(f"DEBUG: Enregistrement partiel impossible ({e}), réécriture complète")
+            self.failed(plan)
+            return self.save(filename, store, first_row)
+        except Exception:
+            self.failed(plan)
+            raise
+        self.finished(plan, signature)
+        return status, count
+
+# --- Entrée and order file loading ---
+
+# Entrée file column -> ProductData field (older files use other names)
+ENTREE_COLUMNS = {
+    'Reference': 'Reference',
+    'ID_Produit': 'Reference',
+    'Fournisseur': 'Fournisseur',
+    'Marque': 'Fournisseur',
+    'Designation/Reference': 'Designation',
+    'Designation_Reference': 'Designation',
+    'Designation': 'Designation',
+    'Num_Chasse': 'Num_Chasse',
+    'Serial Number': 'Num_Chasse',
+    'Serial_Number': 'Num_Chasse',
+    'Couleur': 'Couleur',
+    'Matricule': 'Lot',
+    'Lot': 'Lot',
+    'Magasin': 'Magasin',
+    'Photo': 'Relation',
+    'Relation': 'Relation'
+}
+
+class MissingColumnsError(ValueError):
+    """Columns required by the data type are missing from a file"""
+
+    def __init__(self, columns):
+        super().__init__(f"Colonnes manquantes: {', '.join(columns)}")
+        self.columns = columns
+
+def iter_entree_file(filename):
+    """Records of an Entrée workbook (header on row 1)"""
+    df = pd.read_excel(filename)
+    for _, row in df.iterrows():
+        product = ProductData()
+        for excel_col, product_field in ENTREE_COLUMNS.items():
+            if excel_col in df.columns:
+                value = row[excel_col]
+                setattr(product, product_field, str(value) if pd.notna(value) else "")
+        yield product
+
+def read_order_file(filename):
+    """Orders of an order workbook (header on row 1); raises MissingColumnsError"""
+    df = pd.read_excel(filename)
+    missing_columns = [col for col in record_columns(MODE_COMMANDE) if col not in df.columns]
+    if missing_columns:
+        raise MissingColumnsError(missing_columns)
+    orders = []
+    for _, row in df.iterrows():
+        order = OrderData()
+        order.DATE = str(row["DATE"]) if pd.notna(row["DATE"]) else ""
+        order.ID = str(row["ID"]) if pd.notna(row["ID"]) else ""
+        order.DESIGNATION = str(row["DESIGNATION"]) if pd.notna(row["DESIGNATION"]) else ""
+        order.REFERENCE = str(row["REFERENCE"]) if pd.notna(row["REFERENCE"]) else ""
+        order.QTE = int(row["QTE"]) if pd.notna(row["QTE"]) else 1
+        order.PREPARED = bool(row["PREPARED"]) if pd.notna(row["PREPARED"]) else False
+        orders.append(order)
+    return orders
+
+# --- Sortie/Retour file loading ---
+
+class MovementColumnsNotFound(ValueError):
+    """The Sortie/Retour column header could not be found in a workbook"""
+
+class ChassisColumnNotFound(MovementColumnsNotFound):
+    """The Sortie/Retour header was found, but without its N_CHASSIS column"""
+
+def _cell_text(value):
+    """Text of a cell as loaded ('' for empty cells, whole numbers without '.0')"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def movement_timestamps(dates, heures):
+    """Date/Heure text columns to timestamps in one pass (NaT where unparseable)
+
+    Same rules as movement_ledger.try_parse_movement_datetime: DD/MM/YYYY or
+    YYYY-MM-DD dates, HH:MM times.
+    """
+    parts = dates.str.split('/')
+    day_first = parts.str.len() == 3
+    normalized = dates + " " + heures
+    if day_first.any():
+        split = parts[day_first]
+        normalized[day_first] = (split.str[2] + "-" + split.str[1].str.zfill(2) + "-"
+                                 + split.str[0].str.zfill(2) + " " + heures[day_first])
+    # Dates with slashes but not 3 parts never parse
+    normalized[dates.str.contains('/', regex=False) & ~day_first] = ""
+    return pd.to_datetime(normalized, format="%Y-%m-%d %H:%M", errors='coerce')
+
+def iter_movement_file(filename, mode):
+    """Stream the records of a Sortie/Retour workbook, reading it once
+
+    Rows are read with openpyxl in read-only mode. The header is the first
+    row holding at least 4 of the 7 columns (row 3 in files written by the
+    app). Rows without a chassis (or shorter than 3 characters) and
+    title/header rows are skipped. Raises MovementColumnsNotFound before the
+    first record if the header or its N_CHASSIS column cannot be found.
+    """
+    columns = record_columns(mode)
+    data_class = RECORD_CLASSES[mode]
+    title_keyword = mode.upper()  # "SORTIE" or "RETOUR"
+
+    workbook = load_workbook(filename, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = None
+        for row in rows:
+            texts = [_cell_text(value) for value in row]
+            if sum(text.strip() in columns for text in texts) >= 4:
+                header = texts
+                break
+        if header is None:
+            raise MovementColumnsNotFound(f"En-tête des colonnes {mode} non trouvé")
+        found_columns = [column for column in columns if column in header]
+        if len(found_columns) < 4:
+            raise MovementColumnsNotFound(f"Colonnes {mode} non trouvées dans le fichier")
+        if 'N_CHASSIS' not in found_columns:
+            raise ChassisColumnNotFound(f"Colonne N_CHASSIS non trouvée dans le fichier {mode}")
+
+        positions = [header.index(column) for column in found_columns]
+        chassis_position = header.index('N_CHASSIS')
+        # Repeated Date/DESIGNATION/WILAYA texts share one copy (categories.py)
+        interns = [getattr(shared_dictionary(column), 'intern', None) for column in found_columns]
+        for row in rows:
+            if chassis_position >= len(row):
+                continue
+            chassis = _cell_text(row[chassis_position])
+            if chassis == "nan" or len(chassis.strip()) < 3:
+                continue
+            texts = [value if value.__class__ is str else _cell_text(value) for value in row]
+            # Title ("SORTIE LIVRAISON JOURNALIERE") and repeated header rows;
+            # the separator keeps a keyword from matching across two cells
+            line = "\0".join(texts).upper()
+            if "N_CHASSIS" in line or (title_keyword in line and "LIVRAISON" in line):
+                continue
+            values = [texts[position] if position < len(texts) else "" for position in positions]
+            for index, intern in enumerate(interns):
+                if intern is not None:
+                    values[index] = intern(values[index])
+            yield data_class(**dict(zip(found_columns, values)))
+    finally:
+        workbook.close()
+
+def read_movement_file(filename, mode):
+    """Load the records of a Sortie/Retour workbook (see iter_movement_file)
+
+    Returns (records, timestamps) where timestamps are the parsed
+    Date/Heure (None if invalid), parsed in one pass.
+    """
+    records = list(iter_movement_file(filename, mode))
+    stamps = movement_timestamps(pd.Series([record.Date for record in records], dtype=object),
+                                 pd.Series([record.Heure for record in records], dtype=object))
+    timestamps = [None if pd.isna(stamp) else stamp.to_pydatetime() for stamp in stamps]
+    return records, timestamps
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Headless ingest: build an Entrée/Sortie/Retour file from a file of scanner payloads
+Usage: python ingest_cli.py {entree,sortie,retour} payloads.txt output.xlsx [--date JJ/MM/AAAA]
+
+The output format follows its extension (storage_formats.py): .xlsx, .csv,
+.parquet or .sqlite.
+
+The payload file is streamed (one payload per line, multi-line payloads
+opened by *REF*, or tab-terminated dumps), parsed with the app's engine and
+deduplicated with the app's rules; no Tk window is created. Client columns of
+Sortie/Retour are left empty, to be completed in the app.
+
+Sortie/Retour rows are not checked against the movement history (movement
+store, reference files): a chassis already out can be written in a Sortie
+file, a chassis never out in a Retour file. The app only applies those
+checks to scans; here only the duplicates within the payload file are
+refused.
+
+100k payloads take about 15 s to .xlsx, 90% of it in openpyxl's XML writer
+(about 1.5 s to .csv or .sqlite); prefer those formats for large backfills.
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from records import MODE_ENTREE, MODE_SORTIE, MODE_RETOUR, record_key
+from qr_parsing import parse_payload, iter_payloads
+from storage_formats import write_records
+
+MODES = {
+    "entree": MODE_ENTREE,
+    "sortie": MODE_SORTIE,
+    "retour": MODE_RETOUR,
+}
+
+class IngestStats:
+    """Counters reported at the end of an ingest"""
+
+    def __init__(self):
+        self.payloads = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = []  # (first payload line, reason)
+
+def ingest_records(payloads, mode, now=None, stats=None):
+    """Yield the records to keep from an iterable of payloads (same rules as the app)
+
+    - Payloads without Reference (Entrée) or chassis (Sortie/Retour) are rejected
+    - A Reference/chassis already seen in the file is a duplicate and skipped
+    """
+    stats = stats if stats is not None else IngestStats()
+    now = now or datetime.now()
+    seen_keys = set()
+    for payload in payloads:
+        stats.payloads += 1
+        try:
+            record = parse_payload(payload, mode, now=now)
+        except Exception as e:
+            stats.rejected.append((payload.splitlines()[0], f"Erreur d'analyse: {e}"))
+            continue
+        key = record_key(record)
+        if not key:
+            reason = "Référence manquante" if mode == MODE_ENTREE else "Châssis manquant"
+            stats.rejected.append((payload.splitlines()[0], reason))
+            continue
+        if key in seen_keys:
+            stats.duplicates += 1
+            continue
+        seen_keys.add(key)
+        stats.accepted += 1
+        yield record
+
+def parse_timestamp(date_text, time_text):
+    """--date/--heure options to a datetime (today/now by default)"""
+    now = datetime.now()
+    if date_text:
+        day = datetime.strptime(date_text, "%d/%m/%Y")
+        now = now.replace(year=day.year, month=day.month, day=day.day)
+    if time_text:
+        hour = datetime.strptime(time_text, "%H:%M")
+        now = now.replace(hour=hour.hour, minute=hour.minute)
+    return now
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(
+        description="Construire un fichier Entrée/Sortie/Retour à partir d'un fichier de scans",
+        epilog="Sortie/Retour: l'historique des mouvements n'est pas vérifié "
+               "(seuls les doublons du fichier de scans sont refusés).")
+    parser.add_argument("mode", choices=sorted(MODES), help="type de données")
+    parser.add_argument("input", help="fichier de scans ('-' pour l'entrée standard)")
+    parser.add_argument("output", help="fichier à créer (.xlsx, .csv, .parquet ou .sqlite)")
+    parser.add_argument("--date", help="date des mouvements Sortie/Retour (JJ/MM/AAAA, défaut: aujourd'hui)")
+    parser.add_argument("--heure", help="heure des mouvements Sortie/Retour (HH:MM, défaut: maintenant)")
+    parser.add_argument("--encoding", default="utf-8", help="encodage du fichier de scans (défaut: utf-8)")
+    args = parser.parse_args(argv)
+
+    mode = MODES[args.mode]
+    try:
+        now = parse_timestamp(args.date, args.heure)
+    except ValueError as e:
+        parser.error(f"date/heure invalide: {e}")
+
+    start = time.perf_counter()
+    stats = IngestStats()
+    if args.input == "-":
+        records = ingest_records(iter_payloads(sys.stdin), mode, now, stats)
+        write_records(args.output, records, mode)
+    else:
+        with open(args.input, 'r', encoding=args.encoding, errors='ignore') as input_file:
+            records = ingest_records(iter_payloads(input_file), mode, now, stats)
+            write_records(args.output, records, mode)
+    elapsed = time.perf_counter() - start
+
+    print(f"{stats.payloads} scan(s) lus, {stats.accepted} ajouté(s), "
+          f"{stats.duplicates} doublon(s), {len(stats.rejected)} rejeté(s) en {elapsed:.1f} s")
+    for key, reason in stats.rejected[:15]:
+        print(f"  {key}: {reason}")
+    if len(stats.rejected) > 15:
+        print(f"  ... et {len(stats.rejected) - 15} autre(s)")
+    print(f"Fichier créé: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
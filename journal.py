@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+Write-ahead journal of the session records
+Every change of the session list (scan, edit, deletion, clear) is appended
+to a local journal file before anything is saved, so a crash or a power cut
+does not lose the scans of the day. Appends only write to a buffer; a
+background thread fsyncs them in batches and periodically compacts the
+journal: the session is written to its Excel file (temp file, then rename)
+and the journal is rewritten as a snapshot of the session.
+
+Journal lines are JSON lists:
+  ["M", mode]         data type of the following rows
+  ["F", filename]     Excel file of the session (null: none)
+  ["S", key, values]  row added or changed (a known key keeps its position)
+  ["D", key]          row removed
+  ["C"]               session cleared
+  ["W", unsaved]      session saved to its file, except the last unsaved
+                      changes above (made while the file was written)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from dataclasses import fields
+from operator import attrgetter
+
+from records import RECORD_CLASSES, data_type_of, row_id
+
+# Pending appends are fsynced after FSYNC_INTERVAL seconds, or as soon as
+# FSYNC_BATCH of them are waiting
+FSYNC_INTERVAL = 0.5
+FSYNC_BATCH = 200
+COMPACT_INTERVAL = 120  # Seconds between compactions (only when something changed)
+
+# Session found in a journal left by a previous run
+JournalSession = namedtuple('JournalSession', 'mode filename records')
+
+_modes = {}  # Record class (or its column store view class) -> data type
+
+def _mode_of(record_class):
+    mode = _modes.get(record_class)
+    if mode is None:
+        mode = _modes[record_class] = data_type_of(record_class)
+    return mode
+
+_getters = {}  # Data type -> attrgetter of its fields
+
+def _values_of(mode, record):
+    getter = _getters.get(mode)
+    if getter is None:
+        getter = _getters[mode] = attrgetter(*[field.name for field in fields(RECORD_CLASSES[mode])])
+    return getter(record)
+
+def _line(entry):
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=str) + "\n"
+
+class ScanJournal:
+    """Journal of a session list, attached as a follower of its RecordIndex/OrderIndex
+
+    write_workbook(filename, records, mode) writes the Excel file of the
+    session during compaction (records are plain dataclasses), then
+    saved(filename, records, mode) is told the file holds them. Changes are
+    ignored until start(); file_lock must be held by anyone else writing the
+    session file.
+    """
+
+    def __init__(self, path, write_workbook=None, saved=None):
+        self.path = path
+        self.write_workbook = write_workbook
+        self.saved = saved
+        self.file_lock = threading.Lock()  # Held while the session file is written
+        self.lock = threading.Lock()  # Guards the fields below
+        self.file = None
+        self.mode = None
+        self.filename = None
+        self.rows = {}  # Key -> values, None once removed (a re-added key keeps its place)
+        self.keys = {}  # Row id -> key (an edited record takes the key of the one it replaces)
+        self.unsaved = 0  # Changes since the last save
+        self.saves = 0  # Saves of the session file, to detect a save during compaction
+        self.saving = False  # A save of the session file is being written
+        self.sequence = 0  # Changes since start(), numbering the save points
+        self.cleared = 0  # Sequence of the last clear
+        self.changes = 0  # Changes since the last compaction
+        self.pending = 0  # Appends not fsynced yet
+        self.tail = None  # Lines appended while a compaction runs
+        self.wake = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    # --- Recovery ---
+
+    def recover(self):
+        """Unsaved session left by a previous run (None if there is none)"""
+        try:
+            with open(self.path, encoding='utf-8') as journal:
+                lines = journal.readlines()
+        except FileNotFoundError:
+            return None
+        mode, filename, rows, unsaved = None, None, {}, 0
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                print(f"Warning: ligne illisible ignorée dans le journal {self.path}")
+                continue  # Last line cut by a crash
+            op = entry[0]
+            if op == "S":
+                rows[entry[1]] = (mode, entry[2])
+            elif op == "D":
+                rows[entry[1]] = None
+            elif op == "C":
+                rows = {}
+            elif op == "M":
+                mode = entry[1]
+                continue
+            elif op == "F":
+                filename = entry[1]
+                continue
+            elif op == "W":
+                unsaved = entry[1] if len(entry) > 1 else 0
+                continue
+            unsaved += 1
+        rows = [row for row in rows.values() if row is not None]
+        if not unsaved or not rows:
+            return None
+        mode = rows[-1][0]
+        records = [RECORD_CLASSES[mode](*values) for row_mode, values in rows if row_mode == mode]
+        return JournalSession(mode, filename, records)
+
+    def start(self, records=(), filename=None):
+        """Start journaling, from the given session (restored records, or none)
+
+        The journal of the previous run is replaced atomically; if it held an
+        unsaved session that is not restored, it is kept next to it (.bak).
+        """
+        if not records and self.recover() is not None:
+            try:
+                os.replace(self.path, self.path + ".bak")
+            except OSError as e:
+                print(f"Warning: Could not keep the previous journal: {e}")
+        with self.lock:
+            self.filename = filename
+            for record in records:
+                self._set(record)
+            self.unsaved = self.changes = len(records)
+            self._rewrite(self._snapshot_lines(list(self.rows.items()), saved=False), [])
+        self.thread = threading.Thread(target=self._run, name="ScanJournal", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Fsync pending appends and stop the background thread"""
+        self.stopped = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
+
+    # --- Following the record list ---
+
+    def add(self, record):
+        with self.lock:
+            if self.file is not None:
+                key, values = self._set(record)
+                self._change(["S", key, values])
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def remove(self, record):
+        with self.lock:
+            key = self.keys.get(row_id(record))
+            if self.file is not None and key is not None and self.rows.get(key) is not None:
+                self.rows[key] = None
+                self._change(["D", key])
+
+    def replace(self, old_record, new_record):
+        """An edited record takes the place of the old one"""
+        with self.lock:
+            if self.file is not None:
+                key = self.keys.pop(row_id(old_record), None)
+                if key is not None:
+                    self.keys[row_id(new_record)] = key
+                key, values = self._set(new_record)
+                self._change(["S", key, values])
+
+    def update(self, record):
+        """A record was modified in place"""
+        self.add(record)
+
+    def clear(self):
+        with self.lock:
+            if self.file is not None:
+                self.rows = {}
+                self.keys = {}
+                self.filename = None
+                self._change(["C"])
+                self.cleared = self.sequence
+
+    def load(self, records, filename):
+        """The session was replaced by the records read from filename
+
+        The journal is rewritten as a saved snapshot of them, instead of one
+        change per record.
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            self.rows = {}
+            self.keys = {}
+            for record in records:
+                self.mode = _mode_of(record.__class__)
+                iid = row_id(record)
+                self.keys[iid] = iid
+                self.rows[iid] = _values_of(self.mode, record)
+            self.filename = filename
+            self.sequence += 1
+            self.cleared = self.sequence  # Saves started before do not match these records
+            self.unsaved = self.changes = 0
+            lines = self._snapshot_lines(list(self.rows.items()), saved=True)
+            if self.tail is None:
+                self._rewrite(lines, [])
+            else:
+                # A compaction is rewriting the journal: the new session follows what it keeps
+                lines.insert(0, _line(["C"]))
+                self.file.writelines(lines)
+                self.tail.extend(lines)
+                self.pending += len(lines)
+                self.wake.set()
+
+    def save_point(self):
+        """A save of the session file starts; returns its point for mark_saved
+
+        Until mark_saved or save_failed, compactions leave the file alone.
+        """
+        with self.lock:
+            self.saves += 1
+            self.saving = True
+            return self.sequence
+
+    def mark_saved(self, filename, point=None):
+        """The session as of save_point() is in filename (no point: the whole session)"""
+        with self.lock:
+            self.saving = False
+            if self.file is None or (point is not None and point < self.cleared):
+                return  # Cleared while the file was written: not this session any more
+            if filename != self.filename:
+                self.filename = filename
+                self._write(["F", filename])
+            unsaved = self.sequence - point if point is not None else 0
+            self._write(["W", unsaved] if unsaved else ["W"])
+            self.unsaved = unsaved
+            self.saves += 1
+
+    def save_failed(self):
+        """The save started with save_point() did not reach the file"""
+        with self.lock:
+            self.saving = False
+
+    # --- Internals (called with self.lock held) ---
+
+    def _set(self, record):
+        mode = _mode_of(record.__class__)
+        if mode != self.mode:
+            self.mode = mode
+            if self.file is not None:
+                self._write(["M", mode])
+        iid = row_id(record)
+        key = self.keys.get(iid)
+        if key is None:
+            key = self.keys[iid] = iid
+        values = self.rows[key] = _values_of(mode, record)
+        return key, values
+
+    def _change(self, entry):
+        self._write(entry)
+        self.unsaved += 1
+        self.changes += 1
+        self.sequence += 1
+
+    def _write(self, entry):
+        line = _line(entry)
+        self.file.write(line)
+        if self.tail is not None:
+            self.tail.append(line)
+        self.pending += 1
+        if self.pending >= FSYNC_BATCH:
+            self.wake.set()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def _snapshot_lines(self, items, saved):
+        lines = [_line(["M", self.mode]), _line(["F", self.filename])]
+        lines.extend(_line(["S", key, values]) for key, values in items if values is not None)
+        if saved:
+            lines.append(_line(["W"]))
+        return lines
+
+    def _rewrite(self, lines, tail):
+        """Replace the journal file with lines + tail (temp file, fsync, rename)"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as temp:
+            temp.writelines(lines)
+            temp.writelines(tail)
+            temp.flush()
+            os.fsync(temp.fileno())
+        if self.file is not None:
+            self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.pending = 0
+
+    # --- Background thread ---
+
+    def _run(self):
+        last_compaction = time.monotonic()
+        while not self.stopped:
+            self.wake.wait(FSYNC_INTERVAL)
+            self.wake.clear()
+            try:
+                fileno = None
+                with self.lock:
+                    if self.pending and self.file is not None:
+                        self.file.flush()
+                        fileno = self.file.fileno()
+                        self.pending = 0
+                if fileno is not None:
+                    os.fsync(fileno)  # Outside the lock: scans keep appending meanwhile
+                if self.changes and time.monotonic() - last_compaction >= COMPACT_INTERVAL and not self.stopped:
+                    self.compact()
+                    last_compaction = time.monotonic()
+            except Exception as e:
+                print(f"Error in scan journal: {e}")
+
+    def compact(self):
+        """Write the session to its Excel file if it has unsaved changes, then rewrite the journal"""
+        with self.lock:
+            items = list(self.rows.items())
+            mode, filename = self.mode, self.filename
+            unsaved, saves, saving = self.unsaved, self.saves, self.saving
+            self.changes = 0
+            self.tail = []
+        saved = False
+        try:
+            # Not while a save writes the file: it has the newer rows
+            if unsaved and filename and mode and not saving and self.write_workbook is not None:
+                saved = self._write_session(filename, mode, [values for _, values in items if values is not None], saves)
+        finally:
+            lines = self._snapshot_lines(items, saved or not unsaved)
+            with self.lock:
+                tail, self.tail = self.tail, None
+                if self.file is not None:
+                    self._rewrite(lines, tail)
+                if saved:
+                    self.unsaved = max(self.unsaved - unsaved, 0)
+
+    def _write_session(self, filename, mode, rows, saves):
+        record_class = RECORD_CLASSES[mode]
+        records = [record_class(*values) for values in rows]
+        root, extension = os.path.splitext(filename)
+        temp_path = f"{root}.journal-tmp{extension}"
+        with self.file_lock:
+            if saves != self.saves:
+                return False  # Saved by the user meanwhile, with newer rows
+            try:
+                self.write_workbook(temp_path, records, mode)
+                os.replace(temp_path, filename)
+            except Exception as e:
+                print(f"Warning: Could not write {filename} from the journal: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return False
+            if self.saved is not None:
+                try:
+                    self.saved(filename, records, mode)
+                except Exception as e:
+                    print(f"Warning: {filename} written by the journal, but: {e}")
+            return True
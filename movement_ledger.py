@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Per-chassis movement ledger for Sortie/Retour validation
+Built once from the reference files (latest sortie and latest retour per
+chassis) and updated on every save of a session file, so the checks are O(1)
+"""
+
+import os
+from datetime import datetime
+
+ACTION_SORTIE = "sortie"
+ACTION_RETOUR = "retour"
+
+def try_parse_movement_datetime(date_str, time_str):
+    """Parse the Date/Heure columns of a Sortie/Retour record (None if unparseable)"""
+    try:
+        # Handle different date formats
+        if '/' in date_str:
+            # Format: DD/MM/YYYY
+            date_parts = date_str.split('/')
+            if len(date_parts) == 3:
+                day, month, year = date_parts
+                dt_str = f"{year}-{month.zfill(2)}-{day.zfill(2)} {time_str}"
+                return datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
+        else:
+            # Try other formats
+            dt_str = f"{date_str} {time_str}"
+            return datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
+    except Exception:
+        pass
+    return None
+
+def file_key(filename):
+    """Same session file, however its path was written"""
+    return os.path.normcase(os.path.abspath(filename))
+
+def parse_movement_datetime(date_str, time_str):
+    """Parse the Date/Heure columns of a Sortie/Retour record (now if unparseable)"""
+    # Fallback to current time if parsing fails
+    return try_parse_movement_datetime(date_str, time_str) or datetime.now()
+
+class MovementLedger:
+    """Latest file movements and session history per chassis"""
+
+    def __init__(self):
+        self.latest = {ACTION_SORTIE: {}, ACTION_RETOUR: {}}  # {action: {chassis: datetime}}
+        self.saved = {}  # Session files: {file: {file row: (timestamp, action, chassis)}}
+        self.history = {}  # Saved movements: {chassis: [(timestamp, action), ...]} oldest first
+
+    def load_file(self, action, records, timestamps=None):
+        """Replace the reference data of one action with the records of a loaded file
+
+        timestamps, if given, are the already parsed Date/Heure of each record
+        (None if unparseable).
+        """
+        latest = {}
+        parsed = {}  # Many records share the same Date/Heure
+        if timestamps is None:
+            timestamps = [None] * len(records)
+        for record, timestamp in zip(records, timestamps):
+            chassis = getattr(record, 'N_CHASSIS', None)
+            if not chassis:
+                continue
+            if timestamp is None:
+                stamp = (record.Date, record.Heure)
+                timestamp = parsed.get(stamp)
+                if timestamp is None:
+                    timestamp = parsed[stamp] = parse_movement_datetime(*stamp)
+            previous = latest.get(chassis)
+            if previous is None or timestamp > previous:
+                latest[chassis] = timestamp
+        self.latest[action] = latest
+
+    def record_saved(self, filename, action, rows, replace=False):
+        """Rows of a session file were saved (see MovementStore.record_saved)"""
+        key = file_key(filename)
+        saved = {} if replace else dict(self.saved.get(key, {}))
+        for file_row, chassis, date, heure in rows:
+            if chassis:
+                saved[file_row] = (parse_movement_datetime(date, heure), action, chassis)
+            else:
+                saved.pop(file_row, None)
+        files = dict(self.saved)
+        files[key] = saved
+        history = {}
+        for movements in files.values():
+            for timestamp, saved_action, chassis in movements.values():
+                history.setdefault(chassis, []).append((timestamp, saved_action))
+        for movements in history.values():
+            movements.sort(key=lambda movement: (movement[0], movement[1] == ACTION_RETOUR))
+        # Replaced whole: may run on the save worker while the checks read them
+        self.saved, self.history = files, history
+
+    def last_action(self, chassis):
+        """Last saved action for a chassis (None if not in a saved session file)"""
+        history = self.history.get(chassis)
+        return history[-1][1] if history else None
+
+    def clear(self):
+        """Data cleared in the app: forget the reference files (saved movements stay)"""
+        self.latest = {ACTION_SORTIE: {}, ACTION_RETOUR: {}}
+
+    def can_sortie(self, chassis, in_session_sortie=False):
+        """Not already out: no saved sortie pending, and any file sortie was followed by a retour"""
+        if self.last_action(chassis) == ACTION_SORTIE:
+            return False
+        latest_sortie = self.latest[ACTION_SORTIE].get(chassis)
+        latest_retour = self.latest[ACTION_RETOUR].get(chassis)
+        if latest_retour is not None and (latest_sortie is None or latest_sortie <= latest_retour):
+            return True  # Returned, with no sortie since
+        if in_session_sortie:
+            return False  # Already in current sortie session
+        return latest_sortie is None
+
+    def can_retour(self, chassis, in_session_sortie=False):
+        """Out: last saved action is a sortie, or latest file sortie not followed by a retour"""
+        last_action = self.last_action(chassis)
+        if last_action is not None:
+            return last_action == ACTION_SORTIE
+        if in_session_sortie:
+            return True
+        latest_sortie = self.latest[ACTION_SORTIE].get(chassis)
+        if latest_sortie is None:
+            return False  # Not found in any sortie
+        latest_retour = self.latest[ACTION_RETOUR].get(chassis)
+        return latest_retour is None or latest_retour <= latest_sortie
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent Sortie/Retour movement store (SQLite)
+Every saved sortie/retour and every imported reference file row is kept
+across days and restarts (reference rows until the data is cleared); the
+chronological checks query it directly.
+Scans only count once their session file is saved: each saved row is kept
+under its file and row number, so a later save of the file replaces it and
+an unsaved session leaves nothing behind
+"""
+
+import sqlite3
+
+from movement_ledger import (ACTION_SORTIE, ACTION_RETOUR, try_parse_movement_datetime,
+                             parse_movement_datetime, file_key)
+
+SOURCE_SCAN = "scan"  # Saved in a session file of the app
+SOURCE_FILE = "file"  # Imported from a Sortie/Retour reference file
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movements (
+    id INTEGER PRIMARY KEY,
+    chassis TEXT NOT NULL,
+    action TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    source TEXT NOT NULL,
+    session TEXT,
+    file_row INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_movements_chassis_ts ON movements (chassis, ts);
+CREATE INDEX IF NOT EXISTS idx_movements_ts ON movements (ts);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_movements_file
+    ON movements (chassis, action, ts) WHERE source = 'file';
+"""
+
+# Row of a saved session file (session: the file); created once file_row exists
+_SAVED_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_movements_saved
+    ON movements (session, file_row) WHERE source = 'scan';
+"""
+
+def _ts(timestamp):
+    """Sortable text timestamp"""
+    return timestamp.isoformat(sep=' ', timespec='microseconds')
+
+def _parse_timestamps(records):
+    parsed = {}  # Many records share the same Date/Heure
+    for record in records:
+        stamp = (record.Date, record.Heure)
+        if stamp not in parsed:
+            parsed[stamp] = try_parse_movement_datetime(*stamp)
+        yield parsed[stamp]
+
+class MovementStore:
+    """Movement history on disk; same interface as MovementLedger"""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(movements)")]
+        if 'file_row' not in columns:  # Database of an earlier version
+            self.connection.execute("ALTER TABLE movements ADD COLUMN file_row INTEGER")
+        self.connection.executescript(_SAVED_INDEX)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def record_saved(self, filename, action, rows, replace=False):
+        """Rows of a session file were saved (any thread: uses its own connection)
+
+        rows: (file row, chassis, Date, Heure) of the rows written; a row
+        without chassis drops the movement of its file row. replace: the
+        whole file was written, its earlier movements go.
+        """
+        session = file_key(filename)
+        movements, dropped = [], []
+        parsed = {}  # Many rows share the same Date/Heure
+        for file_row, chassis, date, heure in rows:
+            if not chassis:
+                dropped.append((session, file_row))
+                continue
+            if (date, heure) not in parsed:
+                parsed[date, heure] = _ts(parse_movement_datetime(date, heure))
+            movements.append((chassis, action, parsed[date, heure], SOURCE_SCAN, session, file_row))
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                if replace:
+                    connection.execute("DELETE FROM movements WHERE source = ? AND session = ?",
+                                       (SOURCE_SCAN, session))
+                connection.executemany(
+                    "DELETE FROM movements WHERE source = ? AND session = ? AND file_row = ?",
+                    [(SOURCE_SCAN, session, file_row) for session, file_row in dropped])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO movements (chassis, action, ts, source, session, file_row)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", movements)
+        finally:
+            connection.close()
+
+    def load_file(self, action, records, timestamps=None):
+        """Import the rows of a reference file (rows already imported are ignored)
+
+        Returns the number of new movements; rows without chassis or with an
+        unparseable Date/Heure are skipped. timestamps, if given, are the
+        already parsed Date/Heure of each record (None if unparseable).
+        """
+        if timestamps is None:
+            timestamps = _parse_timestamps(records)
+        rows = []
+        for record, timestamp in zip(records, timestamps):
+            chassis = getattr(record, 'N_CHASSIS', None)
+            if chassis and timestamp is not None:
+                rows.append((chassis, action, _ts(timestamp), SOURCE_FILE))
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO movements (chassis, action, ts, source) VALUES (?, ?, ?, ?)", rows)
+            return self.connection.total_changes - before
+
+    def last_movement(self, chassis):
+        """(action, timestamp text) of the latest movement of a chassis, or None
+
+        On equal timestamps the retour is considered the latest.
+        """
+        return self.connection.execute(
+            "SELECT action, ts FROM movements WHERE chassis = ? ORDER BY ts DESC, action ASC LIMIT 1",
+            (chassis,)).fetchone()
+
+    def last_action(self, chassis):
+        movement = self.last_movement(chassis)
+        return movement[0] if movement else None
+
+    def clear(self):
+        """Data cleared in the app: forget the reference files (saved movements stay)"""
+        with self.connection:
+            self.connection.execute("DELETE FROM movements WHERE source = ?", (SOURCE_FILE,))
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM movements").fetchone()[0]
+
+    def can_sortie(self, chassis, in_session_sortie=False):
+        """Not out: the latest known movement is not a sortie"""
+        last_action = self.last_action(chassis)
+        if last_action is not None:
+            return last_action == ACTION_RETOUR
+        return not in_session_sortie
+
+    def can_retour(self, chassis, in_session_sortie=False):
+        """Out: the latest known movement is a sortie"""
+        last_action = self.last_action(chassis)
+        if last_action is not None:
+            return last_action == ACTION_SORTIE
+        return in_session_sortie
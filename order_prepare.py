@@ -5,33 +5,51 @@ Scans QR codes and manages order preparation status
 Based on QR Scanner App ideology
 """
 
-import pandas as pd
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from PIL import Image, ImageTk
 import os
 import sys
-from dataclasses import dataclass, asdict
 import logging
 import builtins
 import re
 import requests
 from datetime import datetime
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
+from records import MODE_COMMANDE, OrderData, OrderIndex, row_id, search_blob
+from tree_view import VirtualTable, SEARCH_DEBOUNCE_MS
+from table_sort import TableSorter
+from columnar import ColumnStore
+from excel_io import IncrementalSaver, SAVE_UNCHANGED, WorkbookPatchError, MissingColumnsError
+from save_worker import SaveWorker
+from storage_formats import read_records, write_records, is_patchable, FILE_TYPES, OPEN_FILE_TYPES
+from journal import ScanJournal
+from qr_parsing import parse_order_payload, split_payloads
 # Add urllib3 for SSL warnings
 import urllib3
 
 #! REMOVE AFTER SSL FIX - Disable SSL warnings for app.diardzair.com.dz
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Order files: header on row 1, orders from row 2
+ORDER_FIRST_ROW = 2
+# Write-ahead journal of the current orders (restored after a crash)
+JOURNAL_FILENAME = "Order_Prepare.journal"
+# Delay between two checks of the client lookups of a batch (ms)
+BATCH_POLL_MS = 50
+
 # --- Logging Configuration ---
+def app_data_dir():
+    """Directory of the log files and the session journal"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
 def setup_logging():
     """Configure logging to redirect all prints to a log file"""
-    if getattr(sys, 'frozen', False):
-        log_dir = os.path.dirname(sys.executable)
-    else:
-        log_dir = os.path.dirname(os.path.abspath(__file__))
+    log_dir = app_data_dir()
     
     log_file = os.path.join(log_dir, f"Order_Prepare_{datetime.now().strftime('%Y%m%d')}.log")
     
@@ -69,16 +87,6 @@ def resource_path(relative_path):
     
     return os.path.join(base_path, relative_path)
 
-@dataclass
-class OrderData:
-    """Data structure for order preparation information"""
-    DATE: str = ""
-    ID: str = ""
-    DESIGNATION: str = ""
-    REFERENCE: str = ""
-    QTE: int = 1
-    PREPARED: bool = False
-
 class OrderPrepareApp:
     def __init__(self):
         self.root = tk.Tk()
@@ -94,17 +102,50 @@ class OrderPrepareApp:
             print(f"Could not load icon: {e}")
         
         # Data storage
-        self.orders_data = []
+        self.orders_data = ColumnStore(OrderData)  # Orders stored column by column
+        self.saver = IncrementalSaver(  # Appends/patches rows of the saved file (xlsx), rewrites other formats
+            lambda file_path, rows, progress: write_records(file_path, rows, MODE_COMMANDE, progress),
+            is_patchable)
+        self.save_worker = SaveWorker(self.root)  # Excel writes, off the UI thread
+        self.lookup_executor = ThreadPoolExecutor(max_workers=8)  # Client lookups of batch scans
+        self.save_plan = None  # SavePlan being written by save_worker
+        self.save_point = None  # Journal point of that save (journal.save_point)
+        self.sorter = TableSorter()  # Sorted column of the table and cached sort orders
+        self.journal = ScanJournal(os.path.join(app_data_dir(), JOURNAL_FILENAME), write_records)
+        self.order_index = OrderIndex(  # (REFERENCE, ID) and DATE lookups on orders_data
+            followers=(self.sorter, self.journal))
+        self.tree_rows = {}  # Treeview iid (stable row id) -> index in orders_data
         self.excel_file = None
         
         # Scanner state
         self.scanning = False
         self.scan_buffer = ""
         self.scan_timer = None
+        self.search_timer = None  # Debounced table refresh while typing a search
         
         self.setup_ui()
         self.setup_scanner_listener()
+        self.restore_journal_session()
         
+    def restore_journal_session(self):
+        """Offer to restore the unsaved orders of the journal, then start journaling"""
+        session = None
+        try:
+            session = self.journal.recover()
+        except Exception as e:
+            print(f"Could not read the journal: {e}")
+        if session and messagebox.askyesno(
+                "Session Non Enregistrée",
+                f"{len(session.records)} commandes non enregistrées ont été trouvées.\n"
+                f"Voulez-vous les restaurer?"):
+            for order in session.records:
+                self.add_order(order)
+            self.excel_file = session.filename
+            self.journal.start(self.orders_data, self.excel_file)
+            self.update_tree_display()
+        else:
+            self.journal.start()
+
     def setup_ui(self):
         """Setup the main user interface"""
         # Main frame
@@ -150,7 +191,10 @@ class OrderPrepareApp:
                   command=self.open_manual_entry_dialog).pack(side='left', padx=(0, 10))
         
         ttk.Button(manual_frame, text="Effacer", 
-                  command=self.clear_scanner_input).pack(side='left')
+                  command=self.clear_scanner_input).pack(side='left', padx=(0, 10))
+        
+        ttk.Button(manual_frame, text="Importer Lot de Scans", 
+                  command=self.import_scan_batch_file).pack(side='left')
         
         # Search frame
         search_frame = ttk.Frame(main_frame)
@@ -182,13 +226,11 @@ class OrderPrepareApp:
         columns = ("DATE", "ID", "DESIGNATION", "REFERENCE", "QTE", "PREPARED")
         self.tree = ttk.Treeview(data_frame, columns=columns, show='headings', height=15)
         
-        # Configure columns
-        self.tree.heading("DATE", text="Date")
-        self.tree.heading("ID", text="ID Client")
-        self.tree.heading("DESIGNATION", text="Désignation")
-        self.tree.heading("REFERENCE", text="Référence")
-        self.tree.heading("QTE", text="Qté")
-        self.tree.heading("PREPARED", text="Préparé")
+        # Configure columns (click a heading to sort)
+        self.headings = {"DATE": "Date", "ID": "ID Client", "DESIGNATION": "Désignation",
+                         "REFERENCE": "Référence", "QTE": "Qté", "PREPARED": "Préparé"}
+        for col, text in self.headings.items():
+            self.tree.heading(col, text=text, command=lambda c=col: self.sort_column(c))
         
         # Column widths
         self.tree.column("DATE", width=100)
@@ -199,9 +241,11 @@ class OrderPrepareApp:
         self.tree.column("PREPARED", width=80)
         
         # Scrollbars
-        v_scrollbar = ttk.Scrollbar(data_frame, orient="vertical", command=self.tree.yview)
+        v_scrollbar = ttk.Scrollbar(data_frame, orient="vertical")
         h_scrollbar = ttk.Scrollbar(data_frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        # Only the visible rows are Treeview items; the table scrolls over the model
+        self.table = VirtualTable(self.tree, v_scrollbar)
         
         # Pack treeview and scrollbars
         self.tree.grid(row=0, column=0, sticky='nsew')
@@ -211,6 +255,10 @@ class OrderPrepareApp:
         data_frame.grid_rowconfigure(0, weight=1)
         data_frame.grid_columnconfigure(0, weight=1)
         
+        # Configure tags for color coding
+        self.tree.tag_configure('prepared', background='#d4edda', foreground='#155724')
+        self.tree.tag_configure('unprepared', background='#fff3cd', foreground='#856404')
+        
         # Bind events
         self.tree.bind('<Double-1>', self.on_item_double_click)
         self.tree.bind('<Delete>', self.on_delete_key)
@@ -263,7 +311,89 @@ class OrderPrepareApp:
         """Auto-process scanned data"""
         data = self.scanner_entry.get("1.0", tk.END).strip()
         if data and len(data) > 10:  # Minimum length for valid QR data
-            self.process_scanned_data()
+            # A scanner dump or a pasted list holds several payloads
+            payloads = split_payloads(data)
+            if len(payloads) > 1:
+                self.process_batch_data(payloads)
+            else:
+                self.process_scanned_data()
+    
+    def import_scan_batch_file(self):
+        """Import a text file of scanner payloads (offline dump or list) as one batch"""
+        file_path = filedialog.askopenfilename(
+            title="Charger un lot de scans",
+            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as batch_file:
+                payloads = split_payloads(batch_file.read(), one_per_line=True)
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Erreur lors du chargement: {str(e)}")
+            return
+        if payloads:
+            self.process_batch_data(payloads)
+        else:
+            messagebox.showwarning("Attention", "Aucun scan trouvé dans le fichier")
+    
+    def process_batch_data(self, payloads):
+        """Parse a batch of payloads on the worker pool; collect_batch merges them"""
+        # Taken from the input now: the lookups run while scanning goes on
+        self.clear_scanner_input()
+        self.status_label.config(text=f"Traitement du lot ({len(payloads)} scans)...", foreground='blue')
+        futures = [self.lookup_executor.submit(self.parse_qr_data, payload) for payload in payloads]
+        self.root.after(BATCH_POLL_MS, self.collect_batch, payloads, futures)
+        
+    def collect_batch(self, payloads, futures):
+        """Merge a batch into the orders with a single refresh once its lookups are done"""
+        pending = sum(1 for future in futures if not future.done())
+        if pending:
+            self.status_label.config(text=f"Récupération des clients ({len(futures) - pending}/{len(futures)})...",
+                                     foreground='blue')
+            self.root.after(BATCH_POLL_MS, self.collect_batch, payloads, futures)
+            return
+        try:
+            # Orders are merged in scan order
+            today = datetime.now().strftime("%d/%m/%Y")
+            added = 0
+            merged = 0
+            rejected = []  # (payload key, reason)
+            for payload, future in zip(payloads, futures):
+                order_data = future.result()
+                if order_data is None:
+                    rejected.append((payload.splitlines()[0], "Données QR invalides"))
+                    continue
+                if not order_data.ID:
+                    rejected.append((order_data.REFERENCE, "Aucun client trouvé"))
+                    continue
+                order_data.DATE = today
+                existing_order = self.find_existing_order(order_data)
+                if existing_order is not None:
+                    existing_order.QTE += 1
+                    self.order_index.update(existing_order)
+                    merged += 1
+                else:
+                    self.add_order(order_data)
+                    added += 1
+            
+            self.update_tree_display()
+            self.status_label.config(text="Prêt", foreground='green')
+            
+            summary = (f"Scans dans le lot: {len(payloads)}\n"
+                       f"Commandes ajoutées: {added}\n"
+                       f"Quantités mises à jour: {merged}\n"
+                       f"Rejetés: {len(rejected)}")
+            if rejected:
+                details = "\n".join(f"  {key}: {reason}" for key, reason in rejected[:15])
+                if len(rejected) > 15:
+                    details += f"\n  ... et {len(rejected) - 15} autre(s)"
+                summary += f"\n\n{details}"
+            messagebox.showinfo("Import par Lot", summary)
+            
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Erreur lors du traitement du lot: {str(e)}")
+            self.status_label.config(text="Erreur", foreground='red')
             
     def process_scanned_data(self, event=None):
         """Process the scanned QR code data"""
@@ -292,14 +422,15 @@ class OrderPrepareApp:
                     return
                 
                 # Check for duplicates
-                existing_index = self.find_existing_order(order_data)
-                if existing_index is not None:
+                existing_order = self.find_existing_order(order_data)
+                if existing_order is not None:
                     # Update quantity instead of adding duplicate
-                    self.orders_data[existing_index].QTE += 1
+                    existing_order.QTE += 1
+                    self.order_index.update(existing_order)
                     messagebox.showinfo("Info", f"Quantité mise à jour pour {order_data.REFERENCE}")
                 else:
                     # Add new order
-                    self.orders_data.append(order_data)
+                    self.add_order(order_data)
                     messagebox.showinfo("Succès", f"Commande ajoutée: {order_data.REFERENCE} (Client ID: {order_data.ID})")
                 
                 self.update_tree_display()
@@ -316,48 +447,12 @@ class OrderPrepareApp:
     def parse_qr_data(self, qr_data: str):
         """Parse QR code data to extract order information"""
         try:
-            order_data = OrderData()
-            chassis_number = ""
-            
-            # Check if data contains line breaks (structured format)
-            if '\n' in qr_data or '\r' in qr_data:
-                lines = qr_data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-                lines = [line.strip() for line in lines]
-                
-                # Check if first line starts with asterisk (legacy format)
-                if lines and lines[0].startswith('*') and lines[0].endswith('*'):
-                    # Legacy format
-                    if len(lines) >= 6:
-                        order_data.REFERENCE = lines[0][1:-1] if lines[0].startswith('*') else lines[0]
-                        order_data.DESIGNATION = lines[1] if len(lines) > 1 else ""
-                        # Chassis number is in line 5 for legacy format
-                        chassis_number = lines[5] if len(lines) > 5 else ""
-                else:
-                    # New structured format
-                    if len(lines) >= 4:
-                        order_data.REFERENCE = lines[0]
-                        order_data.DESIGNATION = lines[2] if len(lines) > 2 else ""
-                        chassis_number = lines[3] if len(lines) > 3 else ""
-            else:
-                # Single line input
-                if '*' in qr_data:
-                    # Extract reference between asterisks
-                    import re
-                    asterisk_match = re.search(r'\*([^*]+)\*', qr_data)
-                    if asterisk_match:
-                        order_data.REFERENCE = asterisk_match.group(1)
-                        # Extract remaining data
-                        remaining = qr_data[asterisk_match.end():].strip()
-                        if remaining:
-                            order_data.DESIGNATION = remaining
-                        chassis_number = ""
-                else:
-                    # Simple format
-                    order_data.REFERENCE = qr_data
-                    chassis_number = ""
+            order_data, chassis_number = parse_order_payload(qr_data)
+            if order_data is None:
+                print(f"DEBUG - No reference found in QR data")
+                return None
             
             # Fetch client ID from chassis number if available
-            order_data.ID = ""  # Initialize as empty
             if chassis_number:
                 try:
                     print(f"DEBUG - Attempting to fetch client info for chassis: {chassis_number}")
@@ -373,16 +468,7 @@ class OrderPrepareApp:
             else:
                 print(f"DEBUG - No chassis number found in QR data")
             
-            # Set default quantity
-            order_data.QTE = 1
-            order_data.PREPARED = False
-            
-            # Return order data only if we have a reference (minimum requirement)
-            if order_data.REFERENCE:
-                return order_data
-            else:
-                print(f"DEBUG - No reference found in QR data")
-                return None
+            return order_data
             
         except Exception as e:
             print(f"Error parsing QR data: {e}")
@@ -428,11 +514,12 @@ class OrderPrepareApp:
 
     def find_existing_order(self, order_data):
         """Find existing order with same reference and client ID"""
-        for i, existing_order in enumerate(self.orders_data):
-            if (existing_order.REFERENCE == order_data.REFERENCE and 
-                existing_order.ID == order_data.ID):
-                return i
-        return None
+        return self.order_index.find(order_data.REFERENCE, order_data.ID)
+    
+    def add_order(self, order):
+        """Append a new order line"""
+        self.orders_data.append(order)
+        self.order_index.add(order)
         
     def clear_scanner_input(self):
         """Clear the scanner input field"""
@@ -441,78 +528,91 @@ class OrderPrepareApp:
         
     def update_tree_display(self):
         """Update the treeview display"""
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
         # Apply search filter
         search_term = self.search_var.get().lower()
         filter_value = self.filter_var.get()
         
+        # Apply preparation filter on the PREPARED column
+        if filter_value == "Préparés":
+            indexes = self.orders_data.equal('PREPARED', True)
+        elif filter_value == "Non Préparés":
+            indexes = self.orders_data.equal('PREPARED', False)
+        else:
+            indexes = range(len(self.orders_data))
+        
         # Filter data
-        filtered_data = []
-        for order in self.orders_data:
+        iids = []
+        self.tree_rows = {}
+        for index in indexes:
+            order = self.orders_data[index]
             # Apply search filter
-            if search_term:
-                searchable_text = f"{order.DATE} {order.ID} {order.DESIGNATION} {order.REFERENCE}".lower()
-                if search_term not in searchable_text:
-                    continue
-                    
-            # Apply preparation filter
-            if filter_value == "Préparés" and not order.PREPARED:
-                continue
-            elif filter_value == "Non Préparés" and order.PREPARED:
+            if search_term and search_term not in search_blob(order):
                 continue
                 
-            filtered_data.append(order)
+            item = row_id(order)
+            iids.append(item)
+            self.tree_rows[item] = index
         
-        # Add filtered data to tree
-        for order in filtered_data:
-            prepared_text = "Oui" if order.PREPARED else "Non"
-            values = (order.DATE, order.ID, order.DESIGNATION, order.REFERENCE, order.QTE, prepared_text)
-            
-            # Color coding
-            if order.PREPARED:
-                item = self.tree.insert('', 'end', values=values, tags=('prepared',))
-            else:
-                item = self.tree.insert('', 'end', values=values, tags=('unprepared',))
+        # Sorted column kept across refreshes
+        iids = self.sorter.order(iids, lambda item: self.orders_data[self.tree_rows[item]])
+        self.table.set_rows(iids, self.render_row)
         
-        # Configure tags for color coding
-        self.tree.tag_configure('prepared', background='#d4edda', foreground='#155724')
-        self.tree.tag_configure('unprepared', background='#fff3cd', foreground='#856404')
+    def render_row(self, item):
+        """(values, tags) of a table row"""
+        order = self.orders_data[self.tree_rows[item]]
+        prepared_text = "Oui" if order.PREPARED else "Non"
+        values = (order.DATE, order.ID, order.DESIGNATION, order.REFERENCE, order.QTE, prepared_text)
+        
+        # Color coding
+        return values, ('prepared',) if order.PREPARED else ('unprepared',)
         
     def on_search_change(self, *args):
-        """Handle search input changes"""
+        """Handle search input changes (the table is refreshed once typing pauses)"""
+        if self.search_timer is not None:
+            self.root.after_cancel(self.search_timer)
+        self.search_timer = self.root.after(SEARCH_DEBOUNCE_MS, self.run_search)
+        
+    def run_search(self):
+        self.search_timer = None
         self.update_tree_display()
         
     def on_filter_change(self, event=None):
         """Handle filter changes"""
         self.update_tree_display()
         
+    def sort_column(self, col):
+        """Sort table rows by column (clicking the sorted column again reverses it)"""
+        self.sorter.sort_by(col)
+        for column, text in self.headings.items():
+            if column == self.sorter.column:
+                text += " ▼" if self.sorter.reverse else " ▲"
+            self.tree.heading(column, text=text)
+        self.table.top = 0
+        self.update_tree_display()
+        
     def on_item_double_click(self, event):
         """Handle double-click on tree item"""
         self.toggle_preparation_status()
         
     def toggle_preparation_status(self):
-        """Toggle preparation status of selected item"""
-        selected = self.tree.selection()
+        """Toggle preparation status of the selected item(s)"""
+        selected = self.table.selection()
         if not selected:
             messagebox.showwarning("Attention", "Veuillez sélectionner une commande")
             return
             
-        item = selected[0]
-        values = self.tree.item(item, 'values')
-        
-        if values:
-            # Find the order in data
-            for order in self.orders_data:
-                if (order.DATE == values[0] and order.ID == values[1] and 
-                    order.REFERENCE == values[3]):
-                    order.PREPARED = not order.PREPARED
-                    status = "préparée" if order.PREPARED else "non préparée"
-                    messagebox.showinfo("Succès", f"Commande marquée comme {status}")
-                    self.update_tree_display()
-                    break
+        orders = [self.orders_data[self.tree_rows[item]] for item in selected if item in self.tree_rows]
+        if not orders:
+            return
+        for order in orders:
+            order.PREPARED = not order.PREPARED
+            self.order_index.update(order)
+        if len(orders) == 1:
+            status = "préparée" if orders[0].PREPARED else "non préparée"
+            messagebox.showinfo("Succès", f"Commande marquée comme {status}")
+        else:
+            messagebox.showinfo("Succès", f"Statut de {len(orders)} commandes inversé")
+        self.update_tree_display()
                     
     def open_manual_entry_dialog(self):
         """Open dialog for manual entry"""
@@ -604,12 +704,13 @@ class OrderPrepareApp:
                 order.PREPARED = prepared_var.get()
                 
                 # Check for duplicates
-                existing_index = self.find_existing_order(order)
-                if existing_index is not None:
-                    self.orders_data[existing_index].QTE += order.QTE
+                existing_order = self.find_existing_order(order)
+                if existing_order is not None:
+                    existing_order.QTE += order.QTE
+                    self.order_index.update(existing_order)
                     messagebox.showinfo("Info", "Quantité mise à jour pour cette commande")
                 else:
-                    self.orders_data.append(order)
+                    self.add_order(order)
                     messagebox.showinfo("Succès", "Commande ajoutée avec succès")
                 
                 self.update_tree_display()
@@ -627,21 +728,14 @@ class OrderPrepareApp:
         
     def edit_selected_record(self):
         """Edit the selected record"""
-        selected = self.tree.selection()
+        selected = self.table.selection()
         if not selected:
             messagebox.showwarning("Attention", "Veuillez sélectionner une commande")
             return
             
-        item = selected[0]
-        values = self.tree.item(item, 'values')
-        
-        if values:
-            # Find the order in data
-            for i, order in enumerate(self.orders_data):
-                if (order.DATE == values[0] and order.ID == values[1] and 
-                    order.REFERENCE == values[3]):
-                    self.open_edit_dialog(i)
-                    break
+        index = self.tree_rows.get(selected[0])
+        if index is not None:
+            self.open_edit_dialog(index)
                     
     def open_edit_dialog(self, index):
         """Open dialog to edit an order"""
@@ -718,12 +812,14 @@ class OrderPrepareApp:
                     messagebox.showerror("Erreur", "Veuillez entrer une quantité valide (nombre entier positif)")
                     return
                 
+                self.order_index.remove(order)
                 self.orders_data[index].DATE = date_var.get().strip() or datetime.now().strftime("%d/%m/%Y")
                 self.orders_data[index].ID = selected_client_id.get().strip()
                 self.orders_data[index].DESIGNATION = designation_var.get().strip()
                 self.orders_data[index].REFERENCE = reference_var.get().strip()
                 self.orders_data[index].QTE = qte
                 self.orders_data[index].PREPARED = prepared_var.get()
+                self.order_index.add(order)
                 
                 self.update_tree_display()
                 messagebox.showinfo("Succès", "Commande modifiée avec succès")
@@ -741,7 +837,7 @@ class OrderPrepareApp:
         
     def delete_selected_record(self):
         """Delete the selected record(s) - updated to handle multiple selection"""
-        selected = self.tree.selection()
+        selected = self.table.selection()
         if not selected:
             messagebox.showwarning("Attention", "Veuillez sélectionner une commande")
             return
@@ -751,7 +847,7 @@ class OrderPrepareApp:
     
     def on_delete_key(self, event):
         """Handle delete key press to delete selected items"""
-        selected = self.tree.selection()
+        selected = self.table.selection()
         if not selected:
             return
             
@@ -764,21 +860,12 @@ class OrderPrepareApp:
             
         if messagebox.askyesno("Confirmation", message):
             # Collect orders to delete based on selection
-            orders_to_delete = []
-            
-            for item in selected:
-                values = self.tree.item(item, 'values')
-                if values:
-                    # Find the order in data
-                    for i, order in enumerate(self.orders_data):
-                        if (order.DATE == values[0] and order.ID == values[1] and 
-                            order.REFERENCE == values[3]):
-                            orders_to_delete.append(i)
-                            break
+            orders_to_delete = [self.orders_data[self.tree_rows[item]] for item in selected if item in self.tree_rows]
             
-            # Delete orders in reverse order to maintain indices
-            for index in sorted(orders_to_delete, reverse=True):
-                del self.orders_data[index]
+            # Single pass over the list instead of one deletion per order
+            for order in orders_to_delete:
+                self.order_index.remove(order)
+            self.orders_data.remove_records(orders_to_delete)
             
             self.update_tree_display()
             
@@ -788,38 +875,27 @@ class OrderPrepareApp:
                 messagebox.showinfo("Succès", f"{count} commandes supprimées")
         
     def load_excel_file(self):
-        """Load data from Excel file"""
+        """Load data from an order file (Excel, CSV, Parquet or SQLite, by extension)"""
         file_path = filedialog.askopenfilename(
             title="Charger fichier Excel",
-            filetypes=[("Excel files", "*.xlsx *.xls"), ("All files", "*.*")]
+            filetypes=OPEN_FILE_TYPES
         )
         
         if file_path:
             try:
-                df = pd.read_excel(file_path)
-                
-                # Verify columns
-                required_columns = ["DATE", "ID", "DESIGNATION", "REFERENCE", "QTE", "PREPARED"]
-                missing_columns = [col for col in required_columns if col not in df.columns]
-                
-                if missing_columns:
-                    messagebox.showerror("Erreur", f"Colonnes manquantes: {', '.join(missing_columns)}")
+                # Read the whole file first: the current orders stay if it is invalid
+                try:
+                    orders = list(read_records(file_path, MODE_COMMANDE))
+                except MissingColumnsError as e:
+                    messagebox.showerror("Erreur", str(e))
                     return
                 
                 # Load data
-                self.orders_data = []
-                for _, row in df.iterrows():
-                    order = OrderData()
-                    order.DATE = str(row["DATE"]) if pd.notna(row["DATE"]) else ""
-                    order.ID = str(row["ID"]) if pd.notna(row["ID"]) else ""
-                    order.DESIGNATION = str(row["DESIGNATION"]) if pd.notna(row["DESIGNATION"]) else ""
-                    order.REFERENCE = str(row["REFERENCE"]) if pd.notna(row["REFERENCE"]) else ""
-                    order.QTE = int(row["QTE"]) if pd.notna(row["QTE"]) else 1
-                    order.PREPARED = bool(row["PREPARED"]) if pd.notna(row["PREPARED"]) else False
-                    
-                    self.orders_data.append(order)
+                self.orders_data = ColumnStore(OrderData, orders)
+                self.order_index.rebuild(self.orders_data)
                 
                 self.excel_file = file_path
+                self.journal.load(self.orders_data, file_path)
                 self.update_tree_display()
                 messagebox.showinfo("Succès", f"Fichier chargé: {len(self.orders_data)} commandes")
                 
@@ -837,33 +913,59 @@ class OrderPrepareApp:
             file_path = filedialog.asksaveasfilename(
                 title="Sauvegarder fichier Excel",
                 defaultextension=".xlsx",
-                filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
+                filetypes=FILE_TYPES
             )
             
         if file_path:
-            try:
-                # Convert data to DataFrame
-                data_dicts = []
-                for order in self.orders_data:
-                    data_dict = asdict(order)
-                    data_dicts.append(data_dict)
-                
-                df = pd.DataFrame(data_dicts)
-                
-                # Save to Excel
-                df.to_excel(file_path, index=False)
-                
-                self.excel_file = file_path
-                messagebox.showinfo("Succès", f"Fichier sauvegardé: {file_path}")
+            self.excel_file = file_path
+            # Written in the background; a save requested meanwhile follows it
+            if not self.save_worker.request(self.prepare_save, self.on_save_done):
+                self.status_label.config(text="Sauvegarde en attente...", foreground='blue')
                 
-            except Exception as e:
-                messagebox.showerror("Erreur", f"Erreur lors de la sauvegarde: {str(e)}")
+    def prepare_save(self):
+        """Copy what the save has to write (UI thread); returns the task of the save worker"""
+        if not self.excel_file or not self.orders_data:
+            return None  # Cleared since the save was requested
+        # Only new and edited orders are written once the file exists
+        plan = self.save_plan = self.saver.plan(self.excel_file, self.orders_data, ORDER_FIRST_ROW)
+        self.save_point = self.journal.save_point()
+        self.status_label.config(text="Sauvegarde en cours...", foreground='blue')
+        
+        def write(report):
+            with self.journal.file_lock:  # Not while the journal compacts into the same file
+                return self.saver.write(plan, report)
+        return write
+        
+    def on_save_done(self, result, error):
+        """Outcome of a background save (UI thread)"""
+        plan, self.save_plan = self.save_plan, None
+        if error is not None:
+            if plan is not None:
+                self.saver.failed(plan)
+                self.journal.save_failed()
+            if isinstance(error, WorkbookPatchError):
+                print(f"Sauvegarde partielle impossible ({error}), réécriture complète")
+                self.save_worker.request(self.prepare_save, self.on_save_done)
+                return
+            self.status_label.config(text="Erreur de sauvegarde", foreground='red')
+            messagebox.showerror("Erreur", f"Erreur lors de la sauvegarde: {str(error)}")
+            return
+        status, _, signature = result
+        self.saver.finished(plan, signature)
+        # Only now: a crash during the write must still offer the journal's session
+        self.journal.mark_saved(plan.filename, self.save_point)
+        # Reported in the status line: a dialog would take the focus from the scanner
+        if status == SAVE_UNCHANGED:
+            self.status_label.config(text="Aucune modification depuis la dernière sauvegarde", foreground='green')
+        else:
+            self.status_label.config(text=f"Fichier sauvegardé: {plan.filename}", foreground='green')
                 
     def clear_all_data(self):
         """Clear all data and start new file"""
         if self.orders_data:
             if messagebox.askyesno("Confirmation", "Êtes-vous sûr de vouloir effacer toutes les données?"):
-                self.orders_data = []
+                self.orders_data.clear()
+                self.order_index.clear()
                 self.excel_file = None
                 self.update_tree_display()
                 messagebox.showinfo("Succès", "Données effacées")
@@ -873,6 +975,8 @@ class OrderPrepareApp:
     def run(self):
         """Run the application"""
         self.root.mainloop()
+        self.save_worker.wait()
+        self.journal.close()
 
     def open_api_client_selection_dialog(self):
         """Open dialog to search and select a client using API"""
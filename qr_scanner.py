@@ -12,7 +12,6 @@ from PIL import Image, ImageTk, ImageDraw
 import os
 import sys # Import sys to get the executable path
 import subprocess # Import subprocess for launching the new instance
-from dataclasses import dataclass, asdict
 import logging
 import builtins
 import re
@@ -20,9 +19,38 @@ import re
 # --- Auto-Updater Dependencies ---
 import requests
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import time
 import shutil
 from datetime import datetime
+from operator import attrgetter
+
+# --- Shared scanning modules ---
+from movement_ledger import MovementLedger, parse_movement_datetime, ACTION_SORTIE, ACTION_RETOUR
+from movement_store import MovementStore
+from records import (ProductData, SortieData, RetourData, RecordIndex, data_type_of, record_key, row_id,
+                     RECORD_CLASSES, MODE_ENTREE)
+from qr_parsing import parse_payload, split_payloads, FORMAT_STRUCTURED, FORMAT_PLAIN
+from scanner_input import ScanBuffer, SCANNER_SUFFIXES, DEFAULT_GAP_MS, KEYSYM_CHARS
+from scanner_device import open_scanner_reader
+from tree_view import VirtualTable, SEARCH_DEBOUNCE_MS
+from search_index import TrigramIndex, MIN_QUERY_LENGTH
+from table_sort import TableSorter
+from columnar import ColumnStore
+from categories import register_values
+from journal import ScanJournal
+from excel_io import (read_movement_file, MovementColumnsNotFound, ChassisColumnNotFound, record_columns, IncrementalSaver,
+                      SAVE_UNCHANGED, MOVEMENT_HEADER_ROW, WorkbookPatchError)
+from save_worker import SaveWorker
+from storage_formats import read_records, write_records, is_patchable, FILE_TYPES, OPEN_FILE_TYPES
+from scan_pipeline import (ScanQueue, DEFAULT_QUEUE_SIZE, STAGE_PARSED, STAGE_ENRICHED,
+                           STAGE_VALIDATED, STAGE_COMMITTED, STAGE_REJECTED)
+
+# Client column text of a Sortie/Retour row whose client lookup is running
+ENRICHMENT_PENDING = "⏳ Recherche client..."
+# Lookup failure of a moto not reserved by any client: the row is refused
+NOT_RESERVED = "Moto non réservée"
 
 #! REMOVE AFTER SSL FIX - Disable SSL warnings for app.diardzair.com.dz
 import urllib3
@@ -41,16 +69,25 @@ def get_remote_package_url():
     """Get the download URL for the latest release"""
     return GITHUB_LATEST_DOWNLOAD_URL
 
+def app_data_dir():
+    """Directory of the log files and the local movement database"""
+    if getattr(sys, 'frozen', False):
+        # Running as compiled executable
+        return os.path.dirname(sys.executable)
+    # Running as script
+    return os.path.dirname(os.path.abspath(__file__))
+
+# Local database of every saved/imported Sortie/Retour movement
+MOVEMENT_DB_FILENAME = "Mouvement Stock.db"
+# Fields of a saved Sortie/Retour row that make its movement
+MOVEMENT_COLUMNS = ('N_CHASSIS', 'Date', 'Heure')
+# Write-ahead journal of the current session (restored after a crash)
+JOURNAL_FILENAME = "Mouvement Stock.journal"
+
 # --- Logging Configuration ---
 def setup_logging():
     """Configure logging to redirect all prints to a log file"""
-    # Create logs directory if it doesn't exist
-    if getattr(sys, 'frozen', False):
-        # Running as compiled executable
-        log_dir = os.path.dirname(sys.executable)
-    else:
-        # Running as script
-        log_dir = os.path.dirname(os.path.abspath(__file__))
+    log_dir = app_data_dir()
     
     log_file = os.path.join(log_dir, f"Mouvement Stock_{datetime.now().strftime('%Y%m%d')}.log")
     
@@ -107,40 +144,6 @@ def resource_path(relative_path):
     
     return os.path.join(base_path, relative_path)
 
-@dataclass
-class ProductData:
-    """Data structure for product information - Entrée type"""
-    Reference: str = ""
-    Fournisseur: str = ""
-    Designation: str = ""
-    Num_Chasse: str = ""
-    Couleur: str = ""
-    Lot: str = ""
-    Magasin: str = ""  # Will be left blank
-    Relation: str = ""
-
-@dataclass
-class SortieData:
-    """Data structure for sortie information - Sortie type"""
-    Date: str = ""
-    Heure: str = ""
-    DESIGNATION: str = "MOTOS"
-    N_CHASSIS: str = ""
-    ID_CLIENT: str = ""
-    NOM_PRENOM: str = ""
-    WILAYA: str = ""
-
-@dataclass
-class RetourData:
-    """Data structure for retour information - Retour type"""
-    Date: str = ""
-    Heure: str = ""
-    DESIGNATION: str = "MOTOS"
-    N_CHASSIS: str = ""
-    ID_CLIENT: str = ""
-    NOM_PRENOM: str = ""
-    WILAYA: str = ""
-
 class QRScannerApp:    
     def __init__(self):
         self.root = tk.Tk()
@@ -172,12 +175,26 @@ class QRScannerApp:
         # Configure encoding for French characters
         self.root.option_add('*Font', 'TkDefaultFont')
           # Data storage
-        self.products_data = []
+        self.products_data = ColumnStore(RECORD_CLASSES[MODE_ENTREE])  # Session records, column by column
+        self.saver = IncrementalSaver(  # Appends/patches rows of the saved file (xlsx), rewrites other formats
+            lambda filename, rows, progress: write_records(filename, rows, data_type_of(rows.record_class), progress),
+            is_patchable)
+        self.save_worker = SaveWorker(self.root)  # Excel writes, off the UI thread
+        self.save_plan = None  # SavePlan being written by save_worker
+        self.save_point = None  # Journal point of that save (journal.save_point)
+        self.search_index = TrigramIndex()  # Substring search over products_data, built in the background
+        self.sorter = TableSorter()  # Sorted column of the table and cached sort orders
+        self.journal = ScanJournal(os.path.join(app_data_dir(), JOURNAL_FILENAME),  # Every change of products_data, before saving
+                                   write_records, self.on_journal_saved)
+        self.record_index = RecordIndex(  # Duplicate keys of products_data
+            followers=(self.search_index, self.sorter, self.journal))
+        self.tree_rows = {}  # Treeview iid (stable row id) -> index in products_data, set by update_tree_display
+        self.row_positions = {}  # Row id -> index in products_data (checked before use)
         self.excel_file = None
         self.data_type = "Entrée"  # Can be "Entrée", "Sortie", or "Retour"
         
-        # Track sortie/retour history for chronological validation
-        self.sortie_retour_history = {}  # {chassis_number: [(timestamp, action), ...]}
+        # Sortie/Retour movements of every day (local database) for chronological validation
+        self.movement_store = self.open_movement_store()
         
         # Files for cross-referencing sorties and retours
         self.sortie_file_data = []  # Data from sortie Excel file
@@ -192,9 +209,21 @@ class QRScannerApp:
 
         
         # Scanner state
-        self.scanning = False
-        self.scan_buffer = ""
+        self.scanning = False  # True while a scan ticket is being processed
+        self.scan_queue = ScanQueue()  # Scans waiting for processing (bounded)
+        self.current_ticket = None
+        self.enrichment_tickets = {}  # {chassis_number: ticket} for background client lookups
+        self.scan_buffer = ScanBuffer()  # Characters of the scan being received
         self.scan_timer = None  # Timer for auto-processing scanned data
+        self.scan_timer_due = 0.0  # When that timer should fire (time.monotonic)
+        self.search_timer = None  # Debounced table refresh while typing a search
+        self.device_reader = None  # Background reader of a scanner device (optional)
+        self.device_queue = queue.Queue(maxsize=DEFAULT_QUEUE_SIZE)  # Payloads read by the device reader
+        self.device_poll_timer = None
+        
+        # Asynchronous client enrichment for Sortie/Retour
+        self.enrichment_executor = ThreadPoolExecutor(max_workers=4)
+        self.enrichment_status = {}  # {chassis_number: ENRICHMENT_PENDING or error reason}
         
         # Static client list for Sortie type
         self.clients = [
@@ -221,20 +250,61 @@ class QRScannerApp:
             "Ghardaïa", "Relizane", "Timimoun", "Bordj Badji Mokhtar", "Ouled Djellal", "Béni Abbès",
             "In Salah", "In Guezzam", "Touggourt", "Djanet", "El M'Ghair", "El Meniaa"
         ]
+        register_values('WILAYA', self.wilayas)  # Shared WILAYA dictionary of the column stores
         
         self.setup_ui()
         self.setup_scanner_listener()
         self.setup_updater_menu() # Setup the new Help menu item
+        self.restore_journal_session()
     
     # --- New Updater UI Setup ---
 
 
+    def restore_journal_session(self):
+        """Offer to restore the unsaved session of the journal, then start journaling"""
+        session = None
+        try:
+            session = self.journal.recover()
+        except Exception as e:
+            print(f"Warning: Could not read the journal: {e}")
+        if session and messagebox.askyesno(
+                "Session Non Enregistrée",
+                f"Une session non enregistrée a été trouvée ({len(session.records)} lignes, "
+                f"type '{session.mode}').\nVoulez-vous la restaurer?"):
+            self.data_type_var.set(session.mode)
+            self.on_data_type_change()
+            self.products_data.extend(session.records)
+            self.record_index.extend(self.products_data)
+            self.excel_file = session.filename
+            if self.excel_file:
+                self.file_label.config(text=f"Restauré: {os.path.basename(self.excel_file)}")
+            self.journal.start(self.products_data, self.excel_file)
+            self.update_tree_display()
+        else:
+            self.journal.start()
+
+    def open_movement_store(self):
+        """Open the local movement database (in-memory ledger if it cannot be opened)"""
+        db_path = os.path.join(app_data_dir(), MOVEMENT_DB_FILENAME)
+        try:
+            store = MovementStore(db_path)
+            print(f"Movement store opened: {db_path} ({store.count()} movements)")
+            return store
+        except Exception as e:
+            print(f"Warning: Could not open movement store {db_path}: {e}")
+            return MovementLedger()
+    
     def setup_updater_menu(self):
         """Adds the 'Check for Updates' menu item."""
         menubar = tk.Menu(self.root)
         self.root.config(menu=menubar)
 
         # Existing menus (File, Edit, etc. would go here)
+        scanner_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Scanner", menu=scanner_menu)
+        scanner_menu.add_command(label="Connecter un Scanner (Série/USB/HID)...", command=self.connect_scanner_device)
+        scanner_menu.add_command(label="Déconnecter le Scanner", command=self.disconnect_scanner_device)
+        
         help_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Aide", menu=help_menu)
         
@@ -278,9 +348,11 @@ class QRScannerApp:
                   command=self.save_excel_file).grid(row=0, column=1, padx=5)
         ttk.Button(file_frame, text="Effacer Toutes Données", 
                   command=self.clear_all_data).grid(row=0, column=2, padx=5)
+        ttk.Button(file_frame, text="Importer Lot de Scans", 
+                  command=self.import_scan_batch_file).grid(row=0, column=3, padx=5)
         
         self.file_label = ttk.Label(file_frame, text="Aucun fichier chargé")
-        self.file_label.grid(row=1, column=0, columnspan=3, pady=(10, 0))
+        self.file_label.grid(row=1, column=0, columnspan=4, pady=(10, 0))
           # Scanner frame
         scanner_frame = ttk.LabelFrame(main_frame, text="Scanner de Codes QR", padding="10")
         scanner_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
@@ -303,13 +375,37 @@ class QRScannerApp:
         self.scanner_entry.configure(yscrollcommand=scanner_scrollbar.set)
         
         # Bind events (note: Text widget uses different event handling)
-        self.scanner_entry.bind('<KeyRelease>', self.on_scanner_input)
+        self.scanner_entry.bind('<Key>', self.on_scanner_input)
+        self.scanner_entry.bind('<<Paste>>', self.on_scanner_paste)
         scanner_frame.columnconfigure(1, weight=1)
         
+        # Scanner settings: suffix sent after each scan and inter-character gap
+        settings_frame = ttk.Frame(scanner_frame)
+        settings_frame.grid(row=1, column=1, padx=(10, 0), pady=(5, 0), sticky=tk.W)
+        ttk.Label(settings_frame, text="Suffixe scanner:").pack(side='left', padx=(0, 5))
+        self.scanner_suffix_var = tk.StringVar(value="Aucun")
+        suffix_combo = ttk.Combobox(settings_frame, textvariable=self.scanner_suffix_var, width=8,
+                                    values=list(SCANNER_SUFFIXES), state="readonly")
+        suffix_combo.pack(side='left', padx=(0, 15))
+        suffix_combo.bind('<<ComboboxSelected>>', self.on_scanner_settings_change)
+        ttk.Label(settings_frame, text="Délai inter-caractères (ms):").pack(side='left', padx=(0, 5))
+        self.scanner_gap_var = tk.StringVar(value=str(DEFAULT_GAP_MS))
+        self.scanner_gap_var.trace('w', lambda *args: self.on_scanner_settings_change())
+        ttk.Spinbox(settings_frame, textvariable=self.scanner_gap_var, from_=20, to=500, increment=10,
+                    width=6).pack(side='left', padx=(0, 15))
+        # Sortie/Retour: add the row at once and fetch the client in the background
+        self.async_enrichment_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(settings_frame, text="Client en arrière-plan",
+                        variable=self.async_enrichment_var).pack(side='left')
+        
         # Status
         self.status_label = ttk.Label(scanner_frame, text="Ready to scan...", 
                                      foreground="green")
         self.status_label.grid(row=2, column=0, columnspan=2, pady=(10, 0))
+        
+        # Scan queue depth and per-stage latency
+        self.pipeline_label = ttk.Label(scanner_frame, text=self.scan_queue.status_text(), foreground="gray")
+        self.pipeline_label.grid(row=3, column=0, columnspan=2)
           # Data display frame
         data_frame = ttk.LabelFrame(main_frame, text="Données Produits", padding="10")
         data_frame.grid(row=4, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
@@ -346,20 +442,24 @@ class QRScannerApp:
                   'Couleur', 'Lot', 'Magasin', 'Relation')
         
         self.tree = ttk.Treeview(data_frame, columns=columns, show='headings', height=10)
+        self.tree.tag_configure('pending', foreground='orange')
+        self.tree.tag_configure('flagged', background='#ffd6d6')
         
         # Configure column headings and widths with sorting
         for col in columns:
             self.tree.heading(col, text=col.replace('_', ' '), 
-                            command=lambda c=col: self.sort_column(c, False))
+                            command=lambda c=col: self.sort_column(c))
             self.tree.column(col, width=120, minwidth=80)
         
         # Enable editing on double-click
         self.tree.bind('<Double-1>', self.on_item_double_click)
         
         # Scrollbars
-        v_scrollbar = ttk.Scrollbar(data_frame, orient="vertical", command=self.tree.yview)
+        v_scrollbar = ttk.Scrollbar(data_frame, orient="vertical")
         h_scrollbar = ttk.Scrollbar(data_frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        # Only the visible rows are Treeview items; the table scrolls over the model
+        self.table = VirtualTable(self.tree, v_scrollbar)
         
         # Grid layout
         self.tree.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -401,7 +501,9 @@ class QRScannerApp:
                 icon='warning'
             )
             if result:
-                self.products_data = []
+                self.products_data.clear()
+                self.record_index.clear()
+                self.enrichment_status = {}
                 self.update_tree_display()
             else:
                 # Revert the selection
@@ -417,6 +519,7 @@ class QRScannerApp:
         
         # Store previous type for better reversion logic
         self.previous_type = self.data_type
+        self.products_data = ColumnStore(RECORD_CLASSES[self.data_type])
         
         # Update the UI components based on data type
         self.setup_dynamic_ui()
@@ -449,10 +552,11 @@ class QRScannerApp:
         for col in self.tree['columns']:
             self.tree.heading(col, text="")
         
-        # Configure new column headings
+        # Configure new column headings (back to scan order)
+        self.sorter.reset()
         for col in columns:
             self.tree.heading(col, text=col.replace('_', ' '), 
-                            command=lambda c=col: self.sort_column(c, False))
+                            command=lambda c=col: self.sort_column(c))
             self.tree.column(col, width=120, minwidth=80)
           # Update filter dropdown values
         if hasattr(self, 'filter_combo'):
@@ -504,40 +608,409 @@ class QRScannerApp:
         """Ignore Enter key press to prevent accidental processing"""
         return "break"  # This prevents the default Enter key behavior
     
+    def on_scanner_settings_change(self, event=None):
+        """Apply the scanner suffix and inter-character gap settings"""
+        try:
+            gap_ms = int(self.scanner_gap_var.get())
+        except ValueError:
+            gap_ms = DEFAULT_GAP_MS
+        self.scan_buffer.configure(SCANNER_SUFFIXES.get(self.scanner_suffix_var.get()), gap_ms)
+    
     def on_scanner_input(self, event):
-        """Handle scanner input in real-time"""
-        current_text = self.scanner_entry.get("1.0", tk.END).strip()
+        """Handle scanner input in real-time, one keystroke at a time"""
+        if event.keysym == 'BackSpace':
+            self.scan_buffer.backspace()
+            return
+        char = KEYSYM_CHARS.get(event.keysym, event.char)
+        if not char or ((char < ' ' or char == '\x7f') and char not in '\r\n\t'):
+            return  # Modifier, navigation, Delete or shortcut key
+        
+        is_suffix = char == self.scan_buffer.suffix
+        # Gaps are measured between key events, not between their (possibly delayed) handling
+        payload = self.scan_buffer.feed(char, event.time / 1000.0 if event.time else None)
+        if payload:
+            self.commit_scan(payload)
+        elif len(self.scan_buffer) == 1:
+            self.status_label.config(text="Receiving data...", foreground="orange")
         
-        # Ensure proper encoding for French characters
-        if current_text:
+        # The scan completes once the input has been idle long enough
+        if len(self.scan_buffer) and self.scan_timer is None:
+            self.arm_scan_timer(self.scan_buffer.gap)
+        if is_suffix:
+            return "break"  # The suffix is not echoed in the input field
+    
+    def on_scanner_paste(self, event):
+        """Process pasted text directly (single scan or list of scans)"""
+        try:
+            text = self.root.clipboard_get()
+        except tk.TclError:
+            return "break"
+        self.scan_buffer.take()
+        if text.strip():
+            self.commit_scan(text.strip())
+        return "break"
+    
+    def arm_scan_timer(self, delay):
+        self.scan_timer_due = time.monotonic() + delay
+        self.scan_timer = self.root.after(max(1, int(delay * 1000)), self.auto_process_scan)
+    
+    def auto_process_scan(self):
+        """Automatically process scan once the scanner has been idle for the configured gap"""
+        self.scan_timer = None
+        remaining = self.scan_buffer.remaining()
+        if remaining is None:
+            return
+        if remaining > 0:
+            # A character arrived since the timer was armed, or the input is typed
+            self.arm_scan_timer(remaining)
+            return
+        if time.monotonic() - self.scan_timer_due > self.scan_buffer.gap:
+            # Late: the UI was busy, keys pressed meanwhile may still be queued
+            self.arm_scan_timer(self.scan_buffer.gap)
+            return
+        payload = self.scan_buffer.take()
+        if payload:
+            self.commit_scan(payload)
+    
+    def commit_scan(self, payload):
+        """Queue a complete scan; it is processed as soon as the previous one is done"""
+        if self.scan_queue.put(payload) is None:
+            # Back-pressure: the operator is told instead of the scan being lost silently
+            self.root.bell()
+            self.status_label.config(text=f"File de scans pleine ({self.scan_queue.maxsize}) - scan refusé, "
+                                          f"rescannez plus tard", foreground="red")
+            self.update_pipeline_status()
+            return
+        self.process_scan_queue()
+    
+    def process_scan_queue(self):
+        """Process queued scans one at a time (no-op while a scan is in progress)"""
+        while not self.scanning:
+            ticket = self.scan_queue.get()
+            if ticket is None:
+                break
+            self.scanning = True
+            self.current_ticket = ticket
+            self.update_pipeline_status()
             try:
-                # Try to encode/decode to ensure proper UTF-8 handling
-                current_text.encode('utf-8').decode('utf-8')
-            except (UnicodeDecodeError, UnicodeEncodeError):
-                # If there are encoding issues, try to fix them
-                current_text = current_text.encode('utf-8', errors='ignore').decode('utf-8')
-        
-        # Cancel any existing timer
-        if self.scan_timer:
-            self.root.after_cancel(self.scan_timer)
-            self.scan_timer = None
+                # A scanner dump or a pasted list holds several payloads
+                payloads = split_payloads(ticket.payload)
+                if len(payloads) > 1:
+                    self.process_batch_data(payloads)
+                else:
+                    self.process_scanned_data(qr_data=ticket.payload)
+            finally:
+                self.scanning = False
+                self.current_ticket = None
+                if not ticket.done and ticket not in self.enrichment_tickets.values():
+                    self.scan_queue.advance(ticket, STAGE_REJECTED)
+                self.update_pipeline_status()
+    
+    def mark_scan(self, stage, reason=None):
+        """Move the scan being processed to the next stage"""
+        self.scan_queue.advance(self.current_ticket, stage, reason)
+        self.update_pipeline_status()
+    
+    def update_pipeline_status(self):
+        """Show the queue depth and stage latencies in the status bar"""
+        self.pipeline_label.config(text=self.scan_queue.status_text())
+    
+    def connect_scanner_device(self):
+        """Read a scanner device directly in a background thread"""
+        from tkinter import simpledialog
+        path = simpledialog.askstring(
+            "Connecter un Scanner",
+            "Port ou périphérique du scanner :\n"
+            "  COM3, /dev/ttyACM0 (série / USB-CDC)\n"
+            "  /dev/input/eventX (HID, Linux)",
+            parent=self.root)
+        if not path or not path.strip():
+            return
+        self.disconnect_scanner_device()
+        try:
+            gap_ms = int(self.scanner_gap_var.get())
+        except ValueError:
+            gap_ms = DEFAULT_GAP_MS
+        suffix = SCANNER_SUFFIXES.get(self.scanner_suffix_var.get())
+        self.device_reader = open_scanner_reader(path.strip(), self.device_queue, suffix, gap_ms)
+        self.device_reader.start()
+        self.root.after(500, self.check_scanner_device)
+        if self.device_poll_timer is None:
+            self.poll_scanner_device()
+    
+    def check_scanner_device(self):
+        """Report a device that could not be opened"""
+        reader = self.device_reader
+        if reader is not None and not reader.is_alive() and reader.error is not None:
+            self.device_reader = None
+            messagebox.showerror("Erreur Scanner", f"Impossible de lire le scanner {reader.path}:\n{reader.error}")
+        elif reader is not None:
+            self.status_label.config(text=f"Scanner connecté: {reader.path}", foreground="green")
+    
+    def disconnect_scanner_device(self):
+        """Stop the background scanner reader"""
+        if self.device_reader is not None:
+            self.device_reader.stop()
+            self.device_reader = None
+            self.status_label.config(text="Scanner déconnecté", foreground="blue")
+    
+    def poll_scanner_device(self):
+        """Drain the device queue from the Tk loop into the scan pipeline"""
+        # Payloads stay in the device queue (and the reader blocks) while the scan queue is full
+        while not self.scan_queue.full():
+            try:
+                payload = self.device_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.commit_scan(payload)
+        if self.device_reader is not None or not self.device_queue.empty():
+            self.device_poll_timer = self.root.after(50, self.poll_scanner_device)
+        else:
+            self.device_poll_timer = None
+    
+    def import_scan_batch_file(self):
+        """Import a text file of scanner payloads (offline dump or list) as one batch"""
+        filename = filedialog.askopenfilename(
+            title="Sélectionner un lot de scans",
+            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if not filename:
+            return
+        try:
+            with open(filename, 'r', encoding='utf-8', errors='ignore') as batch_file:
+                payloads = split_payloads(batch_file.read(), one_per_line=True)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to read file: {str(e)}")
+            return
+        if not payloads:
+            messagebox.showwarning("No Data", "Aucun scan trouvé dans le fichier")
+            return
+        self.scanning = True
+        try:
+            self.process_batch_data(payloads)
+        finally:
+            self.scanning = False
+            # Scans queued while the import and its summary were open
+            self.process_scan_queue()
+
+    def process_batch_data(self, payloads):
+        """Parse, dedupe and validate a batch of payloads, then commit them at once"""
+        accepted = []
+        rejected = []  # (payload key, reason)
+        duplicates = 0
+        try:
+            self.status_label.config(text=f"Traitement du lot ({len(payloads)} scans)...", foreground="blue")
+            self.root.update_idletasks()
+            
+            # Keys already in the session, plus the ones accepted from this batch
+            seen_keys = set(self.record_index)
+            candidates = []
+            for payload in payloads:
+                try:
+                    product_data = self.parse_qr_data(payload)
+                except Exception as e:
+                    rejected.append((payload.splitlines()[0], f"Erreur d'analyse: {e}"))
+                    continue
+                key = record_key(product_data)
+                if not key:
+                    reason = "Référence manquante" if self.data_type == "Entrée" else "Châssis manquant"
+                    rejected.append((payload.splitlines()[0], reason))
+                    continue
+                if key in seen_keys:
+                    duplicates += 1
+                    continue
+                if self.data_type == "Sortie" and not self.can_sortie_chassis(key):
+                    rejected.append((key, "Déjà en sortie"))
+                    continue
+                if self.data_type == "Retour" and not self.can_retour_chassis(key):
+                    rejected.append((key, "Retour impossible"))
+                    continue
+                seen_keys.add(key)
+                candidates.append(product_data)
+            
+            self.mark_scan(STAGE_PARSED)
+            
+            # Commit the whole batch with a single refresh. Sortie/Retour rows are
+            # added pending, their clients fetched on the worker pool (no
+            # confirmation dialog per scan in batch mode)
+            accepted = candidates
+            pending = self.data_type in ["Sortie", "Retour"]
+            if pending:
+                for product_data in accepted:
+                    self.enrichment_status[product_data.N_CHASSIS] = ENRICHMENT_PENDING
+            self.mark_scan(STAGE_VALIDATED)
+            self.products_data.extend(accepted)
+            self.record_index.extend(accepted)
+            self.update_tree_display()
+            self.mark_scan(STAGE_COMMITTED)
+            if pending:
+                for product_data in accepted:
+                    self.start_enrichment(product_data)
+            self.clear_scanner_input()
+            self.status_label.config(text=f"Lot traité: {len(accepted)} ajouté(s), {duplicates} doublon(s), "
+                                          f"{len(rejected)} rejeté(s)"
+                                          + (" - recherche des clients..." if pending and accepted else ""),
+                                     foreground="green" if not rejected else "orange")
+            
+            summary = (f"Scans dans le lot: {len(payloads)}\n"
+                       f"Ajoutés: {len(accepted)}\n"
+                       f"Doublons ignorés: {duplicates}\n"
+                       f"Rejetés: {len(rejected)}")
+            if pending and accepted:
+                summary += "\nClients: recherche en cours (lignes en attente dans le tableau)"
+            if rejected:
+                details = "\n".join(f"  {key}: {reason}" for key, reason in rejected[:15])
+                if len(rejected) > 15:
+                    details += f"\n  ... et {len(rejected) - 15} autre(s)"
+                summary += f"\n\n{details}"
+            messagebox.showinfo("Import par Lot", summary)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to process batch: {str(e)}")
+            self.status_label.config(text="Error processing batch", foreground="red")
         
-        if len(current_text) > 0:
-            self.status_label.config(text="Receiving data...", foreground="orange")
-            # Set timer to auto-process after 250ms of no input
-            self.scan_timer = self.root.after(250, self.auto_process_scan)
+        finally:
+            self.scanning = False
+    
+    def _fetch_client_for_batch(self, num_chassis):
+        """Fetch client info for a batch scan, returning (client, None) or (None, reason)"""
+        try:
+            return self.fetch_client_info_from_chassis(num_chassis), None
+        except Exception as e:
+            if str(e) == "MOTO_NOT_RESERVED":
+                return None, NOT_RESERVED
+            return None, str(e)
+    
+    def validate_new_record(self, product_data):
+        """Check a scanned record against the session and the loaded files (False if refused)"""
+        if self.data_type == "Entrée":
+            # Check for duplicate Reference
+            if product_data.Reference in self.record_index:
+                messagebox.showwarning(
+                    "Doublon Détecté",
+                    f"Un produit avec la référence '{product_data.Reference}' existe déjà.\n"
+                    f"Les doublons ne sont pas autorisés."
+                )
+                self.status_label.config(text="Scan annulé - Doublon détecté", foreground="red")
+                self.clear_scanner_input()
+                return False
+        elif self.data_type == "Sortie":
+            # Check if chassis is already in sortie but not returned
+            if not self.can_sortie_chassis(product_data.N_CHASSIS):
+                messagebox.showwarning(
+                    "Sortie Interdite",
+                    f"Le châssis '{product_data.N_CHASSIS}' est déjà en sortie et n'a pas été retourné.\n"
+                    f"Veuillez effectuer le retour avant une nouvelle sortie."
+                )
+                self.status_label.config(text="Scan annulé - Chassis déjà en sortie", foreground="red")
+                self.clear_scanner_input()
+                return False
+                
+            # Check for duplicate N_CHASSIS in current session
+            if product_data.N_CHASSIS in self.record_index:
+                messagebox.showwarning(
+                    "Doublon Détecté",
+                    f"Une sortie avec le châssis '{product_data.N_CHASSIS}' existe déjà dans cette session.\n"
+                    f"Les doublons ne sont pas autorisés."
+                )
+                self.status_label.config(text="Scan annulé - Doublon détecté", foreground="red")
+                self.clear_scanner_input()
+                return False
+        else:  # Retour
+            # Check if chassis is available for return (must be in sortie and not already returned)
+            if not self.can_retour_chassis(product_data.N_CHASSIS):
+                messagebox.showwarning(
+                    "Retour Impossible",
+                    f"Le châssis '{product_data.N_CHASSIS}' n'est pas disponible pour retour.\n"
+                    f"Il doit d'abord être en sortie et non encore retourné."
+                )
+                self.status_label.config(text="Scan annulé - Retour impossible", foreground="red")
+                self.clear_scanner_input()
+                return False
+                
+            # Check for duplicate N_CHASSIS in current retour session
+            if product_data.N_CHASSIS in self.record_index:
+                messagebox.showwarning(
+                    "Doublon Détecté",
+                    f"Un retour avec le châssis '{product_data.N_CHASSIS}' existe déjà dans cette session.\n"
+                    f"Les doublons ne sont pas autorisés."
+                )
+                self.status_label.config(text="Scan annulé - Doublon détecté", foreground="red")
+                self.clear_scanner_input()
+                return False
+        return True
+    
+    def add_pending_scan(self, product_data):
+        """Add a Sortie/Retour row at once; the client is fetched on the worker pool"""
+        if not self.validate_new_record(product_data):
+            return
+        self.mark_scan(STAGE_VALIDATED)
+        num_chassis = product_data.N_CHASSIS
+        self.enrichment_status[num_chassis] = ENRICHMENT_PENDING
+        if self.current_ticket is not None:
+            # The ticket completes when the client lookup does
+            self.enrichment_tickets[num_chassis] = self.current_ticket
+        self.products_data.append(product_data)
+        self.record_index.add(product_data)
+        self.update_tree_display()
+        self.clear_scanner_input()
+        self.status_label.config(text=f"Scan {self.data_type} ajouté: {num_chassis} - recherche du client...",
+                                 foreground="blue")
+        self.start_enrichment(product_data)
+    
+    def start_enrichment(self, product_data):
+        """Fetch the client of a pending row on the worker pool; on_enrichment_done fills it in"""
+        future = self.enrichment_executor.submit(self._fetch_client_for_batch, product_data.N_CHASSIS)
+        future.add_done_callback(
+            lambda f: self.root.after(0, lambda: self.on_enrichment_done(product_data, *f.result())))
+    
+    def on_enrichment_done(self, product_data, api_client, error_msg):
+        """Fill in or flag a pending row once its client lookup completes"""
+        ticket = self.enrichment_tickets.pop(product_data.N_CHASSIS, None)
+        self.scan_queue.advance(ticket, STAGE_ENRICHED, error_msg)
+        if not self.products_data.holds(product_data):
+            self.scan_queue.advance(ticket, STAGE_REJECTED, "Ligne supprimée")
+            self.update_pipeline_status()
+            return  # Row deleted or data cleared in the meantime
+        num_chassis = product_data.N_CHASSIS
+        if error_msg == NOT_RESERVED and not product_data.ID_CLIENT:
+            # Refused like a synchronous scan: a moto not sold cannot leave or come back
+            self.scan_queue.advance(ticket, STAGE_REJECTED, error_msg)
+            self.update_pipeline_status()
+            self.products_data.remove_records([product_data])
+            self.record_index.remove(product_data)
+            self.enrichment_status.pop(num_chassis, None)
+            self.update_tree_display()
+            self.root.bell()
+            self.status_label.config(text=f"Ligne retirée: {num_chassis} - moto non réservée, "
+                                          f"ne peut pas être {self.data_type.lower()}",
+                                     foreground="red")
+            return
+        self.scan_queue.advance(ticket, STAGE_COMMITTED)
+        self.update_pipeline_status()
+        if product_data.ID_CLIENT:
+            # Client already chosen manually ('Changer Client' or edit)
+            self.enrichment_status.pop(num_chassis, None)
+            return
+        if api_client is not None:
+            product_data.ID_CLIENT = api_client["ID_CLIENT"]
+            product_data.NOM_PRENOM = api_client["NOM_PRENOM"]
+            product_data.WILAYA = api_client["WILAYA"]
+            self.record_index.update(product_data)
+            self.enrichment_status.pop(num_chassis, None)
+            self.status_label.config(text=f"Client trouvé: {num_chassis} - {product_data.NOM_PRENOM}",
+                                     foreground="green")
         else:
-            self.status_label.config(text="Ready to scan...", foreground="green")
+            self.enrichment_status[num_chassis] = f"⚠ {error_msg}"
+            self.status_label.config(text=f"Client introuvable pour {num_chassis}: {error_msg} "
+                                          f"(utilisez 'Changer Client' ou supprimez la ligne)",
+                                     foreground="red")
+        self.update_tree_display()
     
-    def auto_process_scan(self):
-        """Automatically process scan after delay"""
-        current_text = self.scanner_entry.get("1.0", tk.END).strip()
-        if (current_text and not self.scanning):
-            self.scanning = True
-            self.process_scanned_data(None)
-    def process_scanned_data(self, event=None):
+    def process_scanned_data(self, event=None, qr_data=None):
         """Process the scanned QR code data"""
-        qr_data = self.scanner_entry.get("1.0", tk.END).strip()
+        if qr_data is None:
+            qr_data = self.scanner_entry.get("1.0", tk.END).strip()
         
         if not qr_data:
             messagebox.showwarning("No Data", "No QR code data to process!")
@@ -546,6 +1019,13 @@ class QRScannerApp:
         try:
             # Parse the QR code data
             product_data = self.parse_qr_data(qr_data)
+            self.mark_scan(STAGE_PARSED)
+            
+            # Sortie/Retour: validate, add a pending row and fetch the client in the background
+            if (self.data_type in ["Sortie", "Retour"] and product_data.N_CHASSIS
+                    and self.async_enrichment_var.get()):
+                self.add_pending_scan(product_data)
+                return
               # For Sortie and Retour types, fetch client info from API first
             if self.data_type in ["Sortie", "Retour"]:
                 selected_client = None
@@ -615,83 +1095,23 @@ class QRScannerApp:
                     product_data.ID_CLIENT = selected_client["ID_CLIENT"]
                     product_data.NOM_PRENOM = selected_client["NOM_PRENOM"]
                     product_data.WILAYA = selected_client["WILAYA"]
+                    self.mark_scan(STAGE_ENRICHED)
                 else:
                     # User cancelled client selection
                     self.status_label.config(text="Scan cancelled - no client selected", foreground="orange")
                     self.clear_scanner_input()
                     return
-              # Type-specific validation and duplicate checking
-            if self.data_type == "Entrée":
-                # Check for duplicate Reference
-                for existing_product in self.products_data:
-                    if (hasattr(existing_product, 'Reference') and 
-                        existing_product.Reference == product_data.Reference):
-                        messagebox.showwarning(
-                            "Doublon Détecté",
-                            f"Un produit avec la référence '{product_data.Reference}' existe déjà.\n"
-                            f"Les doublons ne sont pas autorisés."
-                        )
-                        self.status_label.config(text="Scan annulé - Doublon détecté", foreground="red")
-                        self.clear_scanner_input()
-                        return
-            elif self.data_type == "Sortie":
-                # Check if chassis is already in sortie but not returned
-                if not self.can_sortie_chassis(product_data.N_CHASSIS):
-                    messagebox.showwarning(
-                        "Sortie Interdite",
-                        f"Le châssis '{product_data.N_CHASSIS}' est déjà en sortie et n'a pas été retourné.\n"
-                        f"Veuillez effectuer le retour avant une nouvelle sortie."
-                    )
-                    self.status_label.config(text="Scan annulé - Chassis déjà en sortie", foreground="red")
-                    self.clear_scanner_input()
-                    return
-                    
-                # Check for duplicate N_CHASSIS in current session
-                for existing_product in self.products_data:
-                    if (hasattr(existing_product, 'N_CHASSIS') and 
-                        existing_product.N_CHASSIS == product_data.N_CHASSIS):
-                        messagebox.showwarning(
-                            "Doublon Détecté",
-                            f"Une sortie avec le châssis '{product_data.N_CHASSIS}' existe déjà dans cette session.\n"
-                            f"Les doublons ne sont pas autorisés."
-                        )
-                        self.status_label.config(text="Scan annulé - Doublon détecté", foreground="red")
-                        self.clear_scanner_input()
-                        return
-            else:  # Retour
-                # Check if chassis is available for return (must be in sortie and not already returned)
-                if not self.can_retour_chassis(product_data.N_CHASSIS):
-                    messagebox.showwarning(
-                        "Retour Impossible",
-                        f"Le châssis '{product_data.N_CHASSIS}' n'est pas disponible pour retour.\n"
-                        f"Il doit d'abord être en sortie et non encore retourné."
-                    )
-                    self.status_label.config(text="Scan annulé - Retour impossible", foreground="red")
-                    self.clear_scanner_input()
-                    return
-                    
-                # Check for duplicate N_CHASSIS in current retour session
-                for existing_product in self.products_data:
-                    if (hasattr(existing_product, 'N_CHASSIS') and 
-                        existing_product.N_CHASSIS == product_data.N_CHASSIS):
-                        messagebox.showwarning(
-                            "Doublon Détecté",
-                            f"Un retour avec le châssis '{product_data.N_CHASSIS}' existe déjà dans cette session.\n"
-                            f"Les doublons ne sont pas autorisés."
-                        )
-                        self.status_label.config(text="Scan annulé - Doublon détecté", foreground="red")
-                        self.clear_scanner_input()
-                        return
+            # Type-specific validation and duplicate checking
+            if not self.validate_new_record(product_data):
+                return
+            self.mark_scan(STAGE_VALIDATED)
                 # Add to data list
             self.products_data.append(product_data)
-            
-            # Update sortie/retour history for chronological tracking
-            if self.data_type in ["Sortie", "Retour"] and hasattr(product_data, 'N_CHASSIS'):
-                action = "sortie" if self.data_type == "Sortie" else "retour"
-                self.update_sortie_retour_history(product_data.N_CHASSIS, action)
+            self.record_index.add(product_data)
             
             # Update display
             self.update_tree_display()
+            self.mark_scan(STAGE_COMMITTED)
             
             # Clear scanner input
             self.clear_scanner_input()
@@ -715,158 +1135,7 @@ class QRScannerApp:
             self.scanning = False    
     def parse_qr_data(self, qr_data: str):
         """Parse QR code data with backward compatibility"""
-        if self.data_type == "Entrée":
-            product = ProductData()
-            # Leave Magasin empty by default
-            product.Magasin = ""
-        elif self.data_type == "Sortie":
-            from datetime import datetime
-            now = datetime.now()
-            product = SortieData()
-            product.Date = now.strftime("%d/%m/%Y")
-            product.Heure = now.strftime("%H:%M")
-            product.DESIGNATION = "MOTOS"
-        else:  # Retour
-            from datetime import datetime
-            now = datetime.now()
-            product = RetourData()
-            product.Date = now.strftime("%d/%m/%Y")
-            product.Heure = now.strftime("%H:%M")
-            product.DESIGNATION = "MOTOS"
-        if self.data_type == "Entrée":
-            # Check if data contains line breaks (structured format)
-            if '\n' in qr_data or '\r' in qr_data:
-                # Split by lines and clean up - PRESERVE empty lines to maintain field positions
-                lines = qr_data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-                lines = [line.strip() for line in lines]  # Strip whitespace but keep empty lines
-                
-                # Check if first line starts with asterisk (legacy format)
-                if lines and lines[0].startswith('*') and lines[0].endswith('*'):
-                    # Legacy format with asterisks
-                    legacy_field_mapping = [
-                        'Reference',     # *VMSDZ06CUKI191698* -> extract content between asterisks
-                        'Designation',   # MOTOCYCLE CUKI -I-
-                        'Fournisseur',   # CUKI
-                        'Couleur',       # bleu nuit/ blanc
-                        'Magasin',       # Unité Oued-Ghir (can be empty)
-                        'Num_Chasse'     # CUKI I 06/2025
-                    ]                    
-                    for i, line in enumerate(lines):
-                        if i < len(legacy_field_mapping):
-                            field_name = legacy_field_mapping[i]
-                            if i == 0:  # First line with asterisks
-                                # Extract content between asterisks
-                                if line.startswith('*') and line.endswith('*'):
-                                    setattr(product, field_name, line[1:-1])  # Remove asterisks
-                                else:
-                                    setattr(product, field_name, line)
-                            elif field_name == 'Magasin':
-                                # Always keep Magasin empty
-                                setattr(product, field_name, "")
-                            else:
-                                setattr(product, field_name, line)
-                    
-                    # Lot is empty in legacy format (as specified)
-                    product.Lot = ""
-                    
-                else:
-                    # New structured format - split by lines
-                    field_mapping = [
-                        'Reference',
-                        'Fournisseur',
-                        'Designation',
-                        'Num_Chasse',
-                        'Couleur',
-                        'Lot',
-                        'Magasin',
-                        'Relation'
-                    ]
-                    for i, line in enumerate(lines):
-                        if i < len(field_mapping):
-                            field_name = field_mapping[i]
-                            if field_name == 'Magasin':
-                                # Always keep Magasin empty
-                                setattr(product, field_name, "")
-                            else:
-                                setattr(product, field_name, line)
-                    # Ensure Magasin is always empty
-                    product.Magasin = ""
-            else:
-                # Single line input - check for concatenated format
-                # Handle "*VMSDZ06CUKI191858*MOTOCYCLE CUKI -II-CUKI" format
-                if '*' in qr_data:
-                    # Extract everything between first pair of asterisks as Reference
-                    import re
-                    # Find first asterisk pair
-                    asterisk_match = re.search(r'\*([^*]+)\*', qr_data)
-                    if asterisk_match:
-                        product.Reference = asterisk_match.group(1)
-                        # Extract remaining text after the closing asterisk
-                        remaining_text = qr_data[asterisk_match.end():].strip()
-                        if (remaining_text):
-                            # Split remaining text by common separators or patterns
-                            # Look for pattern: "MOTOCYCLE CUKI -II-CUKI" or similar
-                            parts = []
-                            if ' -' in remaining_text and '-' in remaining_text:
-                                # Pattern like "MOTOCYCLE CUKI -II-CUKI"
-                                # Split on the dash pattern
-                                dash_parts = remaining_text.split('-')
-                                if len(dash_parts) >= 2:
-                                    # First part before dash is designation
-                                    product.Designation = dash_parts[0].strip()
-                                    # Last part after last dash could be fournisseur
-                                    if len(dash_parts) > 2:
-                                        product.Fournisseur = dash_parts[-1].strip()
-                            else:
-                                # Simple text - use as designation
-                                product.Designation = remaining_text                
-                    else:
-                        # No asterisks - treat as simple reference
-                        product.Reference = qr_data.strip()
-                    
-        # Auto-set Fournisseur to VMS if Reference starts with VMS
-        if self.data_type == "Entrée" and hasattr(product, 'Reference') and product.Reference:
-            if product.Reference.startswith('VMS'):
-                product.Fournisseur = "VMS"
-        else:  # Sortie or Retour type
-            # For Sortie/Retour, extract chassis number and designation from QR data
-            if '\n' in qr_data or '\r' in qr_data:
-                lines = qr_data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-                lines = [line.strip() for line in lines if line.strip()]
-                
-                # Check if first line starts with asterisk (legacy format)
-                if lines and lines[0].startswith('*') and lines[0].endswith('*'):
-                    # Extract chassis number from between asterisks
-                    product.N_CHASSIS = lines[0][1:-1]  # Remove asterisks
-                    
-                    # Extract designation from second line if available
-                    if len(lines) > 1:
-                        product.DESIGNATION = lines[1]
-                else:
-                    # Try to find chassis number from various positions
-                    for line in lines:
-                        if line and not line.startswith('*'):
-                            # Use the first meaningful line as chassis number
-                            product.N_CHASSIS = line
-                            break
-            else:
-                # Single line - handle concatenated format for Sortie
-                # Handle "*VMSDZ06CUKI191858*MOTOCYCLE CUKI -II-CUKI" format
-                if '*' in qr_data:
-                    import re
-                    # Find first asterisk pair for chassis number
-                    asterisk_match = re.search(r'\*([^*]+)\*', qr_data)
-                    if asterisk_match:
-                        product.N_CHASSIS = asterisk_match.group(1)
-                        # Extract remaining text after the closing asterisk for designation
-                        remaining_text = qr_data[asterisk_match.end():].strip()
-                        if remaining_text:
-                            product.DESIGNATION = remaining_text
-                else:
-                    # No asterisks - treat entire string as chassis number
-                    product.N_CHASSIS = qr_data.strip()
-        
-        return product
+        return parse_payload(qr_data, self.data_type)
     
     def test_legacy_parsing(self):
         """Test the legacy format parsing with sample data"""
@@ -895,43 +1164,14 @@ CUKI I 06/2025"""
     
     def parse_scanner_data_generic(self, scanner_data: str) -> ProductData:
         """Parse scanner data - handles line breaks"""
-        product = ProductData()
-        
         # Ensure proper encoding for French characters
         if isinstance(scanner_data, bytes):
             scanner_data = scanner_data.decode('utf-8', errors='ignore')
-          # Check if the data contains any line break characters
+        # Generic order for multi-line input, otherwise the whole input is the Reference;
+        # the Fournisseur is the one of the payload
         if '\n' in scanner_data or '\r' in scanner_data:
-            # Parse normally using line breaks - PRESERVE empty lines to maintain field positions
-            lines = scanner_data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-            lines = [line.strip() for line in lines]  # Strip whitespace but keep empty lines
-            
-            # Map lines to fields based on position (generic order)
-            field_mapping = [
-                'Reference',
-                'Fournisseur',
-                'Designation',
-                'Num_Chasse',
-                'Couleur',
-                'Lot',
-                'Magasin',
-                'Relation'
-            ]
-            for i, line in enumerate(lines):
-                if i < len(field_mapping):
-                    field_name = field_mapping[i]
-                    if field_name == 'Magasin':
-                        # Always keep Magasin empty
-                        setattr(product, field_name, "")
-                    else:
-                        setattr(product, field_name, line)
-            # Ensure Magasin is always empty
-            product.Magasin = ""
-        else:
-            # No line breaks found - treat entire input as Reference only
-            product.Reference = scanner_data.strip()
-        
-        return product
+            return parse_payload(scanner_data, MODE_ENTREE, format_name=FORMAT_STRUCTURED, auto_fournisseur=False)
+        return parse_payload(scanner_data, MODE_ENTREE, format_name=FORMAT_PLAIN, auto_fournisseur=False)
     def generate_qr_data(self, product_data) -> str:
         """Generate QR code data in structured format based on data type"""        
         if isinstance(product_data, ProductData):
@@ -985,121 +1225,95 @@ CUKI I 06/2025"""
         if self.scan_timer:
             self.root.after_cancel(self.scan_timer)
             self.scan_timer = None
+        # Characters still buffered belong to the next scan (received after this one completed)
+        if len(self.scan_buffer):
+            self.arm_scan_timer(self.scan_buffer.remaining())
             
         self.scanner_entry.delete("1.0", tk.END)
         self.scanner_entry.focus_set()
         self.status_label.config(text="Ready to scan...", foreground="green")
     def update_tree_display(self):
         """Update the treeview with current data, applying search and filter"""
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
         # Get search text and filter field
         search_text = self.search_var.get().lower() if hasattr(self, 'search_var') else ""
         filter_field = self.filter_field.get() if hasattr(self, 'filter_field') else "All Fields"
         
-        # Filter and search products based on data type
-        filtered_products = []
-        for i, product in enumerate(self.products_data):
-            # Get product values for search
-            if self.data_type == "Entrée":
-                product_values = [
-                    str(getattr(product, 'Reference', "") or ""),
-                    str(getattr(product, 'Fournisseur', "") or ""),
-                    str(getattr(product, 'Designation', "") or ""),
-                    str(getattr(product, 'Num_Chasse', "") or ""),
-                    str(getattr(product, 'Couleur', "") or ""),
-                    str(getattr(product, 'Lot', "") or ""),
-                    str(getattr(product, 'Magasin', "") or ""),
-                    str(getattr(product, 'Relation', "") or "")
-                ]
-                # Map filter field to product attribute for Entrée
-                field_mapping = {
-                    "Reference": str(getattr(product, 'Reference', "") or ""),
-                    "Fournisseur": str(getattr(product, 'Fournisseur', "") or ""),
-                    "Designation": str(getattr(product, 'Designation', "") or ""),
-                    "Num_Chasse": str(getattr(product, 'Num_Chasse', "") or ""),
-                    "Couleur": str(getattr(product, 'Couleur', "") or ""),
-                    "Lot": str(getattr(product, 'Lot', "") or ""),
-                    "Magasin": str(getattr(product, 'Magasin', "") or ""),
-                    "Relation": str(getattr(product, 'Relation', "") or "")
-                }
-            else:  # Sortie
-                product_values = [
-                    str(getattr(product, 'Date', "") or ""),
-                    str(getattr(product, 'Heure', "") or ""),
-                    str(getattr(product, 'DESIGNATION', "") or ""),
-                    str(getattr(product, 'N_CHASSIS', "") or ""),
-                    str(getattr(product, 'ID_CLIENT', "") or ""),
-                    str(getattr(product, 'NOM_PRENOM', "") or ""),
-                    str(getattr(product, 'WILAYA', "") or "")
-                ]
-                # Map filter field to product attribute for Sortie
-                field_mapping = {
-                    "Date": str(getattr(product, 'Date', "") or ""),
-                    "Heure": str(getattr(product, 'Heure', "") or ""),
-                    "DESIGNATION": str(getattr(product, 'DESIGNATION', "") or ""),
-                    "N_CHASSIS": str(getattr(product, 'N_CHASSIS', "") or ""),
-                    "ID_CLIENT": str(getattr(product, 'ID_CLIENT', "") or ""),
-                    "NOM_PRENOM": str(getattr(product, 'NOM_PRENOM', "") or ""),
-                    "WILAYA": str(getattr(product, 'WILAYA', "") or "")
-                }
-            
-            # Apply search filter
-            include_product = True
-            if search_text:
-                if filter_field == "All Fields":
-                    # Search in all fields
-                    include_product = any(search_text in value.lower() for value in product_values)
-                else:
-                    # Search in specific field
-                    field_value = field_mapping.get(filter_field, "")
-                    include_product = search_text in field_value.lower()
-            
-            if include_product:
-                filtered_products.append((i, product))
-        
-        # Add filtered products to tree (use filtered_products instead of all products)
-        for original_index, product in filtered_products:            
-            if self.data_type == "Entrée":
-                values = (
-                    str(getattr(product, 'Reference', "") or ""),
-                    str(getattr(product, 'Fournisseur', "") or ""),
-                    str(getattr(product, 'Designation', "") or ""),
-                    str(getattr(product, 'Num_Chasse', "") or ""),
-                    str(getattr(product, 'Couleur', "") or ""),
-                    str(getattr(product, 'Lot', "") or ""),
-                    str(getattr(product, 'Magasin', "") or ""),
-                    str(getattr(product, 'Relation', "") or "")
-                )
-            else:  # Sortie
-                values = (
-                    str(getattr(product, 'Date', "") or ""),
-                    str(getattr(product, 'Heure', "") or ""),
-                    str(getattr(product, 'DESIGNATION', "") or ""),
-                    str(getattr(product, 'N_CHASSIS', "") or ""),
-                    str(getattr(product, 'ID_CLIENT', "") or ""),
-                    str(getattr(product, 'NOM_PRENOM', "") or ""),
-                    str(getattr(product, 'WILAYA', "") or "")
-                )
-            # Use original index for proper identification
-            self.tree.insert('', 'end', values=values, tags=(str(original_index),))
+        columns = record_columns(self.data_type)
+        field_position = columns.index(filter_field) if filter_field in columns else None
+        
+        # Filter and search products; row values are only built for the
+        # visible rows, when the table renders them
+        if search_text:
+            hits = None
+            if len(search_text) >= MIN_QUERY_LENGTH and (filter_field == "All Fields" or field_position is not None):
+                # Candidates from the trigram index (None while it builds: scan the columns)
+                self.search_index.build_in_background(self.products_data, self.root.after)
+                hits = self.search_index.search(search_text, field_position)
+            if hits is not None:
+                found = self.product_positions(hits.values())
+            elif filter_field == "All Fields":
+                # Search in all fields, on the columns
+                found = self.products_data.search(search_text)
+            elif field_position is not None:
+                # Search in specific field
+                found = self.products_data.search(search_text, field_position)
+            else:
+                found = []
+            # Stable row ids as iids for proper identification
+            iids = self.products_data.row_ids(found)
+            self.tree_rows = dict(zip(iids, found))
+        else:
+            iids = self.products_data.row_ids()
+            self.tree_rows = self.row_positions = dict(zip(iids, range(len(iids))))
+        
+        # Sorted column kept across refreshes (new scans take their place in it)
+        iids = self.sorter.order(iids, lambda iid: self.products_data[self.tree_rows[iid]])
+        self.table.set_rows(iids, self.render_row)
+    
+    def product_positions(self, records):
+        """Sorted indexes in products_data of records (records no longer in it are skipped)"""
+        positions = []
+        rebuilt = False
+        for record in records:
+            position = self.row_positions.get(row_id(record))
+            if (position is None or position >= len(self.products_data)
+                    or self.products_data[position] is not record) and not rebuilt:
+                # The list changed since the positions were taken
+                self.row_positions = {iid: i for i, iid in enumerate(self.products_data.row_ids())}
+                rebuilt = True
+                position = self.row_positions.get(row_id(record))
+            if (position is not None and position < len(self.products_data)
+                    and self.products_data[position] is record):
+                positions.append(position)
+        positions.sort()
+        return positions
+    
+    def render_row(self, iid):
+        """(values, tags) of a table row"""
+        product = self.products_data[self.tree_rows[iid]]
+        values = tuple(str(getattr(product, column, "") or "") for column in record_columns(self.data_type))
+        tags = ()
+        if self.data_type != "Entrée":
+            status = self.enrichment_status.get(values[3])
+            if status is not None and not product.ID_CLIENT:
+                # Client lookup still running or failed: show it in the client column
+                values = values[:5] + (status,) + values[6:]
+                tags = ('pending' if status == ENRICHMENT_PENDING else 'flagged',)
+        return values, tags
+    
+    def selected_indexes(self):
+        """Indexes in products_data of the selected tree rows"""
+        return [self.tree_rows[item] for item in self.table.selection() if item in self.tree_rows]
+
     def generate_qr_from_selection(self):
         """Generate QR code(s) from selected row(s)"""
-        selection = self.tree.selection()
+        selection = self.table.selection()
         if not selection:
             messagebox.showwarning("No Selection", "Veuillez sélectionner une ou plusieurs lignes pour générer les codes QR")
             return
         
         # Get selected products
-        selected_products = []
-        for item in selection:
-            tags = self.tree.item(item, 'tags')
-            if tags:
-                index = int(tags[0])
-                product = self.products_data[index]
-                selected_products.append(product)
+        selected_products = [self.products_data[index] for index in self.selected_indexes()]
         
         if len(selected_products) == 1:
             # Single selection - show individual QR code
@@ -1494,172 +1708,48 @@ CUKI I 06/2025"""
             return qr_image
     
     def load_excel_file(self):
-        """Load data from Excel file"""
+        """Load data from a session file (Excel, CSV, Parquet or SQLite, by extension)"""
         filename = filedialog.askopenfilename(
-            filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
+            filetypes=OPEN_FILE_TYPES
         )
         if filename:
             try:
-                df = pd.read_excel(filename)
-                self.products_data = []
-                if self.data_type == "Entrée":
-                    column_mapping = {
-                        'Reference': 'Reference',
-                        'ID_Produit': 'Reference',
-                        'Fournisseur': 'Fournisseur',
-                        'Marque': 'Fournisseur',
-                        'Designation/Reference': 'Designation',
-                        'Designation_Reference': 'Designation',
-                        'Designation': 'Designation',
-                        'Num_Chasse': 'Num_Chasse',
-                        'Serial Number': 'Num_Chasse',
-                        'Serial_Number': 'Num_Chasse',
-                        'Couleur': 'Couleur',
-                        'Matricule': 'Lot',
-                        'Lot': 'Lot',
-                        'Magasin': 'Magasin',
-                        'Photo': 'Relation',
-                        'Relation': 'Relation'
-                    }                    
-                    for _, row in df.iterrows():
-                        product = ProductData()
-                        for excel_col, product_field in column_mapping.items():
-                            if excel_col in df.columns:
-                                value = row[excel_col]
-                                setattr(product, product_field, str(value) if pd.notna(value) else "")
-                        self.products_data.append(product)                
-                elif self.data_type in ["Sortie", "Retour"]:
-                    # Sortie/Retour: logique intelligente pour trouver les colonnes et données
+                # Read the whole file first: the current session stays if it cannot be read
+                products = ColumnStore(RECORD_CLASSES[self.data_type])
+                try:
+                    start = time.perf_counter()
+                    # Rows go straight from the file into the new store
+                    products.extend(read_records(filename, self.data_type))
+                    print(f"DEBUG: Loaded {len(products)} records in {time.perf_counter() - start:.2f} s")
+                except ChassisColumnNotFound:
+                    raise  # The other columns hold data: not replaced by an empty table
+                except MovementColumnsNotFound as search_error:
+                    # Sortie/Retour (Excel): en-tête trouvé dans le contenu du fichier (ligne 3 pour nos fichiers)
                     data_columns = ['Date', 'Heure', 'DESIGNATION', 'N_CHASSIS', 'ID_CLIENT', 'NOM_PRENOM', 'WILAYA']
-                    data_class = SortieData if self.data_type == "Sortie" else RetourData
                     title_keyword = self.data_type.upper()  # "SORTIE" or "RETOUR"
                     
-                    print(f"DEBUG: Loading {self.data_type} file with {len(df)} rows")
-                    print(f"DEBUG: Available columns: {list(df.columns)}")
+                    # Si on ne trouve pas les colonnes, créer une nouvelle table
+                    print(f"Erreur lors de la recherche des colonnes: {search_error}")
+                    df = pd.DataFrame(columns=data_columns)
+                    # Ajouter le titre au centre
+                    title_row = ["" for _ in data_columns]
+                    title_text = f"{title_keyword} LIVRAISON JOURNALIERE"
+                    title_row[int(len(data_columns)/2)] = title_text
                     
-                    # Première tentative: vérifier si les colonnes sont directement dans le DataFrame
-                    found = all(col in df.columns for col in data_columns)
+                    # Créer un DataFrame avec le titre et les en-têtes
+                    title_df = pd.DataFrame([title_row], columns=data_columns)
+                    empty_row = pd.DataFrame([["" for _ in data_columns]], columns=data_columns)
+                    final_df = pd.concat([title_df, empty_row, df], ignore_index=True)
                     
-                    if found:
-                        # Colonnes trouvées directement - charger les données avec logique améliorée
-                        loaded_count = 0
-                        for index, row in df.iterrows():
-                            try:
-                                # Vérifier d'abord si nous avons un chassis valide
-                                chassis_val = str(row['N_CHASSIS']) if pd.notna(row['N_CHASSIS']) else ""
-                                
-                                # Skip if no chassis value or if it's too short
-                                if not chassis_val or chassis_val.strip() == "" or chassis_val == "nan":
-                                    continue
-                                
-                                if len(chassis_val.strip()) < 3:
-                                    continue
-                                
-                                # Skip obvious header/title rows
-                                row_text = " ".join([str(val) for val in row.values if pd.notna(val)]).upper()
-                                if (title_keyword in row_text and "LIVRAISON" in row_text) or "N_CHASSIS" in row_text:
-                                    continue
-                                
-                                product = data_class()
-                                for col in data_columns:
-                                    value = row[col]
-                                    setattr(product, col, str(value) if pd.notna(value) else "")
-                                self.products_data.append(product)
-                                loaded_count += 1
-                                
-                                if loaded_count <= 3:
-                                    print(f"DEBUG: Loaded record {loaded_count}: Chassis={chassis_val}")
-                                    
-                            except Exception as e:
-                                print(f"DEBUG: Error processing row {index}: {e}")
-                                continue
-                        
-                        print(f"DEBUG: Successfully loaded {loaded_count} records")
-                        
-                    else:
-                        # Colonnes non trouvées - chercher dans le contenu du fichier
-                        # Relire le fichier sans en-tête pour analyser le contenu
-                        try:
-                            # Lire le fichier ligne par ligne pour trouver l'en-tête des colonnes
-                            raw_df = pd.read_excel(filename, header=None)
-                            header_row_index = None
-                            
-                            # Chercher la ligne qui contient toutes nos colonnes attendues
-                            for index, row in raw_df.iterrows():
-                                row_values = [str(val).strip() if pd.notna(val) else "" for val in row.values]
-                                # Vérifier si cette ligne contient nos colonnes (au moins 4 sur 7)
-                                matches = sum(1 for col in data_columns if col in row_values)
-                                if matches >= 4:  # Au moins 4 colonnes trouvées
-                                    header_row_index = index
-                                    break
-                            
-                            if header_row_index is not None:
-                                # Relire le fichier avec l'en-tête trouvé
-                                df_with_header = pd.read_excel(filename, header=header_row_index)
-                                  # Vérifier que nous avons maintenant les bonnes colonnes
-                                found_columns = [col for col in data_columns if col in df_with_header.columns]
-                                
-                                if len(found_columns) >= 4:  # Au moins 4 colonnes trouvées
-                                    loaded_count = 0
-                                    for index, row in df_with_header.iterrows():
-                                        try:
-                                            # Vérifier d'abord si nous avons un chassis valide
-                                            chassis_val = ""
-                                            if 'N_CHASSIS' in df_with_header.columns:
-                                                chassis_val = str(row['N_CHASSIS']) if pd.notna(row['N_CHASSIS']) else ""
-                                            
-                                            # Skip if no chassis value or if it's too short
-                                            if not chassis_val or chassis_val.strip() == "" or chassis_val == "nan":
-                                                continue
-                                            
-                                            if len(chassis_val.strip()) < 3:
-                                                continue
-                                            
-                                            # Skip obvious header/title rows
-                                            row_text = " ".join([str(val) for val in row.values if pd.notna(val)]).upper()
-                                            if (title_keyword in row_text and "LIVRAISON" in row_text) or "N_CHASSIS" in row_text:
-                                                continue
-                                            
-                                            product = data_class()
-                                            for col in data_columns:
-                                                if col in df_with_header.columns:
-                                                    value = row[col]
-                                                    setattr(product, col, str(value) if pd.notna(value) else "")
-                                            self.products_data.append(product)
-                                            loaded_count += 1
-                                            
-                                            if loaded_count <= 3:
-                                                print(f"DEBUG: Loaded record {loaded_count}: Chassis={chassis_val}")
-                                                
-                                        except Exception as e:
-                                            print(f"DEBUG: Error processing row {index}: {e}")
-                                            continue
-                                    
-                                    print(f"DEBUG: Successfully loaded {loaded_count} records from header-found section")
-                                else:
-                                    raise ValueError(f"Colonnes {self.data_type} non trouvées dans le fichier")
-                            else:
-                                raise ValueError(f"En-tête des colonnes {self.data_type} non trouvé")
-                                
-                        except Exception as search_error:
-                            # Si on ne trouve pas les colonnes, créer une nouvelle table
-                            print(f"Erreur lors de la recherche des colonnes: {search_error}")
-                            df = pd.DataFrame(columns=data_columns)
-                            # Ajouter le titre au centre
-                            title_row = ["" for _ in data_columns]
-                            title_text = f"{title_keyword} LIVRAISON JOURNALIERE"
-                            title_row[int(len(data_columns)/2)] = title_text
-                            
-                            # Créer un DataFrame avec le titre et les en-têtes
-                            title_df = pd.DataFrame([title_row], columns=data_columns)
-                            empty_row = pd.DataFrame([["" for _ in data_columns]], columns=data_columns)
-                            final_df = pd.concat([title_df, empty_row, df], ignore_index=True)
-                            
-                            final_df.to_excel(filename, index=False)
-                            messagebox.showinfo("Info", f"Table de {self.data_type.lower()} créée dans le fichier Excel.")
-                            return
+                    final_df.to_excel(filename, index=False)
+                    messagebox.showinfo("Info", f"Table de {self.data_type.lower()} créée dans le fichier Excel.")
+                    return
                 
+                self.products_data = products
+                self.record_index.rebuild(self.products_data)
+                self.search_index.build_in_background(self.products_data, self.root.after)
                 self.excel_file = filename
+                self.journal.load(self.products_data, self.excel_file)
                 self.update_tree_display()
                 self.file_label.config(text=f"Loaded: {os.path.basename(filename)}")
                 messagebox.showinfo("Success", f"Loaded {len(self.products_data)} records")
@@ -1672,7 +1762,7 @@ CUKI I 06/2025"""
         if not self.excel_file:
             filename = filedialog.asksaveasfilename(
                 defaultextension=".xlsx",
-                filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")],
+                filetypes=FILE_TYPES,
                 title="Save Excel File As..."
             )
             if not filename:
@@ -1684,68 +1774,84 @@ CUKI I 06/2025"""
             messagebox.showwarning("No Data", "No product data to save!")
             return
         
-        try:
-            # Convert data objects to dictionary list
-            data_list = [asdict(product) for product in self.products_data]
-            
-            # Create DataFrame
-            df = pd.DataFrame(data_list)
-              # Set appropriate column headers based on data type
-            if self.data_type == "Entrée":
-                # Rename columns for Entrée type (8 columns)
-                df.columns = [
-                    'Reference', 'Fournisseur', 'Designation', 
-                    'Num_Chasse', 'Couleur', 'Lot', 
-                    'Magasin', 'Relation'
-                ]
-                # Save normally for Entrée
-                df.to_excel(self.excel_file, index=False)
-            elif self.data_type in ["Sortie", "Retour"]:
-                # For Sortie and Retour types (7 columns)
-                df.columns = [
-                    'Date', 'Heure', 'DESIGNATION', 
-                    'N_CHASSIS', 'ID_CLIENT', 'NOM_PRENOM', 
-                    'WILAYA'
-                ]
-                
-                # Use ExcelWriter to write title separately from table
-                with pd.ExcelWriter(self.excel_file, engine='openpyxl') as writer:
-                    # Write the DataFrame starting from row 3 (leaving rows 1-2 for title)
-                    df.to_excel(writer, index=False, startrow=2, header=True, sheet_name='Sheet1')
-                    
-                    # Get the workbook and worksheet to add formatting
-                    workbook = writer.book
-                    worksheet = workbook['Sheet1']
-                    
-                    # Make title bold and centered
-                    from openpyxl.styles import Font, Alignment
-                    title_font = Font(bold=True, size=14)
-                    center_alignment = Alignment(horizontal='center', vertical='center')
-                    
-                    # Merge cells for title (A1:G1 to span all columns)
-                    worksheet.merge_cells('A1:G1')
-                    title_text = f"{self.data_type.upper()} LIVRAISON JOURNALIERE"
-                    worksheet['A1'] = title_text
-                    worksheet['A1'].font = title_font
-                    worksheet['A1'].alignment = center_alignment
-                    
-                    # Apply formatting to headers
-                    header_font = Font(bold=True)
-                    for col_num, column_title in enumerate(df.columns, 1):
-                        cell = worksheet.cell(row=3, column=col_num)
-                        cell.font = header_font
-            
-            # For Entrée type, save normally
-            if self.data_type == "Entrée":
-                pass  # Already saved above
-            
-            # Update file label
-            self.file_label.config(text=f"File: {os.path.basename(self.excel_file)}")
-            
-            messagebox.showinfo("Success", f"Data saved to {os.path.basename(self.excel_file)}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save file: {str(e)}")
+        # No Sortie/Retour row is written without its client: wait for the
+        # lookups, then choose the client of the flagged rows or delete them
+        pending = failed = 0
+        if self.enrichment_status:
+            for product in self.products_data:
+                status = self.enrichment_status.get(getattr(product, 'N_CHASSIS', None))
+                if status is not None and not product.ID_CLIENT:
+                    if status == ENRICHMENT_PENDING:
+                        pending += 1
+                    else:
+                        failed += 1
+        if pending or failed:
+            message = ""
+            if pending:
+                message += f"{pending} ligne(s) attendent encore leur client (recherche en cours).\n"
+            if failed:
+                message += (f"{failed} ligne(s) n'ont pas de client (recherche échouée): "
+                            f"utilisez 'Changer Client' ou supprimez-les.\n")
+            messagebox.showwarning("Clients Manquants", message + "\nEnregistrement annulé.")
+            return
+        
+        # Written in the background; a save requested meanwhile follows it
+        if not self.save_worker.request(self.prepare_save, self.on_save_done, self.on_save_progress):
+            self.status_label.config(text="Enregistrement en attente...", foreground="blue")
+
+    def prepare_save(self):
+        """Copy what the save has to write (UI thread); returns the task of the save worker"""
+        if not self.excel_file or not self.products_data:
+            return None  # Cleared since the save was requested
+        # Entrée: plain table; Sortie/Retour: title row, header on row 3.
+        # Once written, only new and edited rows are saved
+        first_row = 2 if self.data_type == "Entrée" else MOVEMENT_HEADER_ROW + 1
+        plan = self.save_plan = self.saver.plan(self.excel_file, self.products_data, first_row)
+        self.save_point = self.journal.save_point()
+        self.status_label.config(text=f"Enregistrement de {os.path.basename(plan.filename)}...", foreground="blue")
+        mode = self.data_type
+
+        def write(report):
+            with self.journal.file_lock:  # Not while the journal compacts into the same file
+                result = self.saver.write(plan, report)
+            if plan.rows is not None:
+                self.record_saved_movements(plan.filename, mode, enumerate(plan.rows.rows(), first_row), True)
+            else:
+                self.record_saved_movements(plan.filename, mode, plan.edited + plan.appended, False)
+            return result
+        return write
+
+    def on_save_progress(self, count, total):
+        if total:
+            self.status_label.config(text=f"Enregistrement... {count * 100 // total}%", foreground="blue")
+
+    def on_save_done(self, result, error):
+        """Outcome of a background save (UI thread)"""
+        plan, self.save_plan = self.save_plan, None
+        if error is not None:
+            if plan is not None:
+                self.saver.failed(plan)
+                self.journal.save_failed()
+            if isinstance(error, WorkbookPatchError):
+                print(f"DEBUG: Enregistrement partiel impossible ({error}), réécriture complète")
+                self.save_worker.request(self.prepare_save, self.on_save_done, self.on_save_progress)
+                return
+            self.status_label.config(text="Erreur d'enregistrement", foreground="red")
+            messagebox.showerror("Error", f"Failed to save file: {str(error)}")
+            return
+        status, _, signature = result
+        self.saver.finished(plan, signature)
+        # Only now: a crash during the write must still offer the journal's session
+        self.journal.mark_saved(plan.filename, self.save_point)
+        
+        # Update file label
+        self.file_label.config(text=f"File: {os.path.basename(plan.filename)}")
+        
+        # Reported in the status line: a dialog would take the focus from the scanner
+        if status == SAVE_UNCHANGED:
+            self.status_label.config(text="Aucune modification depuis le dernier enregistrement", foreground="green")
+        else:
+            self.status_label.config(text=f"Data saved to {os.path.basename(plan.filename)}", foreground="green")
 
     def clear_all_data(self):
         """Clear all data from the application"""
@@ -1762,13 +1868,15 @@ CUKI I 06/2025"""
         )        
         if result:
             # Clear all data and unselect current Excel file
-            self.products_data = []
+            self.products_data.clear()
+            self.record_index.clear()
             self.excel_file = None
             
             # Clear cross-reference file data as well
             self.sortie_file_data = []
             self.retour_file_data = []
-            self.sortie_retour_history = {}
+            self.movement_store.clear()
+            self.enrichment_status = {}
             
             # Hide reference panel if open
             self.hide_reference_panel()
@@ -1782,16 +1890,13 @@ CUKI I 06/2025"""
 
     def edit_selected_record(self):
         """Edit the selected record in the tree"""
-        selection = self.tree.selection()
+        selection = self.table.selection()
         if not selection:
             messagebox.showwarning("Sélection", "Veuillez sélectionner un produit à modifier")
             return
         
-        item = selection[0]
-        values = self.tree.item(item, 'values')
-        
         # Find the index in products_data
-        index = self.find_product_index_by_values(values)
+        index = self.tree_rows.get(selection[0])
         if index is None:
             messagebox.showerror("Erreur", "Impossible de trouver le produit sélectionné")
             return
@@ -1801,13 +1906,13 @@ CUKI I 06/2025"""
     
     def delete_selected_record(self):
         """Delete the selected record from the tree"""
-        selection = self.tree.selection()
+        selection = self.table.selection()
         if not selection:
             messagebox.showwarning("Sélection", f"Veuillez sélectionner un {self.data_type.lower()} à supprimer")
             return
         
         item = selection[0]
-        values = self.tree.item(item, 'values')
+        values = self.table.values(item)
           # Confirm deletion with appropriate fields based on data type
         if self.data_type == "Entrée":
             confirm_message = (
@@ -1828,38 +1933,20 @@ CUKI I 06/2025"""
         result = messagebox.askyesno("Confirmation", confirm_message, icon='warning')
         if result:
             # Find the index in products_data
-            index = self.find_product_index_by_values(values)
+            index = self.tree_rows.get(item)
             if index is not None:
                 # Get the product data before deletion for history cleanup
                 product_to_delete = self.products_data[index]
                 
                 # Remove from products_data
                 del self.products_data[index]
-                
-                # Clean up sortie/retour history if applicable
-                if self.data_type in ["Sortie", "Retour"] and hasattr(product_to_delete, 'N_CHASSIS'):
-                    self.remove_from_sortie_retour_history(product_to_delete.N_CHASSIS, self.data_type.lower())
+                self.record_index.remove(product_to_delete)
+                self.enrichment_status.pop(getattr(product_to_delete, 'N_CHASSIS', None), None)
+                # Its movement goes from the movement store with the next save of the file
                 
                 self.update_tree_display()
                 messagebox.showinfo("Succès", f"{self.data_type} supprimé avec succès")
             else:                messagebox.showerror("Erreur", f"Impossible de trouver l'{self.data_type.lower()} à supprimer")
-    def find_product_index_by_values(self, values):
-        """Find the index of a product in products_data by tree values"""        
-        for i, product in enumerate(self.products_data):
-            if self.data_type == "Entrée":
-                if (getattr(product, 'Reference', '') == values[0] and 
-                    getattr(product, 'Fournisseur', '') == values[1] and 
-                    getattr(product, 'Designation', '') == values[2] and
-                    getattr(product, 'Num_Chasse', '') == values[3]):
-                    return i
-            else:  # Sortie or Retour
-                if (getattr(product, 'Date', '') == values[0] and 
-                    getattr(product, 'Heure', '') == values[1] and 
-                    getattr(product, 'DESIGNATION', '') == values[2] and
-                    getattr(product, 'N_CHASSIS', '') == values[3]):
-                    return i
-        return None
-    
     def open_edit_dialog(self, index):
         """Open a dialog to edit a product"""
         product = self.products_data[index]
@@ -1923,6 +2010,7 @@ CUKI I 06/2025"""
         
         def save_changes():
             try:
+                old_product = self.products_data[index]
                 # Update the product based on data type
                 if self.data_type == "Entrée":
                     self.products_data[index] = ProductData(
@@ -1935,8 +2023,9 @@ CUKI I 06/2025"""
                         Magasin=entries["Magasin:"].get(),
                         Relation=entries["Relation:"].get()
                     )
-                else:  # Sortie
-                    self.products_data[index] = SortieData(
+                else:  # Sortie or Retour
+                    data_class = SortieData if self.data_type == "Sortie" else RetourData
+                    self.products_data[index] = data_class(
                         Date=entries["Date:"].get(),
                         Heure=entries["Heure:"].get(),
                         DESIGNATION=entries["DESIGNATION:"].get(),
@@ -1945,6 +2034,7 @@ CUKI I 06/2025"""
                         NOM_PRENOM=entries["NOM & PRENOM:"].get(),
                         WILAYA=entries["WILAYA:"].get()
                     )
+                self.record_index.replace(old_product, self.products_data[index])
                 
                 self.update_tree_display()
                 dialog.destroy()
@@ -1957,40 +2047,35 @@ CUKI I 06/2025"""
         ttk.Button(button_frame, text="Annuler", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
     
     def on_search_change(self, *args):
-        """Handle search text changes"""
+        """Handle search text changes (the table is refreshed once typing pauses)"""
+        if self.search_timer is not None:
+            self.root.after_cancel(self.search_timer)
+        self.search_timer = self.root.after(SEARCH_DEBOUNCE_MS, self.run_search)
+    
+    def run_search(self):
+        self.search_timer = None
         self.update_tree_display()
     
     def on_filter_change(self, event=None):
         """Handle filter changes"""
         self.update_tree_display()
     
-    def sort_column(self, col, reverse):
-        """Sort tree contents by column"""
-        # Get all items and their values
-        data = [(self.tree.set(child, col), child) for child in self.tree.get_children('')]
-        
-        # Sort the data
-        try:
-            # Try to sort as numbers if possible
-            data.sort(key=lambda x: float(x[0]) if x[0].replace('.', '', 1).isdigit() else x[0], reverse=reverse)
-        except:
-            # Fall back to string sorting
-            data.sort(key=lambda x: x[0], reverse=reverse)
-        
-        # Rearrange items in sorted positions
-        for index, (val, child) in enumerate(data):
-            self.tree.move(child, '', index)
-        
-        # Reverse sort next time
-        self.tree.heading(col, command=lambda: self.sort_column(col, not reverse))
+    def sort_column(self, col):
+        """Sort table rows by column (clicking the sorted column again reverses it)"""
+        self.sorter.sort_by(col)
+        for column in self.tree['columns']:
+            arrow = ""
+            if column == self.sorter.column:
+                arrow = " ▼" if self.sorter.reverse else " ▲"
+            self.tree.heading(column, text=column.replace('_', ' ') + arrow)
+        self.table.top = 0
+        self.update_tree_display()
     
     def on_item_double_click(self, event):
         """Handle double-click on tree item"""
-        selection = self.tree.selection()
+        selection = self.table.selection()
         if selection:
-            item = selection[0]
-            values = self.tree.item(item, 'values')
-            index = self.find_product_index_by_values(values)
+            index = self.tree_rows.get(selection[0])
             if index is not None:
                 self.open_edit_dialog(index)
     
@@ -2532,7 +2617,9 @@ CUKI I 06/2025"""
 
     def run(self):
         """Start the application"""
-        self.root.mainloop()      
+        self.root.mainloop()
+        self.save_worker.wait()
+        self.journal.close()      
     def fetch_client_info_from_chassis(self, num_chassis):
         """Fetch client information from chassis number using external APIs"""
         try:
@@ -3360,16 +3447,13 @@ CUKI I 06/2025"""
 
     def change_client_for_selected(self):
         """Change client for selected Sortie record"""
-        selection = self.tree.selection()
+        selection = self.table.selection()
         if not selection:
             messagebox.showwarning("Sélection", "Veuillez sélectionner une sortie pour changer le client")
             return
         
-        item = selection[0]
-        values = self.tree.item(item, 'values')
-        
         # Find the index in products_data
-        index = self.find_product_index_by_values(values)
+        index = self.tree_rows.get(selection[0])
         if index is None:
             messagebox.showerror("Erreur", "Impossible de trouver la sortie sélectionnée")
             return
@@ -3383,6 +3467,7 @@ CUKI I 06/2025"""
             sortie_record.ID_CLIENT = selected_client["ID_CLIENT"]
             sortie_record.NOM_PRENOM = selected_client["NOM_PRENOM"]
             sortie_record.WILAYA = selected_client["WILAYA"]
+            self.record_index.update(sortie_record)
               # Update the display
             self.update_tree_display()
             messagebox.showinfo("Succès", "Client modifié avec succès")
@@ -3501,156 +3586,17 @@ CUKI I 06/2025"""
             )    
     def can_sortie_chassis(self, chassis_number):
         """Check if a chassis can be sortie (not already in sortie without return)"""
-        from datetime import datetime
-        
-        print(f"DEBUG: can_sortie_chassis called for {chassis_number}")
-        print(f"DEBUG: sortie_retour_history keys: {list(self.sortie_retour_history.keys())}")
-        print(f"DEBUG: sortie_file_data count: {len(self.sortie_file_data)}")
-        print(f"DEBUG: retour_file_data count: {len(self.retour_file_data)}")
-        print(f"DEBUG: products_data count: {len(self.products_data)}")
-        
-        # Check in sortie_retour_history for this chassis
-        if chassis_number in self.sortie_retour_history:
-            history = self.sortie_retour_history[chassis_number]
-            print(f"DEBUG: Found history for {chassis_number}: {history}")
-            # Get the last action for this chassis
-            if history:
-                last_timestamp, last_action = history[-1]
-                print(f"DEBUG: Last action was: {last_action}")
-                # If last action was sortie, cannot sortie again
-                if last_action == "sortie":
-                    print(f"DEBUG: Returning False - last action was sortie")
-                    return False        
-        # Check in retour file data to see if this chassis has been returned
-        for retour_record in self.retour_file_data:
-            if hasattr(retour_record, 'N_CHASSIS') and retour_record.N_CHASSIS == chassis_number:
-                print(f"DEBUG: Found retour record for {chassis_number}")
-                # Check if there's a corresponding sortie after this retour
-                retour_time = self.parse_datetime(retour_record.Date, retour_record.Heure)
-                
-                # Look for sortie after this retour
-                sortie_after_retour = False
-                for sortie_record in self.sortie_file_data:
-                    if hasattr(sortie_record, 'N_CHASSIS') and sortie_record.N_CHASSIS == chassis_number:
-                        sortie_time = self.parse_datetime(sortie_record.Date, sortie_record.Heure)
-                        if sortie_time > retour_time:
-                            sortie_after_retour = True
-                            break                
-                if not sortie_after_retour:
-                    # No sortie after this retour, so chassis is available
-                    print(f"DEBUG: Returning True - no sortie after retour")
-                    return True
-        
-        # Check current sortie data for this chassis
-        for product in self.products_data:
-            if (hasattr(product, 'N_CHASSIS') and 
-                product.N_CHASSIS == chassis_number and 
-                isinstance(product, SortieData)):
-                print(f"DEBUG: Returning False - already in current sortie session")
-                return False  # Already in current sortie session
-        
-        # Check in sortie file data without corresponding retour
-        for sortie_record in self.sortie_file_data:
-            if hasattr(sortie_record, 'N_CHASSIS') and sortie_record.N_CHASSIS == chassis_number:
-                print(f"DEBUG: Found sortie record for {chassis_number}")
-                # Check if this sortie has a corresponding retour
-                sortie_time = self.parse_datetime(sortie_record.Date, sortie_record.Heure)
-                
-                retour_found = False
-                for retour_record in self.retour_file_data:
-                    if hasattr(retour_record, 'N_CHASSIS') and retour_record.N_CHASSIS == chassis_number:
-                        retour_time = self.parse_datetime(retour_record.Date, retour_record.Heure)
-                        if retour_time > sortie_time:
-                            retour_found = True
-                            break
-                
-                if not retour_found:
-                    print(f"DEBUG: Returning False - sortie without retour")
-                    return False  # Sortie without retour
-        
-        print(f"DEBUG: Returning True - can sortie")
-        return True  # Can sortie
+        in_session = self.data_type == "Sortie" and chassis_number in self.record_index
+        return self.movement_store.can_sortie(chassis_number, in_session)
+    
     def can_retour_chassis(self, chassis_number):
         """Check if a chassis can be retour (must be in sortie and not already returned)"""
-        from datetime import datetime
-        
-        print(f"DEBUG: Checking if chassis {chassis_number} can be returned")
-        print(f"DEBUG: Sortie file data count: {len(self.sortie_file_data)}")
-        print(f"DEBUG: Current products data count: {len(self.products_data)}")
-        
-        # Check in sortie_retour_history for this chassis
-        if chassis_number in self.sortie_retour_history:
-            history = self.sortie_retour_history[chassis_number]
-            # Get the last action for this chassis
-            if history:
-                last_timestamp, last_action = history[-1]
-                print(f"DEBUG: History found - last action: {last_action}")
-                # If last action was retour, cannot retour again
-                if last_action == "retour":
-                    print(f"DEBUG: Cannot retour - already returned")
-                    return False
-                # If last action was sortie, can retour
-                if last_action == "sortie":
-                    print(f"DEBUG: Can retour - last action was sortie")
-                    return True
-        
-        # Check current sortie data for this chassis
-        for product in self.products_data:
-            if (hasattr(product, 'N_CHASSIS') and 
-                product.N_CHASSIS == chassis_number and 
-                isinstance(product, SortieData)):
-                print(f"DEBUG: Found chassis in current sortie session")
-                return True  # Found in current sortie session
-        
-        # Check in sortie file data for this chassis
-        chassis_found_in_sortie = False
-        latest_sortie_time = None
-        
-        for sortie_record in self.sortie_file_data:
-            if hasattr(sortie_record, 'N_CHASSIS') and sortie_record.N_CHASSIS == chassis_number:
-                print(f"DEBUG: Found chassis in sortie file data: {sortie_record.N_CHASSIS}")
-                chassis_found_in_sortie = True
-                sortie_time = self.parse_datetime(sortie_record.Date, sortie_record.Heure)
-                if latest_sortie_time is None or sortie_time > latest_sortie_time:
-                    latest_sortie_time = sortie_time
-        
-        if not chassis_found_in_sortie:
-            print(f"DEBUG: Chassis not found in any sortie")
-            return False  # Not found in any sortie
-        
-        print(f"DEBUG: Chassis found in sortie, latest time: {latest_sortie_time}")
-          # Check if this chassis has a retour after the latest sortie
-        for retour_record in self.retour_file_data:
-            if hasattr(retour_record, 'N_CHASSIS') and retour_record.N_CHASSIS == chassis_number:
-                retour_time = self.parse_datetime(retour_record.Date, retour_record.Heure)
-                print(f"DEBUG: Found retour for chassis at time: {retour_time}")
-                if retour_time > latest_sortie_time:
-                    print(f"DEBUG: Cannot retour - already returned after latest sortie")
-                    return False  # Already returned after latest sortie
-        
-        print(f"DEBUG: Can retour - chassis is in sortie and not yet returned")
-        return True  # Can retour
+        # Only runs in Retour mode: the session rows are retours, never a sortie
+        return self.movement_store.can_retour(chassis_number)
     
     def parse_datetime(self, date_str, time_str):
         """Parse date and time strings to datetime object"""
-        from datetime import datetime
-        try:
-            # Handle different date formats
-            if '/' in date_str:
-                # Format: DD/MM/YYYY
-                date_parts = date_str.split('/')
-                if len(date_parts) == 3:
-                    day, month, year = date_parts
-                    dt_str = f"{year}-{month.zfill(2)}-{day.zfill(2)} {time_str}"
-                    return datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
-            else:
-                # Try other formats
-                dt_str = f"{date_str} {time_str}"
-                return datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
-        except:
-            # Fallback to current time if parsing fails
-            from datetime import datetime
-            return datetime.now()
+        return parse_movement_datetime(date_str, time_str)
     
     def load_retour_file_for_sortie(self):
         """Load retour file data to use as reference when in sortie mode"""
@@ -3663,128 +3609,7 @@ CUKI I 06/2025"""
             filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
         )
         if filename:
-            try:
-                df = pd.read_excel(filename)
-                self.retour_file_data = []
-                
-                # Expected columns for retour data
-                data_columns = ['Date', 'Heure', 'DESIGNATION', 'N_CHASSIS', 'ID_CLIENT', 'NOM_PRENOM', 'WILAYA']
-                title_keyword = "RETOUR"
-                
-                print(f"DEBUG: Loading Retour reference file with {len(df)} rows")
-                print(f"DEBUG: Available columns: {list(df.columns)}")
-                
-                # Première tentative: vérifier si les colonnes sont directement dans le DataFrame
-                found = all(col in df.columns for col in data_columns)
-                
-                if found:
-                    # Colonnes trouvées directement - charger les données avec logique améliorée
-                    loaded_count = 0
-                    for index, row in df.iterrows():
-                        try:
-                            # Vérifier d'abord si nous avons un chassis valide
-                            chassis_val = str(row['N_CHASSIS']) if pd.notna(row['N_CHASSIS']) else ""
-                            
-                            # Skip if no chassis value or if it's too short
-                            if not chassis_val or chassis_val.strip() == "" or chassis_val == "nan":
-                                continue
-                            
-                            if len(chassis_val.strip()) < 3:
-                                continue
-                            
-                            # Skip obvious header/title rows
-                            row_text = " ".join([str(val) for val in row.values if pd.notna(val)]).upper()
-                            if (title_keyword in row_text and "LIVRAISON" in row_text) or "N_CHASSIS" in row_text:
-                                continue
-                            
-                            retour = RetourData()
-                            for col in data_columns:
-                                value = row[col]
-                                setattr(retour, col, str(value) if pd.notna(value) else "")
-                            self.retour_file_data.append(retour)
-                            loaded_count += 1
-                            
-                            if loaded_count <= 3:
-                                print(f"DEBUG: Loaded retour reference record {loaded_count}: Chassis={chassis_val}")
-                                
-                        except Exception as e:
-                            print(f"DEBUG: Error processing retour row {index}: {e}")
-                            continue
-                    
-                    print(f"DEBUG: Successfully loaded {loaded_count} retour reference records")
-                    
-                else:
-                    # Colonnes non trouvées - chercher dans le contenu du fichier
-                    try:
-                        # Lire le fichier ligne par ligne pour trouver l'en-tête des colonnes
-                        raw_df = pd.read_excel(filename, header=None)
-                        header_row_index = None
-                        
-                        # Chercher la ligne qui contient toutes nos colonnes attendues
-                        for index, row in raw_df.iterrows():
-                            row_values = [str(val).strip() if pd.notna(val) else "" for val in row.values]
-                            # Vérifier si cette ligne contient nos colonnes (au moins 4 sur 7)
-                            matches = sum(1 for col in data_columns if col in row_values)
-                            if matches >= 4:  # Au moins 4 colonnes trouvées
-                                header_row_index = index
-                                break
-                        
-                        if header_row_index is not None:
-                            # Relire le fichier avec l'en-tête trouvé
-                            df_with_header = pd.read_excel(filename, header=header_row_index)
-                            # Vérifier que nous avons maintenant les bonnes colonnes
-                            found_columns = [col for col in data_columns if col in df_with_header.columns]
-                            
-                            if len(found_columns) >= 4:  # Au moins 4 colonnes trouvées
-                                loaded_count = 0
-                                for index, row in df_with_header.iterrows():
-                                    try:
-                                        # Vérifier d'abord si nous avons un chassis valide
-                                        chassis_val = ""
-                                        if 'N_CHASSIS' in df_with_header.columns:
-                                            chassis_val = str(row['N_CHASSIS']) if pd.notna(row['N_CHASSIS']) else ""
-                                        
-                                        # Skip if no chassis value or if it's too short
-                                        if not chassis_val or chassis_val.strip() == "" or chassis_val == "nan":
-                                            continue
-                                        
-                                        if len(chassis_val.strip()) < 3:
-                                            continue
-                                        
-                                        # Skip obvious header/title rows
-                                        row_text = " ".join([str(val) for val in row.values if pd.notna(val)]).upper()
-                                        if (title_keyword in row_text and "LIVRAISON" in row_text) or "N_CHASSIS" in row_text:
-                                            continue
-                                        
-                                        retour = RetourData()
-                                        for col in data_columns:
-                                            if col in df_with_header.columns:
-                                                value = row[col]
-                                                setattr(retour, col, str(value) if pd.notna(value) else "")
-                                        self.retour_file_data.append(retour)
-                                        loaded_count += 1
-                                        
-                                        if loaded_count <= 3:
-                                            print(f"DEBUG: Loaded retour reference record {loaded_count}: Chassis={chassis_val}")
-                                            
-                                    except Exception as e:
-                                        print(f"DEBUG: Error processing retour row {index}: {e}")
-                                        continue
-                                
-                                print(f"DEBUG: Successfully loaded {loaded_count} retour reference records from header-found section")
-                            else:
-                                raise ValueError("Colonnes Retour non trouvées dans le fichier de référence")
-                        else:
-                            raise ValueError("En-tête des colonnes Retour non trouvé dans le fichier de référence")
-                            
-                    except Exception as search_error:
-                        print(f"Erreur lors de la recherche des colonnes retour: {search_error}")
-                        messagebox.showerror("Error", f"Impossible de trouver les colonnes Retour dans le fichier: {search_error}")
-                        return                self.update_reference_panel()
-                messagebox.showinfo("Success", f"Fichier retour chargé: {len(self.retour_file_data)} enregistrements de référence")
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Erreur lors du chargement du fichier retour: {str(e)}")
+            self.load_reference_file(filename, "Retour")
     
     def load_sortie_file_for_retour(self):
         """Load sortie file data to use as reference when in retour mode"""
@@ -3797,158 +3622,54 @@ CUKI I 06/2025"""
             filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
         )
         if filename:
-            try:
-                df = pd.read_excel(filename)
-                self.sortie_file_data = []
-                
-                # Expected columns for sortie data
-                data_columns = ['Date', 'Heure', 'DESIGNATION', 'N_CHASSIS', 'ID_CLIENT', 'NOM_PRENOM', 'WILAYA']
-                title_keyword = "SORTIE"
-                
-                print(f"DEBUG: Loading Sortie reference file with {len(df)} rows")
-                print(f"DEBUG: Available columns: {list(df.columns)}")
-                
-                # Première tentative: vérifier si les colonnes sont directement dans le DataFrame
-                found = all(col in df.columns for col in data_columns)
-                
-                if found:
-                    # Colonnes trouvées directement - charger les données avec logique améliorée
-                    loaded_count = 0
-                    for index, row in df.iterrows():
-                        try:
-                            # Vérifier d'abord si nous avons un chassis valide
-                            chassis_val = str(row['N_CHASSIS']) if pd.notna(row['N_CHASSIS']) else ""
-                            
-                            # Skip if no chassis value or if it's too short
-                            if not chassis_val or chassis_val.strip() == "" or chassis_val == "nan":
-                                continue
-                            
-                            if len(chassis_val.strip()) < 3:
-                                continue
-                            
-                            # Skip obvious header/title rows
-                            row_text = " ".join([str(val) for val in row.values if pd.notna(val)]).upper()
-                            if (title_keyword in row_text and "LIVRAISON" in row_text) or "N_CHASSIS" in row_text:
-                                continue
-                            
-                            sortie = SortieData()
-                            for col in data_columns:
-                                value = row[col]
-                                setattr(sortie, col, str(value) if pd.notna(value) else "")
-                            self.sortie_file_data.append(sortie)
-                            loaded_count += 1
-                            
-                            if loaded_count <= 3:
-                                print(f"DEBUG: Loaded sortie reference record {loaded_count}: Chassis={chassis_val}")
-                                
-                        except Exception as e:
-                            print(f"DEBUG: Error processing sortie row {index}: {e}")
-                            continue
-                    
-                    print(f"DEBUG: Successfully loaded {loaded_count} sortie reference records")
-                    
-                else:
-                    # Colonnes non trouvées - chercher dans le contenu du fichier
-                    try:
-                        # Lire le fichier ligne par ligne pour trouver l'en-tête des colonnes
-                        raw_df = pd.read_excel(filename, header=None)
-                        header_row_index = None
-                        
-                        # Chercher la ligne qui contient toutes nos colonnes attendues
-                        for index, row in raw_df.iterrows():
-                            row_values = [str(val).strip() if pd.notna(val) else "" for val in row.values]
-                            # Vérifier si cette ligne contient nos colonnes (au moins 4 sur 7)
-                            matches = sum(1 for col in data_columns if col in row_values)
-                            if matches >= 4:  # Au moins 4 colonnes trouvées
-                                header_row_index = index
-                                break
-                        
-                        if header_row_index is not None:
-                            # Relire le fichier avec l'en-tête trouvé
-                            df_with_header = pd.read_excel(filename, header=header_row_index)
-                            # Vérifier que nous avons maintenant les bonnes colonnes
-                            found_columns = [col for col in data_columns if col in df_with_header.columns]
-                            
-                            if len(found_columns) >= 4:  # Au moins 4 colonnes trouvées
-                                loaded_count = 0
-                                for index, row in df_with_header.iterrows():
-                                    try:
-                                        # Vérifier d'abord si nous avons un chassis valide
-                                        chassis_val = ""
-                                        if 'N_CHASSIS' in df_with_header.columns:
-                                            chassis_val = str(row['N_CHASSIS']) if pd.notna(row['N_CHASSIS']) else ""
-                                        
-                                        # Skip if no chassis value or if it's too short
-                                        if not chassis_val or chassis_val.strip() == "" or chassis_val == "nan":
-                                            continue
-                                        
-                                        if len(chassis_val.strip()) < 3:
-                                            continue
-                                        
-                                        # Skip obvious header/title rows
-                                        row_text = " ".join([str(val) for val in row.values if pd.notna(val)]).upper()
-                                        if (title_keyword in row_text and "LIVRAISON" in row_text) or "N_CHASSIS" in row_text:
-                                            continue
-                                        
-                                        sortie = SortieData()
-                                        for col in data_columns:
-                                            if col in df_with_header.columns:
-                                                value = row[col]
-                                                setattr(sortie, col, str(value) if pd.notna(value) else "")
-                                        self.sortie_file_data.append(sortie)
-                                        loaded_count += 1
-                                        
-                                        if loaded_count <= 3:
-                                            print(f"DEBUG: Loaded sortie reference record {loaded_count}: Chassis={chassis_val}")
-                                            
-                                    except Exception as e:
-                                        print(f"DEBUG: Error processing sortie row {index}: {e}")
-                                        continue
-                                
-                                print(f"DEBUG: Successfully loaded {loaded_count} sortie reference records from header-found section")
-                            else:
-                                raise ValueError("Colonnes Sortie non trouvées dans le fichier de référence")
-                        else:
-                            raise ValueError("En-tête des colonnes Sortie non trouvé dans le fichier de référence")
-                            
-                    except Exception as search_error:
-                        print(f"Erreur lors de la recherche des colonnes sortie: {search_error}")
-                        messagebox.showerror("Error", f"Impossible de trouver les colonnes Sortie dans le fichier: {search_error}")
-                        return
-                
-                self.update_reference_panel()
-                messagebox.showinfo("Success", f"Fichier sortie chargé: {len(self.sortie_file_data)} enregistrements de référence")
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Erreur lors du chargement du fichier sortie: {str(e)}")
+            self.load_reference_file(filename, "Sortie")
     
-    def update_sortie_retour_history(self, chassis_number, action):
-        """Update the sortie/retour history for chronological tracking"""
-        from datetime import datetime
+    def load_reference_file(self, filename, file_type):
+        """Load a Sortie or Retour file as reference for the chronological checks"""
+        try:
+            start = time.perf_counter()
+            records, timestamps = read_movement_file(filename, file_type)
+        except MovementColumnsNotFound as search_error:
+            print(f"Erreur lors de la recherche des colonnes {file_type.lower()}: {search_error}")
+            messagebox.showerror("Error", f"Impossible de trouver les colonnes {file_type} dans le fichier: {search_error}")
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"Erreur lors du chargement du fichier {file_type.lower()}: {str(e)}")
+            return
         
-        if chassis_number not in self.sortie_retour_history:
-            self.sortie_retour_history[chassis_number] = []
+        if file_type == "Sortie":
+            self.sortie_file_data = records
+            self.movement_store.load_file(ACTION_SORTIE, records, timestamps)
+        else:
+            self.retour_file_data = records
+            self.movement_store.load_file(ACTION_RETOUR, records, timestamps)
+        print(f"DEBUG: Loaded {len(records)} {file_type.lower()} reference records "
+              f"in {time.perf_counter() - start:.2f} s")
         
-        timestamp = datetime.now()
-        self.sortie_retour_history[chassis_number].append((timestamp, action))
+        self.update_reference_panel()
+        messagebox.showinfo("Success", f"Fichier {file_type.lower()} chargé: {len(records)} enregistrements de référence")
+    
+    def record_saved_movements(self, filename, mode, rows, replace):
+        """Sortie/Retour rows written to a session file become movements (save worker or journal thread)
 
-    def remove_from_sortie_retour_history(self, chassis_number, action):
-        """Remove the most recent action from sortie/retour history when an item is deleted"""
-        if chassis_number in self.sortie_retour_history:
-            history = self.sortie_retour_history[chassis_number]
-            if history:
-                # Find and remove the most recent entry with the matching action
-                for i in range(len(history) - 1, -1, -1):
-                    timestamp, hist_action = history[i]
-                    if hist_action == action:
-                        del history[i]
-                        print(f"DEBUG: Removed {action} action for chassis {chassis_number} from history")
-                        break
-                
-                # If no history remains for this chassis, remove the key
-                if not history:
-                    del self.sortie_retour_history[chassis_number]
-                    print(f"DEBUG: Removed chassis {chassis_number} from history completely")
+        rows: (file row, values in field order) of the rows written; replace:
+        the whole file was written. Scans that were never saved leave no movement.
+        """
+        if mode not in ("Sortie", "Retour"):
+            return
+        action = ACTION_SORTIE if mode == "Sortie" else ACTION_RETOUR
+        positions = [record_columns(mode).index(column) for column in MOVEMENT_COLUMNS]
+        try:
+            self.movement_store.record_saved(
+                filename, action, ((row, *[values[position] for position in positions]) for row, values in rows),
+                replace)
+        except Exception as e:
+            print(f"Warning: Could not record the movements of {os.path.basename(filename)}: {e}")
+
+    def on_journal_saved(self, filename, records, mode):
+        """The journal's compaction wrote the whole session file (journal thread)"""
+        values_of = attrgetter(*record_columns(mode))
+        self.record_saved_movements(filename, mode, enumerate(map(values_of, records), MOVEMENT_HEADER_ROW + 1), True)
 
     def show_reference_panel(self):
         """Show a panel displaying loaded reference data (sortie/retour files)"""
@@ -4061,6 +3782,9 @@ CUKI I 06/2025"""
         tree_frame.columnconfigure(0, weight=1)
         tree_frame.rowconfigure(0, weight=1)
         
+        # Chassis index, same as the main table search (built on the first search)
+        chassis_index = TrigramIndex(columns=('N_CHASSIS', 'Num_Chasse'))
+        
         # Function to update tree with search
         def update_tree():
             # Clear existing items
@@ -4068,9 +3792,13 @@ CUKI I 06/2025"""
                 tree.delete(item)
             
             search_text = search_var.get().lower()
+            hits = None
+            if len(search_text) >= MIN_QUERY_LENGTH:
+                chassis_index.ensure(data_list)
+                hits = chassis_index.search(search_text)
             
             # Add filtered data
-            for record in data_list:
+            for record in (data_list if hits is None else hits.values()):
                 # Check if search matches N_CHASSIS
                 chassis_val = getattr(record, 'N_CHASSIS', '') or getattr(record, 'Num_Chasse', '')
                 if search_text and search_text not in chassis_val.lower():
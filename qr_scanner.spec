@@ -11,9 +11,9 @@ a = Analysis(
         'PIL', 'PIL._tkinter_finder', 'tkinter', 'tkinter.ttk', 
         'pandas', 'openpyxl', 'requests', 'qrcode', 
         'win32print', 'win32ui', 'win32con',
-        'tkinter.messagebox', 'tkinter.filedialog',
+        'tkinter.messagebox', 'tkinter.filedialog', 'tkinter.simpledialog', 'queue', 'serial',
         'PIL.Image', 'PIL.ImageTk', 'PIL.ImageDraw',
-        'dataclasses', 'datetime', 'threading',
+        'dataclasses', 'datetime', 'threading', 'sqlite3',
         'subprocess', 'shutil', 'logging'
     ],
     hookspath=[],
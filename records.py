@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Record types shared by the Mouvement Stock and Préparation Commandes apps
+"""
+
+import itertools
+from dataclasses import dataclass, fields
+from operator import attrgetter
+
+# Data type names used by both applications
+MODE_ENTREE = "Entrée"
+MODE_SORTIE = "Sortie"
+MODE_RETOUR = "Retour"
+MODE_COMMANDE = "Commande"
+
+class SearchableRecord:
+    """Base of the record dataclasses: what the tables' text search looks at
+    and which fields repeat (dictionary-encoded by columnar.ColumnStore)"""
+
+    search_columns = None  # Fields in the 'All Fields' text (None: all fields)
+    search_separator = "\n"  # Cannot be typed in a search box: no match across fields
+    categorical_columns = ()  # Fields with few distinct values in a session
+
+_search_layouts = {}  # Record class -> (attrgetter of its fields, positions in the blob)
+
+def _search_cache(record):
+    """[field values, lowercase texts, blob], rebuilt only when a field value changed"""
+    layout = _search_layouts.get(type(record))
+    if layout is None:
+        names = [field.name for field in fields(record)]
+        columns = record.search_columns or names
+        layout = _search_layouts[type(record)] = (attrgetter(*names), [names.index(column) for column in columns])
+    values = layout[0](record)
+    cached = record.__dict__.get('_search')
+    if cached is None or cached[0] != values:
+        texts = tuple([str(value or "").lower() for value in values])
+        cached = record.__dict__['_search'] = [values, texts, None]
+    return cached, layout[1]
+
+def search_fields(record):
+    """Lowercase text of every field, in field order (cached until the record changes)"""
+    return _search_cache(record)[0][1]
+
+def search_blob(record):
+    """Lowercase text searched by 'All Fields' (cached until the record changes)"""
+    cached, positions = _search_cache(record)
+    if cached[2] is None:
+        texts = cached[1]
+        cached[2] = record.search_separator.join([texts[position] for position in positions])
+    return cached[2]
+
+@dataclass
+class ProductData(SearchableRecord):
+    """Data structure for product information - Entrée type"""
+    categorical_columns = ('Fournisseur', 'Designation', 'Couleur', 'Lot', 'Magasin', 'Relation')
+    Reference: str = ""
+    Fournisseur: str = ""
+    Designation: str = ""
+    Num_Chasse: str = ""
+    Couleur: str = ""
+    Lot: str = ""
+    Magasin: str = ""  # Will be left blank
+    Relation: str = ""
+
+@dataclass
+class SortieData(SearchableRecord):
+    """Data structure for sortie information - Sortie type"""
+    categorical_columns = ('Date', 'Heure', 'DESIGNATION', 'WILAYA')  # Clients are nearly unique
+    Date: str = ""
+    Heure: str = ""
+    DESIGNATION: str = "MOTOS"
+    N_CHASSIS: str = ""
+    ID_CLIENT: str = ""
+    NOM_PRENOM: str = ""
+    WILAYA: str = ""
+
+@dataclass
+class RetourData(SearchableRecord):
+    """Data structure for retour information - Retour type"""
+    categorical_columns = ('Date', 'Heure', 'DESIGNATION', 'WILAYA')  # Clients are nearly unique
+    Date: str = ""
+    Heure: str = ""
+    DESIGNATION: str = "MOTOS"
+    N_CHASSIS: str = ""
+    ID_CLIENT: str = ""
+    NOM_PRENOM: str = ""
+    WILAYA: str = ""
+
+@dataclass
+class OrderData(SearchableRecord):
+    """Data structure for order preparation information"""
+    search_columns = ('DATE', 'ID', 'DESIGNATION', 'REFERENCE')
+    search_separator = " "
+    categorical_columns = ('DATE', 'ID', 'DESIGNATION')
+    DATE: str = ""
+    ID: str = ""
+    DESIGNATION: str = ""
+    REFERENCE: str = ""
+    QTE: int = 1
+    PREPARED: bool = False
+
+# Record class for each data type
+RECORD_CLASSES = {
+    MODE_ENTREE: ProductData,
+    MODE_SORTIE: SortieData,
+    MODE_RETOUR: RetourData,
+    MODE_COMMANDE: OrderData,
+}
+
+def data_type_of(record_class):
+    """Data type of a record class (or of a subclass, such as a column store view)"""
+    for cls in record_class.__mro__:
+        for mode, mode_class in RECORD_CLASSES.items():
+            if cls is mode_class:
+                return mode
+    raise KeyError(record_class.__name__)
+
+def record_key(record):
+    """Key used for duplicate detection (Reference, N_CHASSIS or (REFERENCE, ID))"""
+    if isinstance(record, ProductData):
+        return record.Reference
+    if isinstance(record, OrderData):
+        return (record.REFERENCE, record.ID)
+    return record.N_CHASSIS
+
+_row_ids = itertools.count(1)
+
+def new_row_id():
+    return f"R{next(_row_ids)}"
+
+def row_id(record):
+    """Stable identity of a record, used as its Treeview iid (assigned on first use)
+
+    Kept outside the dataclass fields, so it is not compared, shown or saved.
+    Rows of a ColumnStore keep theirs in the store (ColumnStore.row_ids).
+    """
+    iid = getattr(record, '_row_id', None)
+    if iid is None:
+        iid = record._row_id = new_row_id()
+    return iid
+
+class RecordIndex:
+    """Number of records per duplicate key, kept in sync with a record list
+
+    Makes duplicate checks O(1); every mutation of the list must go through
+    add/extend/remove/replace/update (or rebuild after a bulk load). Other
+    structures over the same list (search_index.TrigramIndex,
+    table_sort.TableSorter, journal.ScanJournal) can be attached as
+    followers to get the same mutations.
+    """
+
+    def __init__(self, records=(), followers=()):
+        self.counts = {}
+        self.followers = list(followers)
+        self.extend(records)
+
+    def _count(self, key, delta):
+        count = self.counts.get(key, 0) + delta
+        if count <= 0:
+            self.counts.pop(key, None)
+        else:
+            self.counts[key] = count
+
+    def add(self, record):
+        self._count(record_key(record), 1)
+        for follower in self.followers:
+            follower.add(record)
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def remove(self, record):
+        self._count(record_key(record), -1)
+        for follower in self.followers:
+            follower.remove(record)
+
+    def replace(self, old_record, new_record):
+        """A record was edited or swapped for another one"""
+        self._count(record_key(old_record), -1)
+        self._count(record_key(new_record), 1)
+        for follower in self.followers:
+            follower.replace(old_record, new_record)
+
+    def update(self, record):
+        """A record was modified in place without changing its key (client filled in, ...)"""
+        for follower in self.followers:
+            follower.update(record)
+
+    def rebuild(self, records):
+        self.clear()
+        for record in records:
+            key = record_key(record)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def clear(self):
+        self.counts = {}
+        for follower in self.followers:
+            follower.clear()  # Rebuilt on their next use
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+class OrderIndex:
+    """Orders by (REFERENCE, ID) and by DATE, kept in sync with an order list
+
+    Each group is a dict keyed by row id (insertion ordered), so add, remove
+    and lookups are O(1). An order must be removed before its REFERENCE, ID
+    or DATE is edited, and added back afterwards; other in-place changes
+    (QTE, PREPARED) are reported with update. Followers get the same
+    mutations, as with RecordIndex.
+    """
+
+    def __init__(self, orders=(), followers=()):
+        self.by_key = {}  # (REFERENCE, ID) -> {row id: order}
+        self.by_date = {}  # DATE -> {row id: order}
+        self.followers = list(followers)
+        self.extend(orders)
+
+    def add(self, order):
+        self._index(order)
+        for follower in self.followers:
+            follower.add(order)
+
+    def extend(self, orders):
+        for order in orders:
+            self.add(order)
+
+    def remove(self, order):
+        iid = row_id(order)
+        for groups, key in ((self.by_key, record_key(order)), (self.by_date, order.DATE)):
+            group = groups.get(key)
+            if group is not None:
+                group.pop(iid, None)
+                if not group:
+                    del groups[key]
+        for follower in self.followers:
+            follower.remove(order)
+
+    def update(self, order):
+        """QTE or PREPARED of an order changed in place"""
+        for follower in self.followers:
+            follower.update(order)
+
+    def rebuild(self, orders):
+        """Index a new order list (followers are cleared, as with RecordIndex)"""
+        self.clear()
+        for order in orders:
+            self._index(order)
+
+    def _index(self, order):
+        iid = row_id(order)
+        self.by_key.setdefault(record_key(order), {})[iid] = order
+        self.by_date.setdefault(order.DATE, {})[iid] = order
+
+    def clear(self):
+        self.by_key = {}
+        self.by_date = {}
+        for follower in self.followers:
+            follower.clear()
+
+    def find(self, reference, client_id):
+        """First order with this reference and client (None if there is none)"""
+        group = self.by_key.get((reference, client_id))
+        return next(iter(group.values())) if group else None
+
+    def orders_on(self, date):
+        """Orders of a DATE, in insertion order"""
+        return list(self.by_date.get(date, {}).values())
+
+    def __len__(self):
+        return sum(len(group) for group in self.by_key.values())
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Background saving of the session file
+Excel writes run on a worker thread so scanning stays live while a large
+file is written. A save is prepared on the UI thread (a copy of what has
+to be written), written on the worker, and its progress and outcome are
+reported back on the UI thread with root.after. Saves requested while one
+is running coalesce into a single next save, prepared when the running
+one completes so it includes every change made meanwhile.
+"""
+
+import threading
+import time
+
+# Minimum delay between two progress reports (seconds)
+PROGRESS_INTERVAL = 0.2
+
+class SaveWorker:
+    """Runs one save at a time off the UI thread
+
+    request(prepare, done, progress): prepare() runs on the UI thread and
+    returns a task (None: nothing to write), task(report) runs on the
+    worker and returns a result, then done(result, error) runs on the UI
+    thread (error is None on success). The task may call report(count,
+    total); progress gets the reports on the UI thread. All methods are
+    for the UI thread.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.running = False
+        self.pending = None  # (prepare, done, progress) of the next save
+        self.thread = None
+
+    def request(self, prepare, done, progress=None):
+        """Start a save, or merge it with the one waiting; returns False if it waits"""
+        if self.running:
+            self.pending = (prepare, done, progress)
+            return False
+        self._start(prepare, done, progress)
+        return True
+
+    def busy(self):
+        return self.running or self.pending is not None
+
+    def wait(self):
+        """Let the running write finish (on exit; the waiting save is dropped)"""
+        if self.thread is not None:
+            self.thread.join()
+
+    def _start(self, prepare, done, progress):
+        try:
+            task = prepare()
+        except Exception as e:
+            done(None, e)
+            return
+        if task is None:
+            return  # Nothing to write any more
+        self.running = True
+        self.thread = threading.Thread(target=self._run, args=(task, done, progress),
+                                       name="SaveWorker", daemon=True)
+        self.thread.start()
+
+    def _run(self, task, done, progress):
+        last_report = [0.0]
+
+        def report(count, total):
+            now = time.monotonic()
+            if progress is not None and now - last_report[0] >= PROGRESS_INTERVAL:
+                last_report[0] = now
+                self._post(lambda: progress(count, total))
+
+        result, error = None, None
+        try:
+            result = task(report)
+        except Exception as e:
+            error = e
+        self._post(lambda: self._finished(done, result, error))
+
+    def _post(self, callback):
+        try:
+            self.root.after(0, callback)
+        except Exception as e:  # Window already closed
+            print(f"Save worker: {e}")
+
+    def _finished(self, done, result, error):
+        self.running = False
+        try:
+            done(result, error)
+        finally:
+            if self.pending is not None:
+                pending, self.pending = self.pending, None
+                self._start(*pending)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Scan pipeline tracking
+Every scan is a ticket moving through explicit stages; tickets wait in a
+bounded queue, and the time spent reaching each stage is averaged so the
+status bar can show where the time goes (parsing, client API, validation)
+"""
+
+import time
+from collections import deque
+
+# Stages, in pipeline order
+STAGE_RECEIVED = "received"
+STAGE_PARSED = "parsed"
+STAGE_ENRICHED = "enriched"
+STAGE_VALIDATED = "validated"
+STAGE_COMMITTED = "committed"
+STAGE_REJECTED = "rejected"
+
+STAGES = (STAGE_RECEIVED, STAGE_PARSED, STAGE_ENRICHED, STAGE_VALIDATED,
+          STAGE_COMMITTED, STAGE_REJECTED)
+FINAL_STAGES = (STAGE_COMMITTED, STAGE_REJECTED)
+
+# Short labels for the status bar
+STAGE_LABELS = {
+    STAGE_PARSED: "analyse",
+    STAGE_ENRICHED: "client",
+    STAGE_VALIDATED: "validation",
+    STAGE_COMMITTED: "ajout",
+}
+
+# Scans waiting beyond this are refused (back-pressure)
+DEFAULT_QUEUE_SIZE = 200
+
+class ScanTicket:
+    """One scan and the time at which it reached each stage"""
+
+    def __init__(self, ticket_id, payload, clock=time.monotonic):
+        self.id = ticket_id
+        self.payload = payload
+        self.clock = clock
+        self.stage = STAGE_RECEIVED
+        self.reason = None
+        self.times = {STAGE_RECEIVED: clock()}
+        self.last_time = self.times[STAGE_RECEIVED]
+
+    def advance(self, stage, reason=None):
+        """Move to a stage; returns the seconds spent since the previous one"""
+        now = self.clock()
+        elapsed = now - self.last_time
+        self.stage = stage
+        self.times[stage] = now
+        self.last_time = now
+        if reason is not None:
+            self.reason = reason
+        return elapsed
+
+    @property
+    def done(self):
+        return self.stage in FINAL_STAGES
+
+    def __repr__(self):
+        return f"ScanTicket({self.id}, {self.stage})"
+
+class StageStats:
+    """Rolling average of the time needed to reach each stage"""
+
+    def __init__(self, window=50):
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.counts = {stage: 0 for stage in STAGES}
+
+    def record(self, stage, elapsed):
+        self.samples[stage].append(elapsed)
+        self.counts[stage] += 1
+
+    def latency_ms(self, stage):
+        """Average latency of a stage in ms (None without samples)"""
+        samples = self.samples[stage]
+        if not samples:
+            return None
+        return sum(samples) * 1000.0 / len(samples)
+
+    def summary(self):
+        """'analyse 1 ms · client 340 ms · ...' for the stages seen so far"""
+        parts = []
+        for stage, label in STAGE_LABELS.items():
+            latency = self.latency_ms(stage)
+            if latency is not None:
+                parts.append(f"{label} {latency:.0f} ms")
+        return " · ".join(parts)
+
+class ScanQueue:
+    """Bounded FIFO of scan tickets, with per-stage statistics"""
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.tickets = deque()
+        self.stats = StageStats()
+        self.next_id = 1
+        self.refused = 0
+
+    def put(self, payload):
+        """Queue a scan; returns its ticket, or None when the queue is full"""
+        if self.full():
+            self.refused += 1
+            return None
+        ticket = ScanTicket(self.next_id, payload, self.clock)
+        self.next_id += 1
+        self.tickets.append(ticket)
+        return ticket
+
+    def get(self):
+        """Next ticket to process (None if empty)"""
+        return self.tickets.popleft() if self.tickets else None
+
+    def advance(self, ticket, stage, reason=None):
+        """Move a ticket to a stage and record the latency"""
+        if ticket is None or ticket.done:
+            return
+        self.stats.record(stage, ticket.advance(stage, reason))
+
+    def full(self):
+        return len(self.tickets) >= self.maxsize
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def status_text(self):
+        """Queue depth and stage latencies for the status bar"""
+        text = f"File: {len(self.tickets)}/{self.maxsize}"
+        if self.refused:
+            text += f" ({self.refused} refusé(s))"
+        summary = self.stats.summary()
+        if summary:
+            text += f"  |  {summary}"
+        return text
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Direct scanner device readers
+Read a serial/USB-CDC scanner (or a pty / named pipe standing in for one) or a
+Linux evdev HID scanner in a background thread, and push complete payloads
+onto a queue drained by the Tk loop
+
+Optional dependencies (not in requirements.txt, install only for the device used):
+- pyserial: serial / USB-CDC ports (required on Windows); ptys and named
+  pipes are read without it
+- evdev: HID scanners under /dev/input (Linux)
+"""
+
+import codecs
+import os
+import queue
+import stat
+import sys
+import threading
+
+from scanner_input import ScanBuffer, DEFAULT_GAP_MS
+
+# Optional dependencies
+try:
+    import serial  # pyserial
+except ImportError:
+    serial = None
+
+try:
+    import evdev
+except ImportError:
+    evdev = None
+
+class ScannerDeviceReader(threading.Thread):
+    """Base reader: subclasses implement open_device(), read_chunk() and close_device()"""
+
+    def __init__(self, path, output_queue, suffix="\r", gap_ms=DEFAULT_GAP_MS):
+        super().__init__(daemon=True, name=f"scanner-reader:{path}")
+        self.path = path
+        self.output_queue = output_queue
+        self.buffer = ScanBuffer(suffix, gap_ms, min_length=1)  # Only scans, no typing
+        self.poll_interval = self.buffer.gap
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def open_device(self):
+        raise NotImplementedError
+
+    def read_chunk(self, timeout):
+        """Return the text read within timeout ('' if nothing arrived)"""
+        raise NotImplementedError
+
+    def close_device(self):
+        pass
+
+    def stop(self):
+        """Ask the thread to stop (returns once the current read times out)"""
+        self.stop_event.set()
+
+    def push(self, payload):
+        """Queue a payload, waiting while the queue is full (back-pressure on the device)"""
+        while payload and not self.stop_event.is_set():
+            try:
+                self.output_queue.put(payload, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        try:
+            self.open_device()
+        except Exception as e:
+            self.error = e
+            print(f"Scanner device {self.path}: cannot open ({e})")
+            return
+        print(f"Scanner device {self.path}: reading")
+        try:
+            while not self.stop_event.is_set():
+                text = self.read_chunk(self.poll_interval)
+                if text:
+                    for payload in self.buffer.feed_text(text):
+                        self.push(payload)
+                elif self.buffer.remaining() == 0:
+                    # Idle for the inter-character gap: the scan is complete
+                    self.push(self.buffer.take())
+        except Exception as e:
+            self.error = e
+            print(f"Scanner device {self.path}: read error ({e})")
+        finally:
+            self.push(self.buffer.take())
+            self.close_device()
+            print(f"Scanner device {self.path}: closed")
+
+class SerialScannerReader(ScannerDeviceReader):
+    """Serial / USB-CDC scanner; pyserial when available, raw file reads otherwise (pty, named pipe)"""
+
+    def __init__(self, path, output_queue, suffix="\r", gap_ms=DEFAULT_GAP_MS,
+                 baudrate=9600, encoding='utf-8'):
+        super().__init__(path, output_queue, suffix, gap_ms)
+        self.baudrate = baudrate
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors='ignore')
+        self.port = None
+        self.fd = None
+
+    def open_device(self):
+        if serial is not None and not self._is_plain_file():
+            self.port = serial.Serial(self.path, self.baudrate, timeout=self.poll_interval)
+            return
+        if sys.platform.startswith('win'):
+            raise RuntimeError("pyserial est requis pour lire un port série sous Windows")
+        self._open_fd()
+
+    def _is_plain_file(self):
+        # Named pipes and ptys are read directly, real ports go through pyserial
+        try:
+            mode = os.stat(self.path).st_mode
+        except OSError:
+            return False
+        return stat.S_ISFIFO(mode) or self.path.startswith('/dev/pts/')
+
+    def _open_fd(self):
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        if os.isatty(self.fd):
+            import tty
+            tty.setraw(self.fd)  # No line buffering or echo on a tty
+
+    def read_chunk(self, timeout):
+        if self.port is not None:
+            data = self.port.read(self.port.in_waiting or 1)
+        else:
+            import select
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return ""
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return ""
+            if not data:
+                # Writer closed the named pipe: wait for the next one
+                os.close(self.fd)
+                self._open_fd()
+                self.stop_event.wait(timeout)
+                return ""
+        return self.decoder.decode(data)
+
+    def close_device(self):
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+# US keyboard layout: evdev key name -> (char, shifted char)
+EVDEV_KEYMAP = {
+    'KEY_1': ('1', '!'), 'KEY_2': ('2', '@'), 'KEY_3': ('3', '#'), 'KEY_4': ('4', '$'),
+    'KEY_5': ('5', '%'), 'KEY_6': ('6', '^'), 'KEY_7': ('7', '&'), 'KEY_8': ('8', '*'),
+    'KEY_9': ('9', '('), 'KEY_0': ('0', ')'), 'KEY_MINUS': ('-', '_'), 'KEY_EQUAL': ('=', '+'),
+    'KEY_LEFTBRACE': ('[', '{'), 'KEY_RIGHTBRACE': (']', '}'), 'KEY_SEMICOLON': (';', ':'),
+    'KEY_APOSTROPHE': ("'", '"'), 'KEY_GRAVE': ('`', '~'), 'KEY_BACKSLASH': ('\\', '|'),
+    'KEY_COMMA': (',', '<'), 'KEY_DOT': ('.', '>'), 'KEY_SLASH': ('/', '?'),
+    'KEY_SPACE': (' ', ' '), 'KEY_TAB': ('\t', '\t'), 'KEY_ENTER': ('\r', '\r'),
+    'KEY_KPENTER': ('\r', '\r'),
+}
+for _letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+    EVDEV_KEYMAP[f'KEY_{_letter}'] = (_letter.lower(), _letter)
+
+class EvdevScannerReader(ScannerDeviceReader):
+    """Linux HID scanner read through evdev (grabbed, so keystrokes do not reach the desktop)"""
+
+    def __init__(self, path, output_queue, suffix="\r", gap_ms=DEFAULT_GAP_MS):
+        super().__init__(path, output_queue, suffix, gap_ms)
+        self.device = None
+        self.shift = False
+
+    def open_device(self):
+        if evdev is None:
+            raise RuntimeError("le module 'evdev' est requis pour lire un scanner HID")
+        self.device = evdev.InputDevice(self.path)
+        self.device.grab()
+
+    def read_chunk(self, timeout):
+        import select
+        ready, _, _ = select.select([self.device.fd], [], [], timeout)
+        if not ready:
+            return ""
+        chars = []
+        for event in self.device.read():
+            if event.type != evdev.ecodes.EV_KEY:
+                continue
+            key_event = evdev.categorize(event)
+            keycode = key_event.keycode
+            if isinstance(keycode, list):
+                keycode = keycode[0]
+            if keycode in ('KEY_LEFTSHIFT', 'KEY_RIGHTSHIFT'):
+                self.shift = key_event.keystate != key_event.key_up
+            elif key_event.keystate == key_event.key_down and keycode in EVDEV_KEYMAP:
+                chars.append(EVDEV_KEYMAP[keycode][1 if self.shift else 0])
+        return ''.join(chars)
+
+    def close_device(self):
+        if self.device is not None:
+            try:
+                self.device.ungrab()
+            except Exception:
+                pass
+            self.device.close()
+            self.device = None
+
+def open_scanner_reader(path, output_queue, suffix="\r", gap_ms=DEFAULT_GAP_MS, **kwargs):
+    """Create (not started) the reader matching the device path"""
+    if path.startswith('/dev/input/'):
+        return EvdevScannerReader(path, output_queue, suffix, gap_ms)
+    return SerialScannerReader(path, output_queue, suffix, gap_ms, **kwargs)
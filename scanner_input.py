@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental scanner input buffer
+Accumulates the characters sent by a barcode scanner (douchette) and detects
+the end of a payload from the configured suffix or from the inter-character gap.
+Slower input is taken for typing and completes after a longer idle time.
+The suffix completes a scan as soon as it arrives; other line breaks are
+kept in the payload
+"""
+
+import time
+
+# Scanner suffix options (label -> terminator character)
+SCANNER_SUFFIXES = {
+    "Aucun": None,
+    "CR": "\r",
+    "LF": "\n",
+    "TAB": "\t",
+}
+
+# Default idle gap (ms) after which a scan without suffix is considered complete.
+# Scanners send characters a few ms apart, much faster than a person types.
+DEFAULT_GAP_MS = 80
+
+# Shortest burst completed by the gap: a person can type a few keys as fast
+# as a scanner, so shorter bursts followed by a pause are typing
+MIN_SCAN_LENGTH = 8
+
+# Idle time (ms) that completes typed input without suffix
+TYPING_IDLE_MS = 250
+
+# Tk keysyms that do not carry their character in event.char on every platform
+KEYSYM_CHARS = {
+    "Return": "\r",
+    "KP_Enter": "\r",
+    "Tab": "\t",
+}
+
+class ScanBuffer:
+    """Append-only buffer for one scan at a time"""
+
+    def __init__(self, suffix=None, gap_ms=DEFAULT_GAP_MS, clock=time.monotonic, min_length=MIN_SCAN_LENGTH):
+        self.suffix = suffix
+        self.gap = gap_ms / 1000.0
+        self.min_length = min_length  # 1: no typing (input read from a scanner device)
+        self.typing_idle = TYPING_IDLE_MS / 1000.0
+        self.clock = clock
+        self.chars = []
+        self.last_time = None  # Time of the last character (its key event time when given)
+        self.last_seen = None  # clock() when it was fed
+        self.typed = False  # A pause inside the buffer: typed by hand
+
+    def configure(self, suffix=None, gap_ms=None):
+        """Change the suffix and/or the inter-character gap"""
+        self.suffix = suffix
+        if gap_ms is not None:
+            self.gap = gap_ms / 1000.0
+
+    def feed(self, char, timestamp=None):
+        """Add one character; returns a completed payload or None
+
+        The suffix completes the scan at once. A new character arriving after
+        the gap completes the previous scan (returned; the character starts
+        the next one) if it was a burst of at least MIN_SCAN_LENGTH
+        characters (min_length); otherwise the input is typing and stays in
+        the buffer.
+        timestamp (seconds) is when the key was pressed, e.g. the Tk event
+        time, so a busy UI handling the keys late does not split a scan.
+        """
+        now = self.clock()
+        at = now if timestamp is None else timestamp
+        completed = None
+        if self.chars and at - self.last_time >= self.gap:
+            if not self.typed and len(self.chars) >= self.min_length:
+                completed = self.take() or None
+            else:
+                self.typed = True
+        self.last_time, self.last_seen = at, now
+        if self.suffix is not None and char == self.suffix:
+            return completed or self.take() or None
+        # Line breaks inside a payload are kept as '\n'
+        self.chars.append('\n' if char == '\r' else char)
+        return completed
+
+    def feed_text(self, text):
+        """Add several characters at once (paste, device read); returns completed payloads"""
+        payloads = []
+        for char in text:
+            payload = self.feed(char)
+            if payload:
+                payloads.append(payload)
+        return payloads
+
+    def backspace(self):
+        """Remove the last character (manual correction)"""
+        if self.chars:
+            self.chars.pop()
+
+    def remaining(self):
+        """Seconds left before the current buffer is complete by idle time (0 if already due)"""
+        if not self.chars:
+            return None
+        if not self.typed and len(self.chars) >= self.min_length:
+            idle = self.gap
+        else:
+            idle = self.typing_idle
+        return max(0.0, idle - (self.clock() - self.last_seen))
+
+    def take(self):
+        """Return the buffered payload (stripped) and reset the buffer"""
+        payload = ''.join(self.chars).strip()
+        self.chars = []
+        self.typed = False
+        return payload
+
+    def __len__(self):
+        return len(self.chars)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Trigram substring index over record field values
+Used by the main table search and the reference panel's chassis search:
+instead of testing every record, a query looks up the values holding its
+rarest trigram and only checks those
+"""
+
+import gc
+import threading
+from array import array
+from dataclasses import fields
+
+from records import row_id, search_fields
+
+# Shortest query the index can answer (shorter ones scan the records)
+MIN_QUERY_LENGTH = 3
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class TrigramIndex:
+    """Substring search over the lowercase field values of a record list
+
+    Each distinct (field, value) is indexed once by trigram and lists the
+    rows holding it, so repeated values (dates, designations, clients,
+    wilayas) cost almost nothing and the index grows with the number of
+    distinct values. Same update methods as RecordIndex; the index is built
+    on the first search (ensure, or build_in_background for large lists) and
+    kept up to date afterwards.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = columns  # Field names to index (None: all fields)
+        self.built = False
+        self.clear()
+
+    def clear(self):
+        """Drop the index; the next ensure() rebuilds it"""
+        self.built = False
+        self.value_ids = {}  # (field position, text) -> value id
+        self.values = {}  # value id -> (field position, text)
+        self.value_rows = {}  # value id -> {row id: record}
+        self.grams = {}  # trigram -> array of value ids (ids of dropped values are skipped)
+        self.row_values = {}  # row id -> value ids of the record
+        self.next_value_id = 0
+        self.dropped = 0
+        self.positions = {}  # Record class -> indexed field positions
+        self.pending = None  # (row id, record or None if removed) received during a background build
+
+    def ensure(self, records):
+        """Build the index from the record list if it is not built yet"""
+        if not self.built:
+            self.rebuild(records)
+
+    def rebuild(self, records):
+        self.clear()
+        self.built = True
+        for record in records:
+            self._add(record)
+
+    def build_in_background(self, records, after):
+        """Build the index on a worker thread if it is not built or building
+
+        after is root.after: the built index is installed on the UI thread.
+        Meanwhile search() returns None (callers scan the records) and the
+        updates are kept, then applied to the new index.
+        """
+        if self.built or self.pending is not None:
+            return
+        records = list(records)
+        for record in records:
+            row_id(record)  # Assigned here, the worker only reads them
+        pending = self.pending = []
+        index = TrigramIndex(self.columns)
+        index.built = True
+
+        def build():
+            # The index holds no reference cycles: without this, the collections
+            # triggered by its allocations pause the UI thread for up to a second
+            collecting = gc.isenabled()
+            gc.disable()
+            try:
+                for record in records:
+                    try:
+                        index._add(record)
+                    except (AttributeError, KeyError):
+                        pass  # Removed from the list while read (its removal is pending)
+            finally:
+                if collecting:
+                    gc.enable()
+            try:
+                after(0, lambda: self._install(index, pending))
+            except Exception as e:  # Window already closed
+                print(f"Search index: {e}")
+        threading.Thread(target=build, name="TrigramIndex", daemon=True).start()
+
+    def _install(self, index, pending):
+        if pending is not self.pending:
+            return  # Cleared or rebuilt since the build started
+        self.__dict__.update(index.__dict__)
+        for iid, record in pending:
+            if record is None:
+                self._remove(iid)
+            else:
+                self._add(record)
+
+    # --- Updates (ignored until the index is built, kept while it builds) ---
+
+    def add(self, record):
+        if self.built:
+            self._add(record)
+        elif self.pending is not None:
+            self.pending.append((row_id(record), record))
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def remove(self, record):
+        if self.built:
+            self._remove(row_id(record))
+        elif self.pending is not None:
+            self.pending.append((row_id(record), None))
+
+    def replace(self, old_record, new_record):
+        """A record was edited or swapped for another one"""
+        self.remove(old_record)
+        self.add(new_record)
+
+    def update(self, record):
+        """A record was modified in place (client filled in, ...)"""
+        self.add(record)
+
+    def _field_positions(self, record):
+        positions = self.positions.get(type(record))
+        if positions is None:
+            names = [field.name for field in fields(record)]
+            columns = names if self.columns is None else [name for name in names if name in self.columns]
+            positions = self.positions[type(record)] = [names.index(column) for column in columns]
+        return positions
+
+    def _add(self, record):
+        iid = row_id(record)
+        if iid in self.row_values:
+            self._remove(iid)
+        texts = search_fields(record)
+        value_ids = []
+        for position in self._field_positions(record):
+            text = texts[position]
+            if not text:
+                continue
+            key = (position, text)
+            value_id = self.value_ids.get(key)
+            if value_id is None:
+                value_id = self.value_ids[key] = self.next_value_id
+                self.next_value_id += 1
+                self.values[value_id] = key
+                self.value_rows[value_id] = {}
+                for gram in trigrams(text):
+                    postings = self.grams.get(gram)
+                    if postings is None:
+                        postings = self.grams[gram] = array('l')
+                    postings.append(value_id)
+            self.value_rows[value_id][iid] = record
+            value_ids.append(value_id)
+        self.row_values[iid] = value_ids
+
+    def _remove(self, iid):
+        for value_id in self.row_values.pop(iid, ()):
+            rows = self.value_rows[value_id]
+            rows.pop(iid, None)
+            if not rows:
+                # Last row with this value: drop it (its postings are skipped from now on)
+                del self.value_rows[value_id]
+                del self.value_ids[self.values.pop(value_id)]
+                self.dropped += 1
+        if self.dropped > len(self.values) + 1000:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the postings without the dropped values"""
+        live = self.values
+        for gram, postings in list(self.grams.items()):
+            kept = array('l', (value_id for value_id in postings if value_id in live))
+            if kept:
+                self.grams[gram] = kept
+            else:
+                del self.grams[gram]
+        self.dropped = 0
+
+    # --- Queries ---
+
+    def search(self, text, field=None):
+        """{row id: record} of the records containing text (lowercase)
+
+        In all indexed fields, or only in the field at position field.
+        Returns None when text is too short for the index or the index is
+        not built yet.
+        """
+        if len(text) < MIN_QUERY_LENGTH or not self.built:
+            return None
+        candidates = None
+        for gram in trigrams(text):
+            postings = self.grams.get(gram)
+            if postings is None:
+                return {}
+            if candidates is None or len(postings) < len(candidates):
+                candidates = postings
+        found = {}
+        values = self.values
+        for value_id in candidates:
+            value = values.get(value_id)
+            if value is not None and (field is None or value[0] == field) and text in value[1]:
+                found.update(self.value_rows[value_id])
+        return found
+
+    def __len__(self):
+        return len(self.row_values)
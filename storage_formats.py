@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+File formats of the session files, chosen by extension
+xlsx keeps the Excel layout of each data type (title row of Sortie/Retour,
+incremental saves); CSV, Parquet and SQLite hold a plain table with one
+column per field, for the scripts that read the daily files. Parquet needs
+pyarrow (or fastparquet), used through pandas; without either it is not
+offered in the file dialogs.
+"""
+
+import csv
+import os
+import sqlite3
+from dataclasses import fields
+
+import pandas as pd
+
+from columnar import ColumnTable
+from records import MODE_ENTREE, MODE_SORTIE, MODE_RETOUR, MODE_COMMANDE, RECORD_CLASSES
+from excel_io import (write_records_workbook, iter_entree_file, iter_movement_file, read_order_file,
+                      record_columns, record_rows, MissingColumnsError, PROGRESS_ROWS)
+
+class StorageFormatError(Exception):
+    """A file cannot be read or written in its format"""
+
+# Texts read as True in a boolean column (text formats)
+TRUE_TEXTS = ("true", "1", "vrai", "oui")
+
+def _csv_dtypes(mode):
+    """read_csv dtype of each field of a data type (booleans are read as text)"""
+    return {field.name: "Int64" if field.type in (int, 'int') else str
+            for field in fields(RECORD_CLASSES[mode])}
+
+def _csv_values(column, field):
+    """Field values of a read_csv column (empty cells take the field default)"""
+    if field.type in (bool, 'bool'):
+        return column.fillna("").str.strip().str.lower().isin(TRUE_TEXTS).tolist()
+    if field.type in (int, 'int'):
+        return [int(value) for value in column.fillna(field.default)]
+    return column.fillna("").tolist()
+
+def _records(mode, rows):
+    """Records of a data type from value tuples in field order"""
+    record_class = RECORD_CLASSES[mode]
+    for values in rows:
+        yield record_class(*values)
+
+def _check_columns(found, mode):
+    missing = [column for column in record_columns(mode) if column not in found]
+    if missing:
+        raise MissingColumnsError(missing)
+
+class StorageFormat:
+    """A file format: read(filename, mode) -> records, write(filename, records, mode, progress)"""
+    name = ""
+    extensions = ()
+    patchable = False  # Saves can patch the file in place (excel_io.IncrementalSaver)
+
+    def available(self):
+        """Whether the libraries of the format are installed (offered in the file dialogs)"""
+        return True
+
+    def read(self, filename, mode):
+        raise NotImplementedError
+
+    def write(self, filename, records, mode, progress=None):
+        """Write records (a ColumnStore, a RowSnapshot or records) in place of the file; returns the row count"""
+        raise NotImplementedError
+
+class XlsxFormat(StorageFormat):
+    name = "Excel"
+    extensions = (".xlsx", ".xls")
+    patchable = True
+
+    def read(self, filename, mode):
+        if mode == MODE_ENTREE:
+            return iter_entree_file(filename)
+        if mode == MODE_COMMANDE:
+            return read_order_file(filename)
+        return iter_movement_file(filename, mode)
+
+    def write(self, filename, records, mode, progress=None):
+        return write_records_workbook(filename, records, mode, progress)
+
+class CsvFormat(StorageFormat):
+    """UTF-8, comma separated, header row of field names"""
+    name = "CSV"
+    extensions = (".csv",)
+
+    def read(self, filename, mode):
+        try:
+            header = pd.read_csv(filename, nrows=0, encoding='utf-8-sig').columns
+        except pd.errors.EmptyDataError:
+            header = []
+        _check_columns(header, mode)
+        # Typed on read: text stays text (no type guessing, leading zeros kept)
+        df = pd.read_csv(filename, encoding='utf-8-sig', usecols=record_columns(mode),
+                         dtype=_csv_dtypes(mode), keep_default_na=False, na_values=[""])
+        record_class = RECORD_CLASSES[mode]
+        return ColumnTable(record_class, [_csv_values(df[field.name], field) for field in fields(record_class)])
+
+    def write(self, filename, records, mode, progress=None):
+        columns = record_columns(mode)
+        total = len(records) if hasattr(records, '__len__') else None
+        count = 0
+        with open(filename, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(columns)
+            for row in record_rows(records, columns):
+                writer.writerow(row)
+                count += 1
+                if progress is not None and count % PROGRESS_ROWS == 0:
+                    progress(count, total)
+        return count
+
+class ParquetFormat(StorageFormat):
+    name = "Parquet"
+    extensions = (".parquet",)
+
+    def available(self):
+        try:
+            pd.io.parquet.get_engine('auto')
+        except ImportError:
+            return False
+        return True
+
+    def _check_engine(self):
+        if not self.available():
+            raise StorageFormatError("pyarrow (ou fastparquet) est requis pour les fichiers Parquet")
+
+    def read(self, filename, mode):
+        self._check_engine()
+        df = pd.read_parquet(filename)
+        _check_columns(df.columns, mode)
+        # Column lists give Python values (numpy int64/bool_ do not fit the session columns)
+        return ColumnTable(RECORD_CLASSES[mode], [df[column].tolist() for column in record_columns(mode)])
+
+    def write(self, filename, records, mode, progress=None):
+        self._check_engine()
+        columns = record_columns(mode)
+        df = pd.DataFrame(list(record_rows(records, columns)), columns=columns)
+        df.to_parquet(filename, index=False)
+        return len(df)
+
+# SQLite table of each data type
+SQLITE_TABLES = {
+    MODE_ENTREE: "entree",
+    MODE_SORTIE: "sortie",
+    MODE_RETOUR: "retour",
+    MODE_COMMANDE: "commandes",
+}
+
+_SQLITE_TYPES = {int: "INTEGER", 'int': "INTEGER", bool: "INTEGER", 'bool': "INTEGER"}
+
+class SqliteFormat(StorageFormat):
+    """One table per data type (SQLITE_TABLES), one column per field"""
+    name = "SQLite"
+    extensions = (".sqlite", ".sqlite3", ".db")
+
+    def read(self, filename, mode):
+        table = SQLITE_TABLES[mode]
+        connection = sqlite3.connect(filename)
+        try:
+            found = [row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')]
+            if not found:
+                raise StorageFormatError(f"Table '{table}' introuvable dans {os.path.basename(filename)}")
+            _check_columns(found, mode)
+            columns = ", ".join(f'"{column}"' for column in record_columns(mode))
+            rows = connection.execute(f'SELECT {columns} FROM "{table}" ORDER BY rowid').fetchall()
+        finally:
+            connection.close()
+        booleans = [index for index, field in enumerate(fields(RECORD_CLASSES[mode]))
+                    if field.type in (bool, 'bool')]
+        if booleans:
+            # Stored as 0/1
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for index in booleans:
+                    row[index] = bool(row[index])
+        return _records(mode, rows)
+
+    def write(self, filename, records, mode, progress=None):
+        table = SQLITE_TABLES[mode]
+        names = record_columns(mode)
+        columns = ", ".join(f'"{field.name}" {_SQLITE_TYPES.get(field.type, "TEXT")}'
+                            for field in fields(RECORD_CLASSES[mode]))
+        connection = sqlite3.connect(filename)
+        try:
+            with connection:
+                connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+                connection.execute(f'CREATE TABLE "{table}" ({columns})')
+                cursor = connection.executemany(
+                    f'INSERT INTO "{table}" VALUES ({", ".join("?" * len(names))})',
+                    record_rows(records, names))
+                count = cursor.rowcount
+        finally:
+            connection.close()
+        return count
+
+FORMATS = [XlsxFormat(), CsvFormat(), ParquetFormat(), SqliteFormat()]
+
+def format_for(filename):
+    """Format of a file, by extension (xlsx for unknown extensions, as before)"""
+    extension = os.path.splitext(filename)[1].lower()
+    for storage_format in FORMATS:
+        if extension in storage_format.extensions:
+            return storage_format
+    return FORMATS[0]
+
+def read_records(filename, mode):
+    """Records of a file of a data type (iterable)"""
+    return format_for(filename).read(filename, mode)
+
+def write_records(filename, records, mode, progress=None):
+    """Write records to a file in the format of its extension; returns the row count"""
+    return format_for(filename).write(filename, records, mode, progress)
+
+def is_patchable(filename):
+    return format_for(filename).patchable
+
+# filedialog filetypes: one entry per installed format (save), all of them first (open)
+FILE_TYPES = ([(storage_format.name, " ".join(f"*{extension}" for extension in storage_format.extensions))
+               for storage_format in FORMATS if storage_format.available()]
+              + [("All files", "*.*")])
+OPEN_FILE_TYPES = [("Tous les formats", " ".join(pattern for _, pattern in FILE_TYPES[:-1]))] + FILE_TYPES
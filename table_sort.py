@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Model-side table sorting
+Columns sort on typed keys (Date+Heure as timestamps, quantities as
+integers, text without case or accents). The sorted order of each column
+is cached and kept up to date as records are added, edited or removed, so
+re-sorting after a scan or a search does not sort the whole list again
+"""
+
+import unicodedata
+from bisect import bisect_left
+from datetime import datetime
+from itertools import count
+
+from movement_ledger import try_parse_movement_datetime
+from records import row_id
+
+# Keys are (rank, value): values that do not parse sort after the others, as text
+_VALID = 0
+_INVALID = 1
+
+def text_key(value):
+    """Case and accent insensitive text ('Étoile' sorts with 'etoile')"""
+    text = str(value or "")
+    if not text.isascii():
+        text = "".join(char for char in unicodedata.normalize('NFKD', text)
+                       if not unicodedata.combining(char))
+    return text.casefold()
+
+def movement_time_key(record):
+    """Date column of Sortie/Retour: Date + Heure as a timestamp"""
+    timestamp = try_parse_movement_datetime(str(record.Date or ""), str(record.Heure or ""))
+    if timestamp is None:
+        return (_INVALID, text_key(record.Date), text_key(record.Heure))
+    return (_VALID, timestamp)
+
+def hour_key(record):
+    try:
+        hour = datetime.strptime(str(record.Heure or ""), "%H:%M")
+        return (_VALID, hour.hour * 60 + hour.minute)
+    except ValueError:
+        return (_INVALID, text_key(record.Heure))
+
+def order_date_key(record):
+    """DATE column of Préparation Commandes (JJ/MM/AAAA)"""
+    try:
+        return (_VALID, datetime.strptime(str(record.DATE or ""), "%d/%m/%Y"))
+    except ValueError:
+        return (_INVALID, text_key(record.DATE))
+
+def integer_key(column):
+    def key(record):
+        value = getattr(record, column, "")
+        try:
+            return (_VALID, int(value))
+        except (TypeError, ValueError):
+            return (_INVALID, text_key(value))
+    return key
+
+def column_key(column):
+    """Key function record -> sort key of a table column"""
+    if column == 'Date':
+        return movement_time_key
+    if column == 'Heure':
+        return hour_key
+    if column == 'DATE':
+        return order_date_key
+    if column in ('QTE', 'PREPARED'):
+        return integer_key(column)
+    return lambda record: (_VALID, text_key(getattr(record, column, "")))
+
+class SortedColumn:
+    """Row ids of a column in ascending key order, updated one row at a time"""
+
+    def __init__(self, key):
+        self.key = key
+        self.entries = []  # (key, sequence) ascending; sequence makes entries unique
+        self.iids = []  # Row ids, parallel to entries
+        self.keyed = {}  # Row id -> its entry
+        self.sequence = count()
+
+    def build(self, records):
+        """Order of exactly these records (rows of an earlier build are dropped)"""
+        self.keyed = {}
+        entries = []
+        for record in records:
+            iid = row_id(record)
+            entry = self.keyed[iid] = (self.key(record), next(self.sequence))
+            entries.append((entry, iid))
+        entries.sort()
+        self.entries = [entry for entry, _ in entries]
+        self.iids = [iid for _, iid in entries]
+
+    def add(self, record):
+        iid = row_id(record)
+        if iid in self.keyed:
+            self.remove(iid)
+        entry = self.keyed[iid] = (self.key(record), next(self.sequence))
+        position = bisect_left(self.entries, entry)
+        self.entries.insert(position, entry)
+        self.iids.insert(position, iid)
+
+    def remove(self, iid):
+        entry = self.keyed.pop(iid, None)
+        if entry is not None:
+            position = bisect_left(self.entries, entry)
+            del self.entries[position]
+            del self.iids[position]
+
+    def __contains__(self, iid):
+        return iid in self.keyed
+
+    def __len__(self):
+        return len(self.iids)
+
+class TableSorter:
+    """Sort state of a table and the cached order of each sorted column
+
+    Follows the record list like RecordIndex (add/extend/remove/replace/
+    update/clear); the order of a column is built the first time it is
+    sorted and kept up to date afterwards.
+    """
+
+    def __init__(self):
+        self.column = None  # Sorted column (None: list order)
+        self.reverse = False
+        self.columns = {}  # Column -> SortedColumn
+
+    def sort_by(self, column):
+        """Heading clicked: sort by this column, or reverse it if already sorted"""
+        if column == self.column:
+            self.reverse = not self.reverse
+        else:
+            self.column = column
+            self.reverse = False
+
+    def reset(self):
+        """Back to list order (columns changed)"""
+        self.column = None
+        self.reverse = False
+        self.clear()
+
+    def order(self, iids, record_of):
+        """The shown row ids in sorted order; record_of(iid) -> record"""
+        if self.column is None:
+            return iids
+        sorted_column = self.columns.get(self.column)
+        if sorted_column is None:
+            sorted_column = self.columns[self.column] = SortedColumn(column_key(self.column))
+            sorted_column.build([record_of(iid) for iid in iids])
+        else:
+            missing = [iid for iid in iids if iid not in sorted_column]
+            if len(missing) > len(sorted_column):
+                # Mostly new rows: one sort is cheaper than many insertions
+                sorted_column.build([record_of(iid) for iid in iids])
+            else:
+                for iid in missing:
+                    sorted_column.add(record_of(iid))
+        if len(iids) == len(sorted_column):
+            ordered = list(sorted_column.iids)
+        else:
+            shown = set(iids)
+            ordered = [iid for iid in sorted_column.iids if iid in shown]
+        if self.reverse:
+            ordered.reverse()
+        return ordered
+
+    # --- Following the record list ---
+
+    def add(self, record):
+        for sorted_column in self.columns.values():
+            sorted_column.add(record)
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def remove(self, record):
+        iid = row_id(record)
+        for sorted_column in self.columns.values():
+            sorted_column.remove(iid)
+
+    def replace(self, old_record, new_record):
+        self.remove(old_record)
+        self.add(new_record)
+
+    def update(self, record):
+        """A record was modified in place"""
+        self.add(record)
+
+    def clear(self):
+        """Drop the cached orders (rebuilt on the next sort)"""
+        self.columns = {}
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Serial scanner reader on a pty, without hardware (python -m pytest test_scanner_device.py)"""
+
+import os
+import queue
+import time
+
+import pytest
+
+pty = pytest.importorskip("pty")  # Unix only
+import termios
+
+from scanner_device import open_scanner_reader
+
+def collect(payloads, count, timeout=2.0):
+    """Wait for count payloads from the reader queue"""
+    received = []
+    deadline = time.monotonic() + timeout
+    while len(received) < count and time.monotonic() < deadline:
+        try:
+            received.append(payloads.get(timeout=0.05))
+        except queue.Empty:
+            pass
+    return received
+
+@pytest.fixture
+def pty_reader():
+    master, slave = pty.openpty()
+    payloads = queue.Queue()
+    reader = open_scanner_reader(os.ttyname(slave), payloads, "\r", 80)
+    reader.start()
+    # The reader switches the pty to raw mode (discarding pending input) once opened
+    deadline = time.monotonic() + 2.0
+    while termios.tcgetattr(slave)[3] & termios.ICANON and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield master, payloads, reader
+    reader.stop()
+    reader.join(2)
+    os.close(master)
+    os.close(slave)
+
+def test_suffix_and_gap_complete_scans(pty_reader):
+    master, payloads, reader = pty_reader
+    os.write(master, b"*VMS123*\rMOTO\nLINE2\r")
+    assert collect(payloads, 2) == ["*VMS123*", "MOTO\nLINE2"]
+    # No suffix: the inter-character gap completes the scan
+    os.write(master, "CHÉ1".encode('utf-8'))
+    assert collect(payloads, 1) == ["CHÉ1"]
+    assert reader.error is None
+
+def test_character_split_across_reads(pty_reader):
+    master, payloads, reader = pty_reader
+    data = "ÉTÉ\r".encode('utf-8')
+    os.write(master, data[:1])
+    time.sleep(0.02)
+    os.write(master, data[1:])
+    assert collect(payloads, 1) == ["ÉTÉ"]
+
+def test_stop_flushes_and_ends_thread(pty_reader):
+    master, payloads, reader = pty_reader
+    reader.stop()
+    reader.join(2)
+    assert not reader.is_alive()
+    assert payloads.empty()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Sorted table order across searches (python -m pytest test_table_sort.py)"""
+
+from records import RecordIndex, SortieData, row_id
+from table_sort import TableSorter
+
+def make_rows(designation, count, start):
+    return [SortieData(DESIGNATION=designation, N_CHASSIS=f"C{start + i:04d}") for i in range(count)]
+
+def test_sort_then_filter_then_refilter():
+    sorter = TableSorter()
+    index = RecordIndex(followers=(sorter,))
+    rows_a = make_rows("A", 3, 0)
+    rows_b = make_rows("B", 10, 100)
+    index.extend(rows_a + rows_b)
+    records = {row_id(record): record for record in rows_a + rows_b}
+    ids_a = [row_id(record) for record in rows_a]
+    ids_b = [row_id(record) for record in rows_b]
+
+    sorter.sort_by('N_CHASSIS')
+    assert sorter.order(ids_a, records.__getitem__) == ids_a
+    # More new rows than cached ones: the column is rebuilt over the "B" rows only
+    assert sorter.order(ids_b, records.__getitem__) == ids_b
+    assert sorter.order(ids_a, records.__getitem__) == ids_a
+    assert sorter.order(ids_a + ids_b, records.__getitem__) == ids_a + ids_b
+
+def test_remove_after_rebuild():
+    sorter = TableSorter()
+    index = RecordIndex(followers=(sorter,))
+    rows_a = make_rows("A", 3, 0)
+    rows_b = make_rows("B", 10, 100)
+    index.extend(rows_a + rows_b)
+    records = {row_id(record): record for record in rows_a + rows_b}
+    ids_a = [row_id(record) for record in rows_a]
+    ids_b = [row_id(record) for record in rows_b]
+
+    sorter.sort_by('N_CHASSIS')
+    sorter.order(ids_a, records.__getitem__)
+    sorter.order(ids_b, records.__getitem__)
+    index.remove(rows_a[0])
+    del records[ids_a[0]]
+    assert sorter.order(ids_a[1:] + ids_b, records.__getitem__) == ids_a[1:] + ids_b
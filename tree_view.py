@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Diff-based Treeview refresh
+The apps describe the rows to show (iid, values, tags) and TreeSync applies
+only the inserts, updates, deletes and moves needed to get there, so a new
+scan is a single tree.insert instead of clearing and refilling the table
+"""
+
+from tkinter import ttk
+
+# Search boxes refresh the table once typing pauses this long
+SEARCH_DEBOUNCE_MS = 250
+
+class TreeSync:
+    """Keeps a flat ttk.Treeview in line with a list of rows"""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.rows = {}  # iid -> (values, tags) as last set on the tree
+
+    def sync(self, rows):
+        """Show rows, a list of (iid, values, tags) in display order
+
+        Returns (inserted, updated, deleted, moved) counts.
+        """
+        tree = self.tree
+        target = [iid for iid, _, _ in rows]
+        wanted = set(target)
+
+        # Read the actual order in case items were moved outside of sync
+        current = [iid for iid in tree.get_children('') if iid in self.rows]
+        deleted = [iid for iid in current if iid not in wanted]
+        if deleted:
+            tree.delete(*deleted)
+            for iid in deleted:
+                del self.rows[iid]
+
+        # Existing items first get the relative order they have in the target
+        moved = 0
+        remaining = [iid for iid in current if iid in wanted]
+        ordered = [iid for iid in target if iid in self.rows]
+        if remaining != ordered:
+            # The prefix already in place stays, the rest is moved in target order
+            start = next(position for position, (shown, iid) in enumerate(zip(remaining, ordered))
+                         if shown != iid)
+            for position in range(start, len(ordered)):
+                tree.move(ordered[position], '', position)
+            moved = len(ordered) - start
+
+        # Then new items are inserted at their position; children before
+        # each position already match the target
+        inserted = updated = 0
+        for position, (iid, values, tags) in enumerate(rows):
+            shown = self.rows.get(iid)
+            if shown is None:
+                tree.insert('', position, iid=iid, values=values, tags=tags)
+                inserted += 1
+            elif shown != (values, tags):
+                tree.item(iid, values=values, tags=tags)
+                updated += 1
+            else:
+                continue
+            self.rows[iid] = (values, tags)
+        return inserted, updated, len(deleted), moved
+
+    def clear(self):
+        children = self.tree.get_children('')
+        if children:
+            self.tree.delete(*children)
+        self.rows = {}
+
+# Fallbacks when the Treeview style does not tell
+DEFAULT_ROW_HEIGHT = 20
+DEFAULT_HEADING_HEIGHT = 25
+
+class VirtualTable:
+    """Treeview showing a scrolling window over any number of rows
+
+    Only the visible rows exist as Treeview items: the model gives the row
+    ids in display order and a render(iid) -> (values, tags) function, and
+    each scroll re-renders the window through TreeSync. The selection is
+    kept by row id, so rows stay selected when scrolled out of view.
+    """
+
+    def __init__(self, tree, scrollbar, row_height=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.sync = TreeSync(tree)
+        self.iids = []  # Row ids in display order
+        self.positions = {}  # Row id -> position in iids
+        self.render = lambda iid: ((), ())
+        self.top = 0
+        self.visible = int(tree.cget('height'))
+        self.row_height = row_height or self._style_row_height()
+        self.selected = set()
+
+        scrollbar.configure(command=self.yview)
+        tree.configure(yscrollcommand=lambda *args: None)  # Scrolling is done here
+        tree.bind('<Configure>', self.on_configure, add='+')
+        tree.bind('<MouseWheel>', self.on_mousewheel, add='+')
+        tree.bind('<Button-4>', lambda event: self.scroll(-3), add='+')
+        tree.bind('<Button-5>', lambda event: self.scroll(3), add='+')
+        tree.bind('<Button-1>', self.on_click, add='+')
+        tree.bind('<<TreeviewSelect>>', self.on_select, add='+')
+        tree.bind('<Up>', lambda event: self.move_focus(-1))
+        tree.bind('<Down>', lambda event: self.move_focus(1))
+        tree.bind('<Prior>', lambda event: self.move_focus(-self.visible))
+        tree.bind('<Next>', lambda event: self.move_focus(self.visible))
+
+    def _style_row_height(self):
+        try:
+            return int(ttk.Style(self.tree).lookup('Treeview', 'rowheight') or DEFAULT_ROW_HEIGHT)
+        except (ValueError, TypeError):
+            return DEFAULT_ROW_HEIGHT
+
+    # --- Model ---
+
+    def set_rows(self, iids, render):
+        """Show these row ids (display order); render(iid) -> (values, tags)"""
+        self.iids = list(iids)
+        self.positions = {iid: position for position, iid in enumerate(self.iids)}
+        self.render = render
+        self.selected &= self.positions.keys()
+        self.refresh()
+
+    def selection(self):
+        """Selected row ids in display order, visible or not"""
+        return tuple(sorted(self.selected, key=self.positions.__getitem__))
+
+    def values(self, iid):
+        return self.render(iid)[0]
+
+    def __len__(self):
+        return len(self.iids)
+
+    # --- Window ---
+
+    def refresh(self):
+        """Render the visible window (after a scroll or a change of the shown rows)"""
+        count = len(self.iids)
+        self.top = max(0, min(self.top, count - self.visible))
+        window = self.iids[self.top:self.top + self.visible]
+        self.sync.sync([(iid,) + tuple(self.render(iid)) for iid in window])
+        shown = tuple(iid for iid in window if iid in self.selected)
+        if shown != self.tree.selection():
+            self.tree.selection_set(shown)
+        if count:
+            self.scrollbar.set(self.top / count, (self.top + len(window)) / count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, rows):
+        self.top += rows
+        self.refresh()
+        return "break"
+
+    def see(self, iid):
+        """Scroll so that a row is visible"""
+        position = self.positions.get(iid)
+        if position is None:
+            return
+        if position < self.top:
+            self.top = position
+        elif position >= self.top + self.visible:
+            self.top = position - self.visible + 1
+        else:
+            return
+        self.refresh()
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.iids))
+            self.refresh()
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self.scroll(step * self.visible if args[2] == 'pages' else step)
+
+    # --- Events ---
+
+    def on_configure(self, event):
+        visible = max(1, (event.height - DEFAULT_HEADING_HEIGHT) // self.row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.refresh()
+
+    def on_mousewheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def on_click(self, event):
+        # Plain click on a row replaces the selection, including rows out of view
+        if self.tree.identify_region(event.x, event.y) != 'heading' and not event.state & 0x0005:  # Shift or Control
+            self.selected = set()
+
+    def on_select(self, event):
+        window = self.sync.rows.keys()
+        self.selected = {iid for iid in self.selected if iid not in window} | set(self.tree.selection())
+
+    def move_focus(self, step):
+        """Arrow/page keys: move the selection, scrolling past the window edges"""
+        if not self.iids:
+            return "break"
+        position = self.positions.get(self.tree.focus(), self.top)
+        position = max(0, min(position + step, len(self.iids) - 1))
+        iid = self.iids[position]
+        self.selected = {iid}
+        self.see(iid)
+        self.refresh()
+        self.tree.focus(iid)
+        return "break"